@@ -0,0 +1,301 @@
+"""Batch processing of several images, optionally on a pool of worker processes.
+
+Every worker prepares the mask once when it starts and then processes the
+images it receives. Results are returned in the same order as the input
+paths, and an image that fails is reported in its result instead of
+stopping the whole batch.
+"""
+import multiprocessing
+from functools import partial
+
+from cloudcoverindex.engine import segment, segment_stack
+from cloudcoverindex.masks import load_mask
+from cloudcoverindex.packed import save_segmentation
+from cloudcoverindex.pipeline import run_pipeline
+from cloudcoverindex.profiling import stage
+from cloudcoverindex.rawframes import is_raw_frame, load_frame_file
+from cloudcoverindex.results import ImageResult, describe_error
+from cloudcoverindex.resultcache import hash_file, result_key
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Number of frames decoded into a stack before it is segmented
+STACK_SIZE = 16
+
+# Mask prepared by the worker initializer, shared by every image the worker processes
+_worker_mask = None
+# Width and height of the raw frames the worker processes
+_worker_frame_size = None
+
+
+def process_image(path, mask, save_path=None, profiler=None, frame_size=None):
+    """Processes a single image, catching any error.
+
+    :param path: path to the image file, or to an uncompressed frame, see cloudcoverindex.rawframes
+    :type path: str
+    :param mask: The mask to apply.
+    :type mask: PreparedMask
+    :param save_path: optional path to save the segmented image at, a segmentation file if it ends with .cci
+    :type save_path: str
+    :param profiler: optional profiler recording the stages of the processing
+    :type profiler: Profiler
+    :param frame_size: width and height of raw frames
+    :type frame_size: tuple
+    :rtype: ImageResult
+    """
+    try:
+        segmentation = segment(*load_frame_file(path, mask, frame_size=frame_size, profiler=profiler), mask=mask,
+                               profiler=profiler)
+        if save_path is not None:
+            with stage(profiler, "save"):
+                save_segmentation(segmentation, save_path, mask)
+        return ImageResult(path, segmentation.cloud_pixels, segmentation.total_pixels, save_path=save_path)
+    except Exception as error:
+        return ImageResult(path, error=describe_error(error))
+
+
+def process_stacked(paths, mask, stack_size=STACK_SIZE, frame_size=None):
+    """Processes several images that share a mask as stacks of frames, yielding their results in input order.
+    Up to stack_size frames are decoded into one contiguous array, reused for every
+    stack, and segmented at once by engine.segment_stack. Only the pixel counts are
+    computed. Without numpy every image is processed on its own instead.
+
+    :param paths: paths to the image files
+    :type paths: list
+    :param mask: The mask to apply.
+    :type mask: PreparedMask
+    :param stack_size: maximum number of frames segmented at once
+    :type stack_size: int
+    :param frame_size: width and height of raw frames
+    :type frame_size: tuple
+    :return: An iterator of ImageResult.
+    """
+    if stack_size < 1:
+        raise ValueError("Stack size must be at least 1")
+    if np is None:
+        for path in paths:
+            yield process_image(path, mask, frame_size=frame_size)
+        return
+    width, height = mask.size
+    stack = None
+    paths = list(paths)
+    for start in range(0, len(paths), stack_size):
+        chunk = paths[start:start + stack_size]
+        if stack is None:
+            stack = np.empty((min(stack_size, len(paths)), height, width, 3), dtype=np.uint8)
+        # Frames that can't be decoded are left out of the stack and reported on their own
+        errors = [None] * len(chunk)
+        decoded = 0
+        for i, path in enumerate(chunk):
+            try:
+                stack[decoded] = load_frame_file(path, mask, frame_size=frame_size)[0]
+                decoded += 1
+            except Exception as error:
+                errors[i] = describe_error(error)
+        counts = iter(segment_stack(stack[:decoded], mask) if decoded else [])
+        for path, error in zip(chunk, errors):
+            if error is not None:
+                yield ImageResult(path, error=error)
+            else:
+                yield ImageResult(path, *next(counts))
+
+
+def process_images(paths, mask_path, downscale_factor=1, fast_downscale=False, jobs=1, save_paths=None,
+                   decode_threads=2, prefetch=4, write_queue=4, cache=None, profiler=None, frame_size=None):
+    """Processes several images, yielding their results in input order.
+    With a single job the images go through the prefetching pipeline of
+    cloudcoverindex.pipeline, which overlaps decoding, computing and saving.
+
+    When a result cache is given, images whose result is cached aren't decoded
+    at all, unless they have to be saved, and new results are stored in it.
+
+    When a profiler is given the images are processed one at a time in this
+    process, whatever the number of jobs, so that the stages don't overlap.
+
+    :param paths: paths to the image files, or to uncompressed frames, see cloudcoverindex.rawframes
+    :type paths: list
+    :param mask_path: path to the mask image file
+    :type mask_path: str
+    :param downscale_factor: factor to downscale the images by
+    :type downscale_factor: int
+    :param fast_downscale: downscale while decoding and with a box filter instead of LANCZOS
+    :type fast_downscale: bool
+    :param jobs: number of worker processes, 1 processes the images in this process
+    :type jobs: int
+    :param save_paths: optional paths to save each segmented image at, None entries aren't saved
+    :type save_paths: list
+    :param decode_threads: number of threads decoding images when running a single job
+    :type decode_threads: int
+    :param prefetch: maximum number of images decoded ahead when running a single job
+    :type prefetch: int
+    :param write_queue: maximum number of segmented images waiting to be saved when running a single job
+    :type write_queue: int
+    :param cache: optional cache of results
+    :type cache: ResultCache
+    :param profiler: optional profiler recording the stages of the processing
+    :type profiler: Profiler
+    :param frame_size: width and height of raw frames
+    :type frame_size: tuple
+    :return: An iterator of ImageResult.
+    """
+    if jobs < 1:
+        raise ValueError("Number of jobs must be at least 1")
+    paths = list(paths)
+    if save_paths is None:
+        save_paths = [None] * len(paths)
+    options = dict(downscale_factor=downscale_factor, fast_downscale=fast_downscale, jobs=jobs,
+                   decode_threads=decode_threads, prefetch=prefetch, write_queue=write_queue, profiler=profiler,
+                   frame_size=frame_size)
+    if cache is None:
+        yield from _process_images(paths, mask_path, save_paths, **options)
+        return
+
+    try:
+        mask_hash = hash_file(mask_path)
+    except OSError:
+        # The error is reported for every image when the mask is loaded
+        yield from _process_images(paths, mask_path, save_paths, **options)
+        return
+
+    keys = []
+    cached = {}
+    for i, (path, save_path) in enumerate(zip(paths, save_paths)):
+        try:
+            key = result_key(hash_file(path), mask_hash, downscale_factor, fast_downscale,
+                             frame_size=frame_size if is_raw_frame(path) else None)
+        except OSError:
+            key = None
+        keys.append(key)
+        counts = cache.get(key) if key is not None and save_path is None else None
+        if counts is not None:
+            cached[i] = ImageResult(path, *counts, cached=True)
+
+    missing = [i for i in range(len(paths)) if i not in cached]
+    results = _process_images([paths[i] for i in missing], mask_path, [save_paths[i] for i in missing], **options)
+    for i in range(len(paths)):
+        if i in cached:
+            yield cached[i]
+            continue
+        result = next(results)
+        if result.ok and keys[i] is not None:
+            cache.put(keys[i], result.cloud_pixels, result.total_pixels)
+        yield result
+
+
+def _process_images(paths, mask_path, save_paths, downscale_factor, fast_downscale, jobs, decode_threads, prefetch,
+                    write_queue, profiler, frame_size):
+    if len(paths) <= 1 or profiler is not None:
+        jobs = 1
+    with ImageProcessor(mask_path, downscale_factor=downscale_factor, fast_downscale=fast_downscale, jobs=jobs,
+                        decode_threads=decode_threads, prefetch=prefetch, write_queue=write_queue,
+                        profiler=profiler, frame_size=frame_size) as processor:
+        yield from processor.process(paths, save_paths)
+
+
+class ImageProcessor:
+    """Processes images with a mask that is prepared once and, with several jobs,
+    a pool of worker processes that is started once. Keeping the processor
+    avoids paying both for every group of images, as a long running program does.
+
+    :param mask_path: path to the mask image file
+    :type mask_path: str
+    :param downscale_factor: factor to downscale the images by
+    :type downscale_factor: int
+    :param fast_downscale: downscale while decoding and with a box filter instead of LANCZOS
+    :type fast_downscale: bool
+    :param jobs: number of worker processes, 1 processes the images in this process
+    :type jobs: int
+    :param decode_threads: number of threads decoding images when running a single job
+    :type decode_threads: int
+    :param prefetch: maximum number of images decoded ahead when running a single job
+    :type prefetch: int
+    :param write_queue: maximum number of segmented images waiting to be saved when running a single job
+    :type write_queue: int
+    :param profiler: optional profiler, images are then processed one at a time in this process
+    :type profiler: Profiler
+    :param frame_size: width and height of raw frames
+    :type frame_size: tuple
+    """
+
+    def __init__(self, mask_path, downscale_factor=1, fast_downscale=False, jobs=1, decode_threads=2, prefetch=4,
+                 write_queue=4, profiler=None, frame_size=None):
+        if jobs < 1:
+            raise ValueError("Number of jobs must be at least 1")
+        self.jobs = jobs
+        self.__pipeline_options = dict(decode_threads=decode_threads, prefetch=prefetch, write_queue=write_queue,
+                                       frame_size=frame_size)
+        self.__profiler = profiler
+        self.__frame_size = frame_size
+        self.__mask = None
+        self.__pool = None
+        if jobs > 1 and profiler is None:
+            initializer = partial(_init_worker, mask_path, downscale_factor, fast_downscale, frame_size)
+            self.__pool = multiprocessing.Pool(jobs, initializer=initializer)
+            return
+        try:
+            with stage(profiler, "resize"):
+                self.__mask = load_mask(mask_path, downscale_factor=downscale_factor, fast_downscale=fast_downscale)
+        except Exception as error:
+            # Reported in the result of every image
+            self.__mask = error
+
+    def process(self, paths, save_paths=None):
+        """Processes several images, yielding their results in input order.
+
+        :param paths: paths to the image files
+        :type paths: list
+        :param save_paths: optional paths to save each segmented image at, None entries aren't saved
+        :type save_paths: list
+        :return: An iterator of ImageResult.
+        """
+        paths = list(paths)
+        if save_paths is None:
+            save_paths = [None] * len(paths)
+        tasks = list(zip(paths, save_paths))
+
+        if self.__pool is not None:
+            # Small chunks keep the workers balanced while still streaming results in order
+            chunksize = max(1, len(tasks) // (self.jobs * 8))
+            yield from self.__pool.imap(_process_task, tasks, chunksize=chunksize)
+            return
+        if isinstance(self.__mask, Exception):
+            for path, _ in tasks:
+                yield ImageResult(path, error=describe_error(self.__mask))
+            return
+        if self.__profiler is not None:
+            for path, save_path in tasks:
+                yield process_image(path, self.__mask, save_path, self.__profiler, self.__frame_size)
+            return
+        yield from run_pipeline(paths, self.__mask, save_paths=save_paths, **self.__pipeline_options)
+
+    def close(self):
+        """Stops the worker processes, if any. Images still being processed are abandoned."""
+        if self.__pool is not None:
+            self.__pool.terminate()
+            self.__pool.join()
+            self.__pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def _init_worker(mask_path, downscale_factor, fast_downscale, frame_size=None):
+    global _worker_mask, _worker_frame_size
+    _worker_frame_size = frame_size
+    try:
+        _worker_mask = load_mask(mask_path, downscale_factor=downscale_factor, fast_downscale=fast_downscale)
+    except Exception as error:
+        _worker_mask = error
+
+
+def _process_task(task):
+    path, save_path = task
+    if isinstance(_worker_mask, Exception):
+        return ImageResult(path, error=describe_error(_worker_mask))
+    return process_image(path, _worker_mask, save_path, frame_size=_worker_frame_size)
@@ -1,11 +1,11 @@
 import sys
 import os
+import time
 
-from PIL import Image
-from argparse import ArgumentParser, RawDescriptionHelpFormatter
+from argparse import ArgumentParser, ArgumentTypeError, RawDescriptionHelpFormatter
 
-
-from cloudcoverindex.filters import mask_filter, red_blue_filter, convolution_filter
+# Pillow, numpy and the processing modules take most of the startup time, so they are
+# imported where they are used. The command line only loads what its options need.
 
 description = "Cloud Cover Index: Determine cloud cover index from jpeg image"
 __version__ = "0.0.3"
@@ -19,29 +19,109 @@ class CloudCoverApp:
 
     :param path: path to image file
     :type path: str
-    :param mask_path: path to the mask image file
-    :type mask_path: str
+    :param mask: path to the mask image file, or a PreparedMask
+    :type mask: str or PreparedMask
     :param path: path where the processed image is to be saved at
     :type path: str
     """
     
-    def __init__(self, path, mask_path, downscale_factor=1):
-        """Constructor method that applies all filters to an image and keeps it as an attribute.
-        First the mask_filter is applied to reduce image size and
-        decrease complexity, then the red_blue_filter to categorize
-        the pixels of the image, and after the convolution filter
-        is applied. Finally the image is kept.
-
-        :param path: path to image file
+    def __init__(self, path, mask, downscale_factor=1, fast_downscale=False, profiler=None, tile_height=None,
+                 workers=None, coarse_factor=None, frame_size=None):
+        """Constructor method that segments the image and keeps the result as an attribute.
+        First the image is cropped and downscaled to the mask to reduce its size and
+        decrease complexity, then the R/B filter categorizes the pixels
+        of the image, and after that the convolution filter is applied. All
+        steps run on arrays by the fused engine, the output image is only
+        built when it is saved.
+
+        :param path: path to image file, or to an uncompressed .npy or raw RGB frame, which is memory mapped
+            instead of decoded, see cloudcoverindex.rawframes
         :type path: str
-        :param mask_path: path to the mask image file
-        :type mask_path: str
+        :param mask: path to the mask image file, or a PreparedMask. Mask files are prepared
+            through the shared mask cache, a PreparedMask brings its own downscale factor and mode
+        :type mask: str or PreparedMask
+        :param downscale_factor: factor to downscale the image by
+        :type downscale_factor: int
+        :param fast_downscale: downscale while decoding the JPEG and with a box filter instead of LANCZOS
+        :type fast_downscale: bool
+        :param profiler: optional profiler recording the time and memory of every stage, including saving
+        :type profiler: Profiler
+        :param tile_height: if given, the image is processed in strips of this number of rows to bound the memory
+            used, see cloudcoverindex.tiles
+        :type tile_height: int
+        :param workers: if given, the image is segmented on this number of processes sharing its memory,
+            see cloudcoverindex.parallel. Decoding the JPEG stays on one process and takes about half of
+            the time of a frame, so more workers can make it at most about 2x as fast
+        :type workers: int
+        :param coarse_factor: if given, the image is segmented at this coarser factor first and only the ambiguous
+            blocks are segmented again at the downscale factor, see cloudcoverindex.refine for when it pays off
+        :type coarse_factor: int
+        :param frame_size: width and height of a raw frame
+        :type frame_size: tuple
+        """
+        from PIL import Image
+        from cloudcoverindex.engine import load_frame, segment
+        from cloudcoverindex.masks import PreparedMask, load_mask
+        from cloudcoverindex.profiling import stage
+        from cloudcoverindex.rawframes import is_raw_frame, load_raw_frame
+
+        self.__profiler = profiler
+        if not isinstance(mask, PreparedMask):
+            with stage(profiler, "resize"):
+                mask = load_mask(mask, downscale_factor=downscale_factor, fast_downscale=fast_downscale)
+        self.__mask = mask
+        if is_raw_frame(path):
+            if tile_height is not None or workers is not None:
+                raise ValueError("Uncompressed frames can't be processed in strips or on several processes")
+            rgb, alpha = load_raw_frame(path, mask, frame_size=frame_size, profiler=profiler)
+        else:
+            with stage(profiler, "decode"):
+                image = Image.open(path)
+            if tile_height is not None:
+                from cloudcoverindex.tiles import segment_tiled
+                self.__segmentation = segment_tiled(image, mask, tile_height=tile_height, profiler=profiler)
+                return
+            if workers is not None:
+                from cloudcoverindex.parallel import segment_parallel
+                self.__segmentation = segment_parallel(image, mask, workers=workers)
+                return
+            rgb, alpha = load_frame(image, mask, profiler=profiler)
+        if coarse_factor is not None:
+            from cloudcoverindex.refine import get_segmenter
+            self.__segmentation = get_segmenter(mask, coarse_factor).segment(rgb, profiler=profiler)
+            return
+        self.__segmentation = segment(rgb, alpha, mask=mask, profiler=profiler)
+
+    @classmethod
+    def batch(cls, paths, mask, downscale_factor=1, fast_downscale=False, stack_size=None, frame_size=None):
+        """Computes the pixel counts of several images from the same camera at once.
+        The frames are decoded into one contiguous stack and the filters run over the
+        whole stack, instead of building an app for every image, see batch.process_stacked.
+        An image that can't be processed is reported in its result.
+
+        :param paths: paths to the image files
+        :type paths: list
+        :param mask: path to the mask image file, or a PreparedMask
+        :type mask: str or PreparedMask
+        :param downscale_factor: factor to downscale the images by
+        :type downscale_factor: int
+        :param fast_downscale: downscale while decoding the JPEG and with a box filter instead of LANCZOS
+        :type fast_downscale: bool
+        :param stack_size: maximum number of frames processed at once, by default batch.STACK_SIZE
+        :type stack_size: int
+        :param frame_size: width and height of raw frames, see cloudcoverindex.rawframes
+        :type frame_size: tuple
+        :return: The results of the images, in input order.
+        :rtype: list
         """
-        image = mask_filter(Image.open(path), Image.open(mask_path), downscale_factor=downscale_factor)
-        image = red_blue_filter(image)
-        image = convolution_filter(image)
+        from cloudcoverindex.batch import process_stacked, STACK_SIZE
+        from cloudcoverindex.masks import PreparedMask, load_mask
 
-        self.__image = image
+        if stack_size is None:
+            stack_size = STACK_SIZE
+        if not isinstance(mask, PreparedMask):
+            mask = load_mask(mask, downscale_factor=downscale_factor, fast_downscale=fast_downscale)
+        return list(process_stacked(paths, mask, stack_size=stack_size, frame_size=frame_size))
 
     def get_cloud_cover_index(self):
         """Returns the value of the cloud cover index.
@@ -53,38 +133,204 @@ class CloudCoverApp:
         :return: Cloud cover index
         :rtype: float
         """
-        image_pixels = self.__image.load()
-        width, height = self.__image.size
-        total_pixels = 0
-        cloud_pixels = 0
-        for x in range(width):
-            for y in range(height):
-                l_band, a_band = image_pixels[x, y]
-                if a_band == 0:
-                    continue
-                total_pixels += 1
-                if l_band == 255:
-                    cloud_pixels += 1
+        cloud_pixels, total_pixels = self.get_pixel_counts()
         return cloud_pixels / total_pixels
 
+    @classmethod
+    def estimate_cloud_cover_index(cls, path, mask, downscale_factor=1, fast_downscale=False, error_bound=0.01,
+                                   confidence=0.95, time_budget=None, seed=None, frame_size=None):
+        """Estimates the cloud cover index of an image without segmenting the whole image.
+        The filters are evaluated at random points of the mask until the confidence
+        interval is narrow enough or the time budget runs out, see cloudcoverindex.sampling.
+        The image is still decoded whole, downscaling while decoding makes that fast.
+        Uncompressed frames are memory mapped, so at a downscale factor of 1 only the
+        pages holding the sampled pixels are read.
+
+        :param path: path to image file, or to an uncompressed .npy or raw RGB frame
+        :type path: str
+        :param mask: path to the mask image file, or a PreparedMask
+        :type mask: str or PreparedMask
+        :param downscale_factor: factor to downscale the image by
+        :type downscale_factor: int
+        :param fast_downscale: downscale while decoding the JPEG and with a box filter instead of LANCZOS
+        :type fast_downscale: bool
+        :param error_bound: largest error accepted, half the width of the interval, None to use the time budget
+        :type error_bound: float
+        :param confidence: confidence level of the interval
+        :type confidence: float
+        :param time_budget: optional seconds for the whole estimate, including decoding the image
+        :type time_budget: float
+        :param seed: optional seed of the random points, for repeatable estimates
+        :param frame_size: width and height of a raw frame, see cloudcoverindex.rawframes
+        :type frame_size: tuple
+        :return: The estimate, with the index and the bounds of its interval
+        :rtype: CloudCoverEstimate
+        """
+        from cloudcoverindex.masks import PreparedMask, load_mask
+        from cloudcoverindex.rawframes import load_frame_file
+        from cloudcoverindex.sampling import estimate_cloud_cover
+
+        start = time.perf_counter()
+        if not isinstance(mask, PreparedMask):
+            mask = load_mask(mask, downscale_factor=downscale_factor, fast_downscale=fast_downscale)
+        rgb, _ = load_frame_file(path, mask, frame_size=frame_size)
+        if time_budget is not None:
+            time_budget = max(0.0, time_budget - (time.perf_counter() - start))
+        return estimate_cloud_cover(rgb, mask, error_bound=error_bound, confidence=confidence,
+                                    time_budget=time_budget, seed=seed)
+
+    def get_pixel_counts(self):
+        """Returns the number of cloud pixels and the total number of pixels
+        used to compute the cloud cover index. Counts from several images can
+        be added together to compute a pooled index.
+
+        :return: A tuple (cloud_pixels, total_pixels)
+        :rtype: tuple
+        """
+        return self.__segmentation.cloud_pixels, self.__segmentation.total_pixels
+
+    def get_cloud_pixel_count(self):
+        """Returns the number of cloud pixels in the processed image.
+
+        :return: Number of white pixels that aren't transparent
+        :rtype: int
+        """
+        return self.get_pixel_counts()[0]
+
+    def get_total_pixel_count(self):
+        """Returns the number of pixels that aren't transparent in the processed image.
+
+        :return: Number of pixels that aren't transparent
+        :rtype: int
+        """
+        return self.get_pixel_counts()[1]
+
     def save(self, path):
         """Saves the image to a given path.
-        Uses the pillow version of the same method.
+        Uses the pillow version of the same method, unless the path ends with .cci,
+        which saves a compact segmentation file, see cloudcoverindex.packed.
 
         :param path: path where the processed image is to be saved at
         :type path: str
         """
-        self.__image.save(path)
+        from cloudcoverindex.packed import save_segmentation
+        from cloudcoverindex.profiling import stage
 
+        with stage(self.__profiler, "save"):
+            save_segmentation(self.__segmentation, path, self.__mask)
 
-def main():
+
+# Options that take a value, they are passed to the parser together with their value
+VALUE_OPTIONS = ("-j", "--jobs", "--decode-threads", "--prefetch", "--write-queue", "--cache", "--profile", "--watch",
+                 "--output", "--checkpoint", "--interval", "--settle", "--serve", "--batch-size", "--queue-size",
+                 "--save-format", "--frame-size")
+MASK_PATH = "data/mask-1350-sq.png"
+DOWNSCALE_FACTOR = 4
+# Long options without a value, passed to the parser as they are
+FLAG_OPTIONS = ("--no-cache",)
+# Characters of the groups of flags, where an "s" or an "S" saves the output images and a "p" returns percentages
+FLAG_CHARACTERS = frozenset("-sSp")
+# First bytes of every JPEG file, the start of image marker followed by the next marker
+JPEG_SIGNATURE = b"\xff\xd8\xff"
+
+
+def is_jpeg(path):
+    """Checks whether a file is a JPEG image from its first bytes, without parsing its headers.
+
+    :param path: path to the file
+    :type path: str
+    :return: Whether the file starts as a JPEG image
+    :rtype: bool
+    :raises OSError: if the file can't be read
+    """
+    with open(path, "rb") as file:
+        return file.read(len(JPEG_SIGNATURE)) == JPEG_SIGNATURE
+
+
+def _flag_arguments(arg):
+    """Turns an argument that isn't a file into those of the parser.
+    In a group of flags an "s" or an "S" saves the output images and a "p" returns percentages,
+    other options are left for the parser to report and anything else is reported and skipped.
+
+    :param arg: the command line argument
+    :type arg: str
+    :return: The arguments for the parser, empty if the argument is skipped.
+    :rtype: list
+    """
+    if arg in ("--S", "--percentage"):
+        return [arg]
+    if FLAG_CHARACTERS.issuperset(arg):
+        arguments = []
+        for char in arg:
+            if char == 's' or char == 'S':
+                arguments.append('--S')
+            if char == 'p':
+                arguments.append('--percentage')
+        return arguments
+    if arg.startswith("-"):
+        # Unknown options make the parser fail with its usage
+        return [arg]
+    print("Skipped \"" + arg + "\", it isn't a file nor a group of flags", file=sys.stderr)
+    return []
+
+
+def split_arguments(argv):
+    """Turns the command line arguments into those of the parser.
+    Arguments that are readable files are image paths, only JPEG images and uncompressed
+    frames are kept and every other file is reported and skipped. Arguments that aren't files
+    are groups of flags, where an "s" or an "S" saves the output images and a "p" returns percentages.
+    Any other option is left for the parser to report, and any other argument is reported and skipped.
+
+    :param argv: the command line arguments, without the program name
+    :type argv: list
+    :return: The arguments for the parser.
+    :rtype: list
+    """
     arguments = []
+    i = 0
+    while i < len(argv):
+        arg = argv[i]
+        i += 1
+        if arg in FLAG_OPTIONS or arg == '-h' or arg == '--help':
+            arguments.append(arg)
+            continue
+        if arg.split("=", 1)[0] in VALUE_OPTIONS:
+            arguments.append(arg)
+            if "=" not in arg and i < len(argv):
+                arguments.append(argv[i])
+                i += 1
+            continue
+        if not arg.startswith("--") and arg[:2] in VALUE_OPTIONS:
+            # Short option with its value attached, such as -j4
+            arguments.append(arg)
+            continue
+        try:
+            jpeg = is_jpeg(arg)
+        except OSError:
+            arguments.extend(_flag_arguments(arg))
+            continue
+        if jpeg:
+            arguments.append(arg)
+            continue
+        # Only loaded when some file isn't a JPEG image, as it needs numpy
+        from cloudcoverindex.rawframes import is_raw_frame_file
+        if is_raw_frame_file(arg):
+            arguments.append(arg)
+        else:
+            print("Skipped \"" + arg + "\", only jpeg images and uncompressed frames are supported", file=sys.stderr)
+    return arguments
+
+
+def main():
+    from cloudcoverindex.resultcache import default_cache_path
+
     parser = ArgumentParser(formatter_class=RawDescriptionHelpFormatter,
                             description=f"{description} (Version: {__version__})")
 
-    parser.add_argument("paths", type=str, nargs='+',
+    parser.add_argument("paths", type=str, nargs='*',
                         metavar='PATH/TO/IMAGE', action="store",
-                        help="read image(s) and return cloud cover index(es) (only jpeg images are supported)")
+                        help="read image(s) and return cloud cover index(es) (only jpeg images, and uncompressed "
+                             ".npy or raw .rgb frames are supported)")
 
     parser.add_argument("-s", "--S", action="store_true",
                         help="save greyscale output image (the dashes(-) are implied)")
@@ -92,43 +338,192 @@ def main():
     parser.add_argument("-p", "--percentage", action="store_true",
                         help="return cloud cover index value as a percentage (the dashes(-) are implied)")
 
-    for arg in sys.argv[1:]:
+    parser.add_argument("-j", "--jobs", type=int, default=1, metavar="N",
+                        help="number of worker processes used to process the images (default: 1)")
+
+    parser.add_argument("--decode-threads", type=int, default=2, metavar="N",
+                        help="with a single job, number of threads decoding images ahead (default: 2)")
+
+    parser.add_argument("--prefetch", type=int, default=4, metavar="N",
+                        help="with a single job, maximum number of images decoded ahead (default: 4)")
+
+    parser.add_argument("--write-queue", type=int, default=4, metavar="N",
+                        help="with a single job, maximum number of images waiting to be saved (default: 4)")
+
+    parser.add_argument("--frame-size", type=__frame_size, default=None, metavar="WIDTHxHEIGHT",
+                        help="width and height of the raw .rgb frames, .npy frames have their own")
+
+    parser.add_argument("--save-format", type=str, default="png", choices=("png", "cci"),
+                        help="format of the saved images, cci files keep one bit per pixel and a reference to the "
+                             "mask, see cloudcoverindex.packed (default: png)")
+
+    parser.add_argument("--cache", type=str, default=None, metavar="PATH",
+                        help="file where results are cached, so images submitted again aren't processed again "
+                             "(default: " + default_cache_path() + ")")
+
+    parser.add_argument("--no-cache", action="store_true",
+                        help="process every image even if its result is cached, and don't cache results")
+
+    parser.add_argument("--profile", type=str, default=None, metavar="FILE",
+                        help="write the time and memory spent in every processing stage to a JSON file, "
+                             "images are then processed one at a time")
+
+    parser.add_argument("--watch", type=str, default=None, metavar="DIR",
+                        help="keep running and process every new jpeg image that appears in a directory")
+
+    parser.add_argument("--output", type=str, default=None, metavar="FILE",
+                        help="when watching, file the results are appended to as JSON lines (default: standard output)")
+
+    parser.add_argument("--checkpoint", type=str, default=None, metavar="FILE",
+                        help="when watching, file recording the images already processed, so restarts resume "
+                             "(default: a file next to the result cache)")
+
+    parser.add_argument("--interval", type=float, default=1.0, metavar="SECONDS",
+                        help="when watching, time between checks for new images (default: 1)")
+
+    parser.add_argument("--settle", type=float, default=2.0, metavar="SECONDS",
+                        help="when watching, time an image must stay unchanged before it is processed (default: 2)")
+
+    parser.add_argument("--serve", type=str, default=None, metavar="ADDRESS",
+                        help="keep running as a server answering requests on a Unix socket path or a TCP host:port, "
+                             "see cloudcoverindex.server (the worker processes are set with --jobs)")
+
+    parser.add_argument("--batch-size", type=int, default=4, metavar="N",
+                        help="when serving, maximum number of requests sent to a worker at once (default: 4)")
+
+    parser.add_argument("--queue-size", type=int, default=64, metavar="N",
+                        help="when serving, maximum number of requests waiting for a worker (default: 64)")
+
+    args = parser.parse_args(split_arguments(sys.argv[1:]))
+    if args.jobs < 1:
+        parser.error("the number of jobs must be at least 1")
+    if args.decode_threads < 1 or args.prefetch < 1 or args.write_queue < 1:
+        parser.error("decode threads and queue depths must be at least 1")
+    if args.serve is not None:
+        if args.paths or args.watch is not None:
+            parser.error("images or a directory can't be given when serving")
+        if args.batch_size < 1 or args.queue_size < 1:
+            parser.error("batch and queue sizes must be at least 1")
+        from cloudcoverindex.server import serve
         try:
-            if arg == '-h' or arg == '--help' or Image.open(arg).format == 'JPEG':
-                arguments.append(arg)
-        except:
-            for char in arg:
-                if char == 's' or char == 'S':
-                    arguments.append('--S')
-                if char == 'p':
-                    arguments.append('--percentage')
-
-    args = parser.parse_args(arguments)
-
-    for path in args.paths:
-        app = CloudCoverApp(path, "data/mask-1350-sq.png", downscale_factor=4)
-
-        image_name = ""
-        image_path, image_format = path.rsplit('.', 1)
-        for char in reversed(image_path):
-            if char == '/':
-                break
-            image_name = str(char) + image_name
-
-        if args.S:
-            os.makedirs("data/saved_images/", exist_ok=True)
-            app.save("data/saved_images/" + image_name + "-seg.png")
-            print("Saved image named \"" + image_name + "-seg.png\" to data/saved_images/...")
-
-        cloud_cover_index = app.get_cloud_cover_index()
-        output = "Image named \"" + image_name + "\" has a Cloud Cover Index of "
-
-        if args.percentage:
-            output += str(100.0*cloud_cover_index)[:5] + " %"
-        else:
-            output += str("%.2f" % cloud_cover_index)
+            serve(args.serve, MASK_PATH, downscale_factor=DOWNSCALE_FACTOR, workers=args.jobs,
+                  batch_size=args.batch_size, queue_size=args.queue_size)
+        except (OSError, ValueError) as error:
+            print("Could not start the server: " + str(error), file=sys.stderr)
+            sys.exit(1)
+        return
+    if args.watch is not None:
+        if args.paths:
+            parser.error("images can't be given when watching a directory")
+        __watch(args)
+        return
+    if not args.paths:
+        parser.error("the following arguments are required: PATH/TO/IMAGE")
+
+    import sqlite3
+    from cloudcoverindex.batch import process_images
+    from cloudcoverindex.profiling import Profiler
+    from cloudcoverindex.resultcache import ResultCache
+
+    image_names = [__image_name(path) for path in args.paths]
+    save_paths = None
+    if args.S:
+        os.makedirs("data/saved_images/", exist_ok=True)
+        save_paths = ["data/saved_images/" + image_name + "-seg." + args.save_format for image_name in image_names]
+
+    cache = None
+    if not args.no_cache:
+        try:
+            cache = ResultCache(args.cache)
+        except (OSError, sqlite3.Error) as error:
+            print("Could not open the result cache, images are processed without it: " + str(error), file=sys.stderr)
+
+    profiler = Profiler() if args.profile is not None else None
+    failed = False
+    results = process_images(args.paths, MASK_PATH, downscale_factor=DOWNSCALE_FACTOR, jobs=args.jobs,
+                             save_paths=save_paths, decode_threads=args.decode_threads, prefetch=args.prefetch,
+                             write_queue=args.write_queue, cache=cache, profiler=profiler, frame_size=args.frame_size)
+    for image_name, result in zip(image_names, results):
+        if not result.ok:
+            failed = True
+            print("Could not process image named \"" + image_name + "\": " + result.error, file=sys.stderr)
+            continue
+
+        if result.save_path is not None:
+            print("Saved image named \"" + image_name + "-seg." + args.save_format + "\" to data/saved_images/...")
+
+        print(__format_output(image_name, result.cloud_cover_index, args.percentage))
+
+    if cache is not None:
+        cache.close()
+    if profiler is not None:
+        profiler.close()
+        profiler.write_json(args.profile)
+    if failed:
+        sys.exit(1)
+
+
+def __watch(args):
+    from cloudcoverindex.batch import ImageProcessor
+    from cloudcoverindex.profiling import Profiler
+    from cloudcoverindex.watch import Checkpoint, default_checkpoint_path, watch
+
+    if not os.path.isdir(args.watch):
+        print("Not a directory: " + args.watch, file=sys.stderr)
+        sys.exit(1)
+
+    def save_path(path):
+        return "data/saved_images/" + __image_name(path) + "-seg." + args.save_format
+
+    if args.S:
+        os.makedirs("data/saved_images/", exist_ok=True)
+
+    profiler = Profiler() if args.profile is not None else None
+    checkpoint = Checkpoint(args.checkpoint or default_checkpoint_path(args.watch))
+    output = open(args.output, "a") if args.output is not None else sys.stdout
+    processor = ImageProcessor(MASK_PATH, downscale_factor=DOWNSCALE_FACTOR, jobs=args.jobs,
+                               decode_threads=args.decode_threads, prefetch=args.prefetch,
+                               write_queue=args.write_queue, profiler=profiler, frame_size=args.frame_size)
+    try:
+        watch(args.watch, processor, output, checkpoint, interval=args.interval, settle_time=args.settle,
+              save_path=save_path if args.S else None)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        processor.close()
+        checkpoint.close()
+        if output is not sys.stdout:
+            output.close()
+        if profiler is not None:
+            profiler.close()
+            profiler.write_json(args.profile)
+
+
+def __frame_size(text):
+    width, separator, height = text.lower().partition("x")
+    if not separator or not width.isdigit() or not height.isdigit() or int(width) < 1 or int(height) < 1:
+        raise ArgumentTypeError("expected WIDTHxHEIGHT, for example 4368x2912")
+    return int(width), int(height)
+
+
+def __image_name(path):
+    image_name = ""
+    image_path = path.rsplit('.', 1)[0]
+    for char in reversed(image_path):
+        if char == '/':
+            break
+        image_name = str(char) + image_name
+    return image_name
+
+
+def __format_output(image_name, cloud_cover_index, percentage):
+    output = "Image named \"" + image_name + "\" has a Cloud Cover Index of "
 
-        print(output)
+    if percentage:
+        output += str(100.0*cloud_cover_index)[:5] + " %"
+    else:
+        output += str("%.2f" % cloud_cover_index)
+    return output
 
 
 if __name__ == "__main__":
@@ -0,0 +1,203 @@
+"""Fused segmentation engine.
+
+Goes from a decoded RGB frame and its mask straight to the segmentation
+and the cloud/total pixel counts, working on contiguous arrays instead of
+chaining the image filters. The output image is only built on request.
+When numpy isn't available frames are kept as images and segmented with
+the pillow backend of the filters instead.
+"""
+from PIL import Image
+
+from cloudcoverindex.filters import crop_and_scale, red_blue_array, red_blue_white, convolution_array, \
+    convolution_slab, count_cloud_array, red_blue_filter, convolution_filter, count_cloud_pixels
+from cloudcoverindex.masks import PreparedMask, prepare_mask
+from cloudcoverindex.profiling import stage
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Number of rows of the bands the opaque part of a mask is split into
+BAND_HEIGHT = 64
+
+# Maximum number of pixels of the frames of a stack computed together per band, bigger groups fall out of the cache
+STACK_PIXELS = 1 << 18
+
+
+class Segmentation:
+    """Result of segmenting a frame.
+    Keeps the segmented greyscale band, the alpha band and the pixel counts.
+
+    :param band: uint8 array with the segmented greyscale values (0 or 255), or an image in L mode.
+    :param alpha: uint8 array with the alpha values of the frame, or an image in L mode.
+    :param cloud_pixels: Number of white pixels that aren't transparent.
+    :type cloud_pixels: int
+    :param total_pixels: Number of pixels that aren't transparent.
+    :type total_pixels: int
+    """
+
+    def __init__(self, band, alpha, cloud_pixels, total_pixels):
+        self.band = band
+        self.alpha = alpha
+        self.cloud_pixels = cloud_pixels
+        self.total_pixels = total_pixels
+
+    def to_image(self):
+        """Builds the segmented image, the same image returned by the filter chain.
+
+        :return: An image in LA mode.
+        """
+        if isinstance(self.band, Image.Image):
+            return Image.merge("LA", (self.band, self.alpha))
+        return Image.merge("LA", (Image.fromarray(self.band), Image.fromarray(self.alpha)))
+
+
+def load_frame(image, mask, downscale_factor=1, fast_downscale=False, profiler=None):
+    """Crops and scales an image to its mask and returns both as arrays.
+    Without numpy the decoded RGB image and the scaled mask are returned instead.
+
+    :param image: An image, must be in RGB mode.
+    :param mask: An image, must have only one band/channel, or a PreparedMask.
+    :param downscale_factor: An optional factor to downscale the image.
+    :type downscale_factor: int
+    :param fast_downscale: Use decode time scaling and box reduction instead of LANCZOS.
+    :type fast_downscale: bool
+    :param profiler: An optional profiler recording the decode, crop, resize and merge stages.
+    :type profiler: Profiler
+    :return: A tuple (rgb, alpha) with arrays of shape (height, width, 3) and (height, width).
+    """
+    if not isinstance(mask, PreparedMask):
+        with stage(profiler, "resize"):
+            mask = prepare_mask(mask, downscale_factor=downscale_factor, fast_downscale=fast_downscale)
+    image, band = crop_and_scale(image, mask, profiler=profiler)
+    with stage(profiler, "merge"):
+        if np is None:
+            image.load()
+            return image, band
+        return np.asarray(image), mask.alpha
+
+
+def segment(rgb, alpha, ratio_threshold=0.95, window_size=5, low_threshold=7, high_threshold=16, mask=None,
+            profiler=None):
+    """Segments a frame into cloud and sky pixels.
+    Applies the R/B filter, the convolution filter and the pixel count
+    without building any intermediate image.
+
+    When the prepared mask of the frame is given, only the rectangles around
+    its opaque pixels are computed and the total pixel count comes from the
+    mask. The result is the same.
+
+    :param rgb: uint8 array of shape (height, width, 3), or an RGB image as returned by load_frame without numpy.
+    :param alpha: uint8 array of shape (height, width), or the mask image.
+    :param ratio_threshold: Red/Blue ratios bigger than this value produce a white pixel.
+    :param window_size: Width and height of the convolution window, must be odd.
+    :param low_threshold: Counts lower or equal than this value produce a black pixel.
+    :param high_threshold: Counts greater than this value produce a white pixel.
+    :param mask: Optional prepared mask the alpha array comes from.
+    :type mask: PreparedMask
+    :param profiler: An optional profiler recording the red_blue, convolution, select and count stages.
+    :type profiler: Profiler
+    :return: The segmentation of the frame.
+    :rtype: Segmentation
+    """
+    if isinstance(rgb, Image.Image):
+        return __segment_images(rgb, alpha, ratio_threshold, window_size, low_threshold, high_threshold, profiler)
+
+    height, width = alpha.shape
+    if mask is None or height < window_size or width < window_size:
+        with stage(profiler, "red_blue"):
+            band = red_blue_array(rgb, alpha, ratio_threshold)
+        band = convolution_array(band, window_size, low_threshold, high_threshold, profiler=profiler)
+        with stage(profiler, "count"):
+            cloud_pixels, total_pixels = count_cloud_array(band, alpha)
+        return Segmentation(band, alpha, cloud_pixels, total_pixels)
+
+    margin = window_size // 2
+    opaque = mask.opaque
+    with stage(profiler, "red_blue"):
+        white = np.zeros((height, width), dtype=bool)
+        for top, bottom, left, right in mask.regions(BAND_HEIGHT):
+            white[top:bottom, left:right] = red_blue_white(rgb[top:bottom, left:right],
+                                                           opaque[top:bottom, left:right], ratio_threshold)
+
+    # Pixels farther than the window radius from every opaque pixel are always black
+    band = np.zeros((height, width), dtype=np.uint8)
+    cloud_pixels = 0
+    for top, bottom, left, right in mask.regions(BAND_HEIGHT, margin):
+        input_top = max(0, top - margin)
+        input_bottom = min(height, bottom + margin)
+        original = white[input_top:input_bottom, left:right].astype(np.uint8) * 255
+        output = convolution_slab(original, window_size, low_threshold, high_threshold,
+                                  offset=(input_top, left), image_shape=(height, width), profiler=profiler)
+        output = output[top - input_top:bottom - input_top]
+        band[top:bottom, left:right] = output
+        with stage(profiler, "count"):
+            cloud_pixels += int(np.count_nonzero((output == 255) & opaque[top:bottom, left:right]))
+    return Segmentation(band, alpha, cloud_pixels, mask.opaque_pixels)
+
+
+def segment_stack(rgb, mask, ratio_threshold=0.95, window_size=5, low_threshold=7, high_threshold=16):
+    """Segments a stack of frames that share a mask and returns the pixel counts of every frame.
+    Every rectangle around the opaque pixels of the mask is computed for a group of
+    frames at once, so the per frame overhead is paid once per group. Groups are as big
+    as STACK_PIXELS allows, small frames go in big groups and full size frames one by one.
+    The counts are the same as those of segmenting every frame on its own. Requires numpy.
+
+    :param rgb: uint8 array of shape (frames, height, width, 3), every frame cropped and scaled to the mask.
+    :param mask: The prepared mask of the frames.
+    :type mask: PreparedMask
+    :param ratio_threshold: Red/Blue ratios bigger than this value produce a white pixel.
+    :param window_size: Width and height of the convolution window, must be odd.
+    :param low_threshold: Counts lower or equal than this value produce a black pixel.
+    :param high_threshold: Counts greater than this value produce a white pixel.
+    :return: A list with a tuple (cloud_pixels, total_pixels) for every frame.
+    :rtype: list
+    """
+    frames, height, width = rgb.shape[:3]
+    if (height, width) != mask.alpha.shape:
+        raise ValueError("Frames must have the size of the mask")
+    if height < window_size or width < window_size:
+        segmentations = [segment(frame, mask.alpha, ratio_threshold, window_size, low_threshold, high_threshold)
+                         for frame in rgb]
+        return [(segmentation.cloud_pixels, segmentation.total_pixels) for segmentation in segmentations]
+
+    group = max(1, STACK_PIXELS // (BAND_HEIGHT * width))
+    counts = []
+    for first in range(0, frames, group):
+        cloud_pixels = __segment_group(rgb[first:first + group], mask, ratio_threshold, window_size, low_threshold,
+                                       high_threshold)
+        counts.extend((int(count), mask.opaque_pixels) for count in cloud_pixels)
+    return counts
+
+
+def __segment_group(rgb, mask, ratio_threshold, window_size, low_threshold, high_threshold):
+    frames, height, width = rgb.shape[:3]
+    margin = window_size // 2
+    opaque = mask.opaque
+    white = np.zeros((frames, height, width), dtype=bool)
+    for top, bottom, left, right in mask.regions(BAND_HEIGHT):
+        white[:, top:bottom, left:right] = red_blue_white(rgb[:, top:bottom, left:right],
+                                                          opaque[top:bottom, left:right], ratio_threshold)
+
+    cloud_pixels = np.zeros(frames, dtype=np.int64)
+    for top, bottom, left, right in mask.regions(BAND_HEIGHT, margin):
+        input_top = max(0, top - margin)
+        input_bottom = min(height, bottom + margin)
+        original = white[:, input_top:input_bottom, left:right].astype(np.uint8) * 255
+        output = convolution_slab(original, window_size, low_threshold, high_threshold,
+                                  offset=(input_top, left), image_shape=(height, width))
+        output = output[:, top - input_top:bottom - input_top]
+        cloud_pixels += np.count_nonzero((output == 255) & opaque[top:bottom, left:right], axis=(1, 2))
+    return cloud_pixels
+
+
+def __segment_images(image, alpha, ratio_threshold, window_size, low_threshold, high_threshold, profiler=None):
+    with stage(profiler, "merge"):
+        image = Image.merge("RGBA", image.split() + (alpha,))
+    image = red_blue_filter(image, ratio_threshold, backend="pillow", profiler=profiler)
+    image = convolution_filter(image, window_size, low_threshold, high_threshold, backend="pillow",
+                               profiler=profiler)
+    cloud_pixels, total_pixels = count_cloud_pixels(image, backend="pillow", profiler=profiler)
+    band, alpha = image.split()
+    return Segmentation(band, alpha, cloud_pixels, total_pixels)
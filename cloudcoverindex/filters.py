@@ -1,7 +1,21 @@
-from PIL import Image, ImageFilter
+from functools import lru_cache
 
+from PIL import Image, ImageChops, ImageFilter, ImageMath
 
-def mask_filter(image, mask, downscale_factor=1):
+from cloudcoverindex.masks import PreparedMask, prepare_mask
+from cloudcoverindex.profiling import stage
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Fastest backend available, used by the filters when no backend is given.
+# The array functions of this module require numpy.
+BACKEND = "numpy" if np is not None else "pillow"
+
+
+def mask_filter(image, mask, downscale_factor=1, fast_downscale=False, profiler=None):
     """Applies a transparency mask to the given image.
     This method applies a transparency mask over an RGB
     image returning an RGBA image where its alpha channel
@@ -9,51 +23,148 @@ def mask_filter(image, mask, downscale_factor=1):
     Requires the mask to be a one channel image.
 
     :param image: An image, must be in RGB mode. If image size is bigger than mask size the image is cropped
-    :param mask: An image, must have only one band/channel. Width and height of mask must not exceed image dimensions
+    :param mask: An image, must have only one band/channel. Width and height of mask must not exceed image dimensions.
+        A PreparedMask can be used instead, see crop_and_scale.
     :param downscale_factor: An optional factor to downscale the image.
     :type downscale_factor: int
+    :param fast_downscale: Downscale while decoding and with a box filter instead of LANCZOS, see crop_and_scale.
+    :type fast_downscale: bool
+    :param profiler: An optional profiler recording the decode, crop, resize and merge stages.
+    :type profiler: Profiler
     :return: An image in RGBA mode, keeping RGB values from image and adding mask as the A channel.
     """
+    image, mask = crop_and_scale(image, mask, downscale_factor=downscale_factor, fast_downscale=fast_downscale,
+                                 profiler=profiler)
+    with stage(profiler, "merge"):
+        return Image.merge("RGBA", image.split() + mask.split())
+
+
+def crop_and_scale(image, mask, downscale_factor=1, fast_downscale=False, profiler=None):
+    """Crops and downscales an image to the size of the mask.
+    This is the geometric part of mask_filter, the image and the mask are
+    returned as separate images instead of being merged.
+
+    By default both images are downscaled with a LANCZOS filter. When fast_downscale is set
+    and the image hasn't been loaded yet, JPEG images are decoded directly at 1/2, 1/4 or 1/8
+    of their size (the largest that divides the factor) and the rest of the factor
+    is applied with an integer box reduction. The mask is box reduced by the whole factor.
+
+    The mask can also be a PreparedMask, in which case it is used as it is and its own
+    downscale factor and mode replace the given ones.
+
+    :param image: An image, must be in RGB mode. If image size is bigger than mask size the image is cropped
+    :param mask: An image, must have only one band/channel. Width and height of mask must not exceed image dimensions
+    :param downscale_factor: An optional factor to downscale the image.
+    :type downscale_factor: int
+    :param fast_downscale: Use decode time scaling and box reduction instead of LANCZOS.
+    :type fast_downscale: bool
+    :param profiler: An optional profiler recording the decode, crop and resize stages.
+    :type profiler: Profiler
+    :return: A tuple (image, mask) with the cropped and scaled RGB image and the scaled mask.
+    """
     if image is None:
         raise TypeError("Invalid None type argument")
     if mask is None:
         raise TypeError("Invalid None type argument")
-    if mask.size[0] > image.size[0] or mask.size[1] > image.size[1]:
+    mask_size = mask.source_size if isinstance(mask, PreparedMask) else mask.size
+    if mask_size[0] > image.size[0] or mask_size[1] > image.size[1]:
         raise ValueError("Both width and height of mask must be smaller than width and height of image")
     if image.mode != "RGB":
         raise ValueError("Only RGB images are supported")
-    if len(mask.getbands()) != 1:
-        raise ValueError("Mask must have only one channel")
-    if downscale_factor < 1:
-        raise ValueError("Downscale factor must be grater than 1")
-
-    # Crop the image if bigger
-    if image.size[0] > mask.size[0] or image.size[1] > mask.size[1]:
-        image = __crop_borders(image, mask.size)
-
-    # Downscale both image and mask
-    if downscale_factor != 1:
-        image = image.resize((image.size[0] // downscale_factor, image.size[1] // downscale_factor), Image.LANCZOS)
-        mask = mask.resize((mask.size[0] // downscale_factor, mask.size[1] // downscale_factor), Image.LANCZOS)
+    if not isinstance(mask, PreparedMask):
+        with stage(profiler, "resize"):
+            mask = prepare_mask(mask, downscale_factor=downscale_factor, fast_downscale=fast_downscale)
 
-    return Image.merge("RGBA", image.split() + mask.split())
+    image, box, reduce_factor = decode_for_mask(image, mask, profiler=profiler)
+    if mask.fast_downscale and reduce_factor != 1:
+        # Cropping is part of the reduction
+        with stage(profiler, "resize"):
+            return image.reduce(reduce_factor, box=box), mask.band
 
+    # Crop the image if bigger
+    if box != (0, 0) + image.size:
+        with stage(profiler, "crop"):
+            image = image.crop(box)
+
+    # Downscale the image, the mask is already scaled
+    if reduce_factor != 1:
+        with stage(profiler, "resize"):
+            image = image.resize((image.size[0] // reduce_factor, image.size[1] // reduce_factor), Image.LANCZOS)
+
+    return image, mask.band
+
+
+def decode_for_mask(image, mask, profiler=None):
+    """Decodes an image that is going to be cropped and scaled to a prepared mask.
+    This is the first half of crop_and_scale, which is left to the caller: the box of the
+    decoded image under the mask has to be cropped and then downscaled by the returned
+    factor, with a box reduction if the mask uses fast_downscale and with LANCZOS otherwise.
+    With fast_downscale JPEG images are decoded at a fraction of their size, see draft,
+    and the box is trimmed to a multiple of the factor.
+
+    :param image: An image, must be in RGB mode and not smaller than the mask.
+    :param mask: The prepared mask.
+    :type mask: PreparedMask
+    :param profiler: An optional profiler recording the decode stage.
+    :type profiler: Profiler
+    :return: A tuple (image, box, reduce_factor) with the decoded image, the (left, upper, right, lower)
+        box under the mask and the factor the box is still to be downscaled by.
+    :rtype: tuple
+    """
+    width, height = image.size
+    mask_width, mask_height = mask.source_size
+    if mask_width > width or mask_height > height:
+        raise ValueError("Both width and height of mask must be smaller than width and height of image")
+    if image.mode != "RGB":
+        raise ValueError("Only RGB images are supported")
+    draft_scale = draft(image, mask.downscale_factor) if mask.fast_downscale else 1
+    with stage(profiler, "decode"):
+        image.load()
+
+    # Box of the mask, in the coordinates of the decoded image
+    left = (width - mask_width) // 2 // draft_scale
+    upper = (height - mask_height) // 2 // draft_scale
+    crop_width = mask_width // draft_scale
+    crop_height = mask_height // draft_scale
+    reduce_factor = mask.downscale_factor // draft_scale
+    if mask.fast_downscale:
+        crop_width -= crop_width % reduce_factor
+        crop_height -= crop_height % reduce_factor
+    return image, (left, upper, left + crop_width, upper + crop_height), reduce_factor
+
+
+def draft(image, downscale_factor):
+    """Requests a JPEG image to be decoded directly at a fraction of its size.
+    libjpeg can only scale by 1/2, 1/4 and 1/8 while decoding, the largest
+    that divides the downscale factor is requested. Non JPEG images and
+    images that have already been loaded ignore the request.
+
+    :param image: An image, must be in RGB mode.
+    :param downscale_factor: The factor the image is going to be downscaled by.
+    :type downscale_factor: int
+    :return: The scale the image is going to be decoded at, 1 if it is decoded at its full size.
+    :rtype: int
+    """
+    width, height = image.size
+    draft_scale = 1
+    for scale in (8, 4, 2):
+        if downscale_factor % scale == 0:
+            draft_scale = scale
+            break
+    if draft_scale != 1:
+        image.draft("RGB", (width // draft_scale, height // draft_scale))
+        draft_scale = __draft_scale(image.size, (width, height))
+    return draft_scale
 
-def __crop_borders(image, new_size):
-    width = image.size[0]
-    height = image.size[1]
-    new_width = new_size[0]
-    new_height = new_size[1]
-
-    # Otherwise there is no point in calling this method
-    assert width > new_width or height > new_height
 
-    new_upper_left_corner = [(width - new_width) // 2, (height - new_height) // 2]
-    new_lower_right_corner = [new_upper_left_corner[0] + new_width, new_upper_left_corner[1] + new_height]
-    return image.crop(new_upper_left_corner + new_lower_right_corner)
+def __draft_scale(draft_size, original_size):
+    for scale in (8, 4, 2):
+        if draft_size == (-(-original_size[0] // scale), -(-original_size[1] // scale)):
+            return scale
+    return 1
 
 
-def red_blue_filter(image):
+def red_blue_filter(image, ratio_threshold=0.95, backend=None, profiler=None):
     """Applies an R/B filter to each pixel in the image
     Applies a pixel wise filter to the provided image:
     Converts a pixel to white if the Red/Blue component ratio
@@ -61,7 +172,19 @@ def red_blue_filter(image):
     For the pixel is transparent the resulting greyscale band value will be 0.
     Requires The image to be in RGBA mode.
 
+    Three backends are available: "numpy" computes the whole frame at once
+    using array operations, "pillow" does the same with pillow operations only
+    and "python" walks every pixel and is kept as the reference implementation.
+    The numpy and pillow backends look up the decision for every (red, blue) pair
+    in a table built once per threshold. All produce identical results.
+
     :param image: An image.
+    :param ratio_threshold: Red/Blue ratios bigger than this value produce a white pixel.
+    :type ratio_threshold: float
+    :param backend: Either "numpy", "pillow" or "python". By default the fastest available, see BACKEND.
+    :type backend: str
+    :param profiler: An optional profiler recording the red_blue stage.
+    :type profiler: Profiler
     :return: An LA image( greyscale with alpha channel).
     """
     if image is None:
@@ -69,6 +192,109 @@ def red_blue_filter(image):
     if image.mode != "RGBA":
         raise ValueError("Only RGBA images are supported")
 
+    backend = backend or BACKEND
+    if backend not in ("numpy", "pillow", "python"):
+        raise ValueError("Unknown backend: " + str(backend))
+    with stage(profiler, "red_blue"):
+        if backend == "numpy":
+            # Transparent pixels are always black, only the bounding box of the opaque pixels is computed
+            greyscale_band = Image.new("L", image.size, color=0)
+            bbox = image.getchannel("A").getbbox()
+            if bbox is not None:
+                pixels = np.asarray(image.crop(bbox))
+                greyscale_band.paste(Image.fromarray(red_blue_array(pixels[..., :3], pixels[..., 3],
+                                                                    ratio_threshold)), bbox[:2])
+        elif backend == "pillow":
+            greyscale_band = red_blue_band(image, ratio_threshold)
+        else:
+            greyscale_band = __red_blue_python(image, ratio_threshold)
+
+    # Return the result of merging the computed greyscale image with the original alpha channel.
+    return Image.merge("LA", (greyscale_band, image.getchannel("A")))
+
+
+@lru_cache(maxsize=None)
+def red_blue_table(ratio_threshold=0.95):
+    """Decision table of the R/B filter.
+    Since both components are 8 bit values, the decision for every (red, blue)
+    pair is computed once and kept. The table is built with the same float
+    division as the per pixel filter, so decisions are identical.
+
+    :param ratio_threshold: Red/Blue ratios bigger than this value produce a white pixel.
+    :type ratio_threshold: float
+    :return: 65536 bytes, the value at red * 256 + blue is 255 for white pixels and 0 for black ones.
+    :rtype: bytes
+    """
+    table = bytearray(256 * 256)
+    for red in range(256):
+        row = red * 256
+        table[row] = 255  # 0 Blue component case
+        for blue in range(1, 256):
+            if red / blue > ratio_threshold:
+                table[row + blue] = 255
+    return bytes(table)
+
+
+@lru_cache(maxsize=None)
+def __red_blue_lookup(ratio_threshold):
+    lookup = np.frombuffer(red_blue_table(ratio_threshold), dtype=np.uint8) != 0
+    lookup.flags.writeable = False
+    return lookup
+
+
+def red_blue_array(rgb, alpha, ratio_threshold=0.95):
+    """Array version of the R/B filter.
+    Applies the same decision as red_blue_filter to a whole frame at once.
+
+    :param rgb: An array of shape (height, width, 3) with the RGB values of the frame.
+    :param alpha: An array of shape (height, width) with the alpha values of the frame.
+    :param ratio_threshold: Red/Blue ratios bigger than this value produce a white pixel.
+    :type ratio_threshold: float
+    :return: A uint8 array of shape (height, width) with values 0 or 255.
+    """
+    return red_blue_white(rgb, alpha, ratio_threshold).astype(np.uint8) * 255
+
+
+def red_blue_white(rgb, alpha, ratio_threshold=0.95):
+    """Same as red_blue_array but returns the decision as a boolean array.
+
+    :param rgb: An array of shape (height, width, 3) with the RGB values of the frame, or of shape
+        (frames, height, width, 3) with a stack of frames sharing the alpha values.
+    :param alpha: An array of shape (height, width) with the alpha values of the frame, or a boolean array
+        that is True for the opaque pixels.
+    :param ratio_threshold: Red/Blue ratios bigger than this value produce a white pixel.
+    :type ratio_threshold: float
+    :return: A boolean array with the shape of the frames, True for white pixels.
+    """
+    index = rgb[..., 0].astype(np.intp) << 8
+    index |= rgb[..., 2]
+    white = __red_blue_lookup(ratio_threshold).take(index)
+    white &= alpha != 0
+    return white
+
+
+def red_blue_band(image, ratio_threshold=0.95):
+    """Pillow version of the R/B filter.
+    Computes the greyscale band of red_blue_filter using pillow operations only.
+
+    :param image: An image in RGBA mode.
+    :param ratio_threshold: Red/Blue ratios bigger than this value produce a white pixel.
+    :type ratio_threshold: float
+    :return: An image in L mode with values 0 or 255.
+    """
+    red, _, blue, alpha = image.split()
+    # Every pixel gets the index of its (red, blue) pair in the decision table
+    if hasattr(ImageMath, "lambda_eval"):
+        index = ImageMath.lambda_eval(lambda args: args["red"] * 256 + args["blue"], red=red, blue=blue)
+    else:
+        index = ImageMath.eval("red * 256 + blue", red=red, blue=blue)
+    band = index.point(list(red_blue_table(ratio_threshold)), "L")
+    # Transparent pixels are black
+    opaque = alpha.point([255 if value else 0 for value in range(256)])
+    return ImageChops.multiply(band, opaque)
+
+
+def __red_blue_python(image, ratio_threshold=0.95):
     width, height = image.size
 
     img_pixels = image.load()
@@ -77,13 +303,11 @@ def red_blue_filter(image):
     greyscale_band_pixels = greyscale_band.load()
     for x in range(width):
         for y in range(height):
-            greyscale_band_pixels[x, y] = __red_blue_pixel_filter(img_pixels[x, y])
+            greyscale_band_pixels[x, y] = __red_blue_pixel_filter(img_pixels[x, y], ratio_threshold)
+    return greyscale_band
 
-    # Return the result of merging the computed greyscale image with the original alpha channel.
-    return Image.merge("LA", (greyscale_band, image.split()[3]))
 
-
-def __red_blue_pixel_filter(pixel):
+def __red_blue_pixel_filter(pixel, ratio_threshold=0.95):
     """This method applies the filter defined above to a pixel
     Returns an int value (255 or 0) as the result of applying the filter
     to teh pixel. If the received pixel is transparent returns 0.
@@ -99,13 +323,13 @@ def __red_blue_pixel_filter(pixel):
         return black_pixel
     if blue_band_value == 0:  # 0 Blue component case
         return white_pixel
-    if red_band_value / blue_band_value > 0.95:
+    if red_band_value / blue_band_value > ratio_threshold:
         return white_pixel
     else:
         return black_pixel
 
 
-def convolution_filter(image):
+def convolution_filter(image, window_size=5, low_threshold=7, high_threshold=16, backend=None, profiler=None):
     """Applies a convolution filter to the provided image.
     The convolution filter is a simple mean 5x5 convolution filter but dividing the sum by 255.
     (Can be though of as counting every white pixel). Then the results are converted to binary (0, 255)
@@ -115,50 +339,264 @@ def convolution_filter(image):
     7 < value <= 16 -> the returned pixel value doesnt change.
     16 < value <= 25 -> the returned pixel value is 255.
 
+    Pixels closer to the border than half the window size keep their original value,
+    and so does the whole image if it is smaller than the window.
     Note that this filter is only applied to the L band of the image and in order to work properly
     the L band values must be either 0 or 255.
     Requires the image to be in mode LA.
 
+    The "numpy" backend counts the white neighbours with a summed-area table, so the
+    cost per pixel does not depend on the window size. The "pillow" backend counts them
+    with a pillow kernel and selects the output pixels with lookup tables, and the "python"
+    backend uses the same kernel but selects every output pixel in python. Pillow kernels
+    only support 3x3 and 5x5 windows.
+
     :param image: An Image in LA mode.
+    :param window_size: Width and height of the window, must be odd.
+    :type window_size: int
+    :param low_threshold: Counts lower or equal than this value produce a black pixel.
+    :type low_threshold: int
+    :param high_threshold: Counts greater than this value produce a white pixel.
+    :type high_threshold: int
+    :param backend: Either "numpy", "pillow" or "python". By default the fastest available, see BACKEND.
+    :type backend: str
+    :param profiler: An optional profiler recording the convolution and select stages.
+    :type profiler: Profiler
     :return: An image. The returned image contains two channels and the alpha channel remains unchanged.
     """
     if image.mode != "LA":
         raise ValueError("Only LA images allowed")
+    if window_size < 1 or window_size % 2 == 0:
+        raise ValueError("Window size must be a positive odd number")
+    if low_threshold > high_threshold:
+        raise ValueError("Low threshold must not be greater than high threshold")
 
-    # Initialize kernel
-    kernel_size = (5, 5)
-    kernel = [
-        1, 1, 1, 1, 1,
-        1, 1, 1, 1, 1,
-        1, 1, 1, 1, 1,
-        1, 1, 1, 1, 1,
-        1, 1, 1, 1, 1,
-    ]
-    kernel_filter = ImageFilter.Kernel(kernel_size, kernel, scale=255)
+    backend = backend or BACKEND
     image_l_band, image_alpha_band = image.split()
-    convolved_band = image_l_band.filter(kernel_filter)
-    convolved_band = __select_output_pixels(image_l_band, convolved_band)
+    if backend == "numpy":
+        convolved_band = Image.fromarray(convolution_array(np.asarray(image_l_band), window_size,
+                                                           low_threshold, high_threshold, profiler=profiler))
+    elif backend in ("pillow", "python"):
+        if window_size not in (3, 5):
+            raise ValueError("The " + backend + " backend only supports 3x3 and 5x5 windows")
+        # Initialize kernel
+        kernel_filter = ImageFilter.Kernel((window_size, window_size), [1] * window_size ** 2, scale=255)
+        with stage(profiler, "convolution"):
+            convolved_band = image_l_band.filter(kernel_filter)
+        with stage(profiler, "select"):
+            if backend == "pillow":
+                convolved_band = select_output_band(image_l_band, convolved_band, low_threshold, high_threshold)
+            else:
+                convolved_band = __select_output_pixels(image_l_band, convolved_band, low_threshold,
+                                                        high_threshold)
+    else:
+        raise ValueError("Unknown backend: " + str(backend))
     return Image.merge("LA", (convolved_band, image_alpha_band))
 
 
-def __select_output_pixels(original_band, convolved_band):
+def convolution_array(band, window_size=5, low_threshold=7, high_threshold=16, profiler=None):
+    """Array version of the convolution filter.
+    Applies the same rules as convolution_filter to a greyscale band.
+
+    :param band: A uint8 array of shape (height, width) with values 0 or 255.
+    :param window_size: Width and height of the window, must be odd.
+    :param low_threshold: Counts lower or equal than this value produce a black pixel.
+    :param high_threshold: Counts greater than this value produce a white pixel.
+    :param profiler: An optional profiler recording the convolution and select stages.
+    :return: A uint8 array of the same shape as band.
+    """
+    height, width = band.shape
+    if height < window_size or width < window_size:
+        # Same as pillow, images smaller than the kernel are returned unchanged
+        return band.copy()
+
+    # Far from any white pixel the output is black, so only the bounding box
+    # of the white pixels grown by the window radius is convolved
+    margin = window_size // 2
+    output = np.zeros_like(band)
+    keep_border(output, band, margin)
+    white = band == 255
+    rows = np.flatnonzero(white.any(axis=1))
+    columns = np.flatnonzero(white.any(axis=0))
+    if len(rows) == 0:
+        return output
+    top, bottom = max(0, rows[0] - margin), min(height, rows[-1] + 1 + margin)
+    left, right = max(0, columns[0] - margin), min(width, columns[-1] + 1 + margin)
+    output[top:bottom, left:right] = convolution_slab(band[top:bottom, left:right], window_size, low_threshold,
+                                                      high_threshold, offset=(top, left), image_shape=(height, width),
+                                                      profiler=profiler)
+    return output
+
+
+def convolution_slab(band, window_size=5, low_threshold=7, high_threshold=16, offset=(0, 0), image_shape=None,
+                     profiler=None):
+    """Applies the convolution filter to a rectangular part of a band.
+    Pixels outside the slab are taken as black, so the result is exact wherever the window
+    only covers black pixels outside the slab. Pixels closer than half the window size to the
+    border of the whole image keep their original value.
+    The whole image must not be smaller than the window.
+
+    :param band: A uint8 array with the values (0 or 255) of the part of the band, or a stack of
+        such parts with rows and columns as its last two axes.
+    :param window_size: Width and height of the window, must be odd.
+    :param low_threshold: Counts lower or equal than this value produce a black pixel.
+    :param high_threshold: Counts greater than this value produce a white pixel.
+    :param offset: Row and column of the first pixel of the slab in the whole image.
+    :type offset: tuple
+    :param image_shape: Height and width of the whole image, by default the shape of the slab.
+    :type image_shape: tuple
+    :param profiler: An optional profiler recording the convolution and select stages.
+    :type profiler: Profiler
+    :return: A uint8 array of the same shape as band.
+    """
+    if image_shape is None:
+        image_shape = band.shape[-2:]
+    with stage(profiler, "convolution"):
+        counts = window_counts(band == 255, window_size)
+    with stage(profiler, "select"):
+        output = select_output_array(band, counts, low_threshold, high_threshold)
+        keep_border(output, band, window_size // 2, offset, image_shape)
+    return output
+
+
+def keep_border(output, band, margin, offset=(0, 0), image_shape=None):
+    """Copies the original values of the border pixels of the image, which are not convolved.
+    The band can also be a stack of bands with the same geometry, with rows and columns as its last two axes.
+
+    :param output: A convolved part of a band, modified in place.
+    :param band: The original values of the same part of the band.
+    :param margin: Width of the border, half the window size.
+    :param offset: Row and column of the first pixel of the part in the whole image.
+    :param image_shape: Height and width of the whole image, by default the shape of the part.
+    """
+    part_height, part_width = band.shape[-2:]
+    if image_shape is None:
+        image_shape = (part_height, part_width)
+    row, column = offset
+    height, width = image_shape
+    top = max(0, min(part_height, margin - row))
+    bottom = max(0, min(part_height, height - margin - row))
+    left = max(0, min(part_width, margin - column))
+    right = max(0, min(part_width, width - margin - column))
+    output[..., :top, :] = band[..., :top, :]
+    output[..., bottom:, :] = band[..., bottom:, :]
+    output[..., :left] = band[..., :left]
+    output[..., right:] = band[..., right:]
+
+
+def window_counts(white, window_size):
+    """Counts the white pixels in the window centered at each pixel.
+    The count is computed from a summed-area table, pixels outside the array count as black.
+    A stack of frames can be counted at once, every frame is counted on its own.
+
+    :param white: A boolean array of shape (height, width), or (frames, height, width) for a stack.
+    :param window_size: Width and height of the window, must be odd.
+    :return: An int32 array of the same shape as white.
+    """
+    margin = window_size // 2
+    padded = np.pad(white, [(0, 0)] * (white.ndim - 2) + [(margin, margin)] * 2).astype(np.int32)
+    table = np.zeros(padded.shape[:-2] + (padded.shape[-2] + 1, padded.shape[-1] + 1), dtype=np.int32)
+    np.cumsum(padded, axis=-2, out=table[..., 1:, 1:])
+    np.cumsum(table[..., 1:, 1:], axis=-1, out=table[..., 1:, 1:])
+    k = window_size
+    return table[..., k:, k:] - table[..., :-k, k:] - table[..., k:, :-k] + table[..., :-k, :-k]
+
+
+def select_output_array(band, counts, low_threshold=7, high_threshold=16):
+    """Applies the three way threshold of the convolution filter to a whole band.
+
+    :param band: A uint8 array with the original values of the band.
+    :param counts: An array of the same shape with the white pixel count of each window.
+    :param low_threshold: Counts lower or equal than this value produce a black pixel.
+    :param high_threshold: Counts greater than this value produce a white pixel.
+    :return: A uint8 array of the same shape as band.
+    """
+    output = np.where(counts > high_threshold, np.uint8(255), band)
+    output[counts <= low_threshold] = 0
+    return output
+
+
+def select_output_band(original_band, convolved_band, low_threshold=7, high_threshold=16):
+    """Pillow version of the three way threshold of the convolution filter.
+
+    :param original_band: An image in L mode with the original values of the band.
+    :param convolved_band: An image in L mode with the white pixel count of each window.
+    :param low_threshold: Counts lower or equal than this value produce a black pixel.
+    :param high_threshold: Counts greater than this value produce a white pixel.
+    :return: An image in L mode.
+    """
+    white = convolved_band.point([255 if count > high_threshold else 0 for count in range(256)])
+    unchanged = convolved_band.point([255 if low_threshold < count <= high_threshold else 0 for count in range(256)])
+    return ImageChops.lighter(white, ImageChops.multiply(unchanged, original_band))
+
+
+def __select_output_pixels(original_band, convolved_band, low_threshold=7, high_threshold=16):
     original_pixels = original_band.load()
     convolved_pixels = convolved_band.load()
 
     width, height = original_band.size
     for x in range(width):
         for y in range(height):
-            convolved_pixels[x, y] = __select_output_pixel(original_pixels[x, y], convolved_pixels[x, y])
+            convolved_pixels[x, y] = __select_output_pixel(original_pixels[x, y], convolved_pixels[x, y],
+                                                           low_threshold, high_threshold)
 
     return convolved_band
 
 
-def __select_output_pixel(original_pixel, convolved_pixel):
+def __select_output_pixel(original_pixel, convolved_pixel, low_threshold=7, high_threshold=16):
     black_pixel = 0
     white_pixel = 255
 
-    if convolved_pixel <= 7:
+    if convolved_pixel <= low_threshold:
         return black_pixel
-    if convolved_pixel <= 16:
+    if convolved_pixel <= high_threshold:
         return original_pixel
     return white_pixel
+
+
+def count_cloud_pixels(image, backend=None, profiler=None):
+    """Counts the cloud pixels and the total pixels of a processed image.
+    Every pixel that isn't transparent is counted, and those that are also
+    white are counted as cloud pixels.
+    Requires the image to be in mode LA.
+
+    :param image: An Image in LA mode.
+    :param backend: Either "numpy" or "pillow". By default the fastest available, see BACKEND.
+    :type backend: str
+    :param profiler: An optional profiler recording the count stage.
+    :type profiler: Profiler
+    :return: A tuple (cloud_pixels, total_pixels).
+    :rtype: tuple
+    """
+    if image.mode != "LA":
+        raise ValueError("Only LA images allowed")
+    backend = backend or BACKEND
+    if backend not in ("numpy", "pillow"):
+        raise ValueError("Unknown backend: " + str(backend))
+    with stage(profiler, "count"):
+        # Only the bounding box of the opaque pixels is counted
+        bbox = image.getchannel("A").getbbox()
+        if bbox is None:
+            return 0, 0
+        image = image.crop(bbox)
+        if backend == "numpy":
+            pixels = np.asarray(image)
+            return count_cloud_array(pixels[..., 0], pixels[..., 1])
+        band, alpha = image.split()
+        opaque = alpha.point([255 if value else 0 for value in range(256)])
+        cloud = ImageChops.multiply(band.point([255 if value == 255 else 0 for value in range(256)]), opaque)
+        return cloud.histogram()[255], opaque.histogram()[255]
+
+
+def count_cloud_array(band, alpha):
+    """Array version of count_cloud_pixels.
+
+    :param band: A uint8 array with the greyscale values of the image.
+    :param alpha: A uint8 array of the same shape with the alpha values of the image.
+    :return: A tuple (cloud_pixels, total_pixels).
+    :rtype: tuple
+    """
+    opaque = alpha != 0
+    total_pixels = int(np.count_nonzero(opaque))
+    cloud_pixels = int(np.count_nonzero(opaque & (band == 255)))
+    return cloud_pixels, total_pixels
@@ -0,0 +1,224 @@
+"""Prepared masks and a cache to share them across images.
+
+Preparing a mask means decoding it and downscaling it to the size the
+images will have after being processed. A PreparedMask keeps the result,
+together with some values derived from it, so that the work is done once
+for every image that uses the same mask.
+"""
+import os
+import threading
+from collections import OrderedDict
+
+from PIL import Image
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+class PreparedMask:
+    """A mask already scaled for a downscale factor.
+
+    :param band: The scaled mask, a single band image in L mode.
+    :param source_size: Size of the mask before scaling, images are cropped to this size.
+    :type source_size: tuple
+    :param downscale_factor: Factor the mask was downscaled by.
+    :type downscale_factor: int
+    :param fast_downscale: Whether the mask was box reduced instead of resized with LANCZOS.
+    :type fast_downscale: bool
+    :param path: Absolute path to the mask file, set for masks loaded from a file.
+    :type path: str
+    """
+
+    def __init__(self, band, source_size, downscale_factor=1, fast_downscale=False, path=None):
+        self.band = band
+        self.source_size = tuple(source_size)
+        self.downscale_factor = downscale_factor
+        self.fast_downscale = fast_downscale
+        self.path = path
+        self.opaque_pixels = sum(band.histogram()[1:])
+        # Bounding box of the opaque pixels as (left, upper, right, lower), None if there are none
+        self.bbox = band.getbbox()
+        self.__alpha = None
+        self.__opaque = None
+        self.__row_spans = None
+        self.__regions = {}
+
+    @property
+    def alpha(self):
+        """The scaled mask as a read only uint8 array, requires numpy."""
+        if self.__alpha is None:
+            self.__alpha = np.asarray(self.band)
+        return self.__alpha
+
+    @property
+    def opaque(self):
+        """Boolean array that is True for the opaque pixels of the scaled mask, requires numpy."""
+        if self.__opaque is None:
+            self.__opaque = self.alpha != 0
+        return self.__opaque
+
+    @property
+    def row_spans(self):
+        """Span of the opaque pixels of every row, requires numpy.
+        An array of shape (height, 2) where each row holds the first opaque column and
+        the column after the last opaque one, or (0, 0) if the row is fully transparent.
+        """
+        if self.__row_spans is None:
+            width = self.opaque.shape[1]
+            has_opaque = self.opaque.any(axis=1)
+            starts = np.argmax(self.opaque, axis=1)
+            stops = width - np.argmax(self.opaque[:, ::-1], axis=1)
+            spans = np.stack([starts, stops], axis=1)
+            spans[~has_opaque] = 0
+            self.__row_spans = spans
+        return self.__row_spans
+
+    def regions(self, band_height=64, margin=0):
+        """Splits the opaque part of the mask into horizontal bands of tight rectangles, requires numpy.
+        Every rectangle covers band_height rows and the columns spanned by the opaque pixels
+        of those rows, both grown by margin pixels. Fully transparent bands are skipped.
+
+        :param band_height: Number of rows of each band.
+        :type band_height: int
+        :param margin: Number of pixels the opaque area is grown by.
+        :type margin: int
+        :return: A list of (top, bottom, left, right) rectangles, bottom and right are exclusive.
+        :rtype: list
+        """
+        key = (band_height, margin)
+        if key not in self.__regions:
+            self.__regions[key] = self.__compute_regions(band_height, margin)
+        return self.__regions[key]
+
+    def __compute_regions(self, band_height, margin):
+        if self.bbox is None:
+            return []
+        height, width = self.opaque.shape
+        spans = self.row_spans
+        regions = []
+        first = max(0, self.bbox[1] - margin)
+        last = min(height, self.bbox[3] + margin)
+        for top in range(first, last, band_height):
+            bottom = min(last, top + band_height)
+            rows = spans[max(0, top - margin):min(height, bottom + margin)]
+            rows = rows[rows[:, 1] > 0]
+            if len(rows) == 0:
+                continue
+            left = max(0, int(rows[:, 0].min()) - margin)
+            right = min(width, int(rows[:, 1].max()) + margin)
+            regions.append((top, bottom, left, right))
+        return regions
+
+    @property
+    def size(self):
+        """Size of the scaled mask."""
+        return self.band.size
+
+
+def prepare_mask(mask, downscale_factor=1, fast_downscale=False):
+    """Scales a mask for the given downscale factor.
+
+    :param mask: An image, must have only one band/channel.
+    :param downscale_factor: Factor to downscale the mask by.
+    :type downscale_factor: int
+    :param fast_downscale: Box reduce the mask instead of resizing it with LANCZOS.
+    :type fast_downscale: bool
+    :return: The prepared mask.
+    :rtype: PreparedMask
+    """
+    if mask is None:
+        raise TypeError("Invalid None type argument")
+    if len(mask.getbands()) != 1:
+        raise ValueError("Mask must have only one channel")
+    if downscale_factor < 1:
+        raise ValueError("Downscale factor must be grater than 1")
+
+    source_size = mask.size
+    if mask.mode != "L":
+        mask = mask.convert("L")
+    new_size = (mask.size[0] // downscale_factor, mask.size[1] // downscale_factor)
+    if downscale_factor == 1:
+        band = mask
+    elif fast_downscale:
+        band = mask.reduce(downscale_factor, box=(0, 0, new_size[0] * downscale_factor,
+                                                  new_size[1] * downscale_factor))
+    else:
+        band = mask.resize(new_size, Image.LANCZOS)
+    return PreparedMask(band, source_size, downscale_factor=downscale_factor, fast_downscale=fast_downscale)
+
+
+class MaskCache:
+    """Least recently used cache of prepared masks.
+    Masks are keyed by their path, modification time, scaled size, downscale
+    factor and downscale mode, so a mask file that changes on disk is
+    prepared again.
+
+    :param max_size: Maximum number of prepared masks kept.
+    :type max_size: int
+    """
+
+    def __init__(self, max_size=8):
+        if max_size < 1:
+            raise ValueError("Cache size must be at least 1")
+        self.max_size = max_size
+        self.__masks = OrderedDict()
+        self.__lock = threading.Lock()
+
+    def get(self, path, downscale_factor=1, fast_downscale=False):
+        """Returns the prepared mask for a mask file, preparing it if it isn't cached.
+
+        :param path: path to the mask image file
+        :type path: str
+        :param downscale_factor: Factor to downscale the mask by.
+        :type downscale_factor: int
+        :param fast_downscale: Box reduce the mask instead of resizing it with LANCZOS.
+        :type fast_downscale: bool
+        :rtype: PreparedMask
+        """
+        path = os.path.abspath(path)
+        with Image.open(path) as mask:
+            source_size = mask.size
+            key = (path, os.stat(path).st_mtime_ns,
+                   (source_size[0] // downscale_factor, source_size[1] // downscale_factor),
+                   downscale_factor, fast_downscale)
+            with self.__lock:
+                prepared = self.__masks.get(key)
+                if prepared is not None:
+                    self.__masks.move_to_end(key)
+                    return prepared
+            prepared = prepare_mask(mask, downscale_factor=downscale_factor, fast_downscale=fast_downscale)
+            prepared.path = path
+
+        with self.__lock:
+            self.__masks[key] = prepared
+            self.__masks.move_to_end(key)
+            while len(self.__masks) > self.max_size:
+                self.__masks.popitem(last=False)
+        return prepared
+
+    def clear(self):
+        """Removes every mask from the cache."""
+        with self.__lock:
+            self.__masks.clear()
+
+    def __len__(self):
+        return len(self.__masks)
+
+
+default_cache = MaskCache()
+
+
+def load_mask(path, downscale_factor=1, fast_downscale=False):
+    """Returns the prepared mask for a mask file using the shared cache.
+
+    :param path: path to the mask image file
+    :type path: str
+    :param downscale_factor: Factor to downscale the mask by.
+    :type downscale_factor: int
+    :param fast_downscale: Box reduce the mask instead of resizing it with LANCZOS.
+    :type fast_downscale: bool
+    :rtype: PreparedMask
+    """
+    return default_cache.get(path, downscale_factor=downscale_factor, fast_downscale=fast_downscale)
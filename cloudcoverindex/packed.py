@@ -0,0 +1,285 @@
+"""Compact files of segmented frames.
+
+A segmentation is only a white or black value for every pixel, and its alpha
+band is the mask, which is the same for every frame of a camera. Segmentation
+files (.cci) keep one bit per pixel, packed by rows as in a mode "1" image and
+compressed with zlib in strips of rows, together with a header holding the
+pixel counts and a reference to the mask file instead of the mask itself.
+
+A file starts with a fixed size header, followed by the mask reference as
+JSON, the offsets of the strips and the strips themselves:
+
+    magic (4 bytes), version (uint16), compression (uint8), reserved (uint8),
+    width, height (uint32), cloud pixels, total pixels (uint64),
+    strip height, mask reference size (uint32)
+
+All numbers are little endian. Files are read memory mapped, so the counts
+are read from the header alone and only the strips holding the requested
+rows are decompressed.
+"""
+import json
+import mmap
+import os
+import struct
+import zlib
+
+from PIL import Image
+
+from cloudcoverindex.masks import load_mask
+from cloudcoverindex.resultcache import hash_file
+
+# Extension of segmentation files, saving to a path with it writes a segmentation file
+EXTENSION = ".cci"
+MAGIC = b"CCIS"
+FORMAT_VERSION = 1
+# Rows of every compressed strip
+STRIP_HEIGHT = 64
+# Compression of the strips, by name and by the value stored in the header
+COMPRESSIONS = {"none": 0, "zlib": 1}
+
+_HEADER = struct.Struct("<4sHBBIIQQII")
+_OFFSET = struct.Struct("<Q")
+# Maps the segmented values, 0 or 255, to the bits of a mode "1" image
+_BITS = [0] + [255] * 255
+
+
+class MaskReference:
+    """Reference to the mask file a segmentation was computed with.
+
+    :param path: absolute path to the mask image file, None if the mask wasn't loaded from a file
+    :type path: str
+    :param sha256: hash of the mask file when the segmentation was written
+    :type sha256: str
+    :param downscale_factor: factor the mask was downscaled by
+    :type downscale_factor: int
+    :param fast_downscale: whether the mask was box reduced instead of resized with LANCZOS
+    :type fast_downscale: bool
+    """
+
+    def __init__(self, path, sha256, downscale_factor=1, fast_downscale=False):
+        self.path = path
+        self.sha256 = sha256
+        self.downscale_factor = downscale_factor
+        self.fast_downscale = fast_downscale
+
+    @classmethod
+    def from_mask(cls, mask):
+        """Builds the reference to a prepared mask.
+
+        :param mask: The prepared mask, its file is hashed if it has a path.
+        :type mask: PreparedMask
+        :rtype: MaskReference
+        """
+        path = getattr(mask, "path", None)
+        return cls(path, hash_file(path) if path is not None else None, mask.downscale_factor, mask.fast_downscale)
+
+    def load(self, verify=True):
+        """Loads the referenced mask through the shared mask cache.
+
+        :param verify: check that the mask file didn't change since the segmentation was written
+        :type verify: bool
+        :rtype: PreparedMask
+        """
+        if self.path is None:
+            raise ValueError("The segmentation doesn't reference a mask file")
+        if verify and self.sha256 is not None and hash_file(self.path) != self.sha256:
+            raise ValueError("Mask file changed since the segmentation was written: " + self.path)
+        return load_mask(self.path, downscale_factor=self.downscale_factor, fast_downscale=self.fast_downscale)
+
+    def to_json(self):
+        """Returns the reference as JSON, as stored in segmentation files.
+
+        :rtype: str
+        """
+        return json.dumps({"path": self.path, "sha256": self.sha256, "downscale_factor": self.downscale_factor,
+                           "fast_downscale": self.fast_downscale}, sort_keys=True)
+
+    @classmethod
+    def from_json(cls, text):
+        """Builds a reference from its JSON.
+
+        :param text: The reference, as returned by to_json.
+        :type text: str
+        :rtype: MaskReference
+        """
+        values = json.loads(text)
+        return cls(values["path"], values["sha256"], values["downscale_factor"], values["fast_downscale"])
+
+
+def write_segmentation(path, segmentation, mask=None, compression="zlib", strip_height=STRIP_HEIGHT):
+    """Writes a segmentation file.
+
+    :param path: path of the file
+    :type path: str
+    :param segmentation: The segmentation of a frame.
+    :type segmentation: Segmentation
+    :param mask: optional prepared mask of the frame, referenced by the file
+    :type mask: PreparedMask
+    :param compression: "zlib" or "none"
+    :type compression: str
+    :param strip_height: rows of every compressed strip
+    :type strip_height: int
+    """
+    if compression not in COMPRESSIONS:
+        raise ValueError("Unknown compression: " + str(compression))
+    if strip_height < 1:
+        raise ValueError("Strip height must be at least 1")
+    band = segmentation.band
+    if not isinstance(band, Image.Image):
+        band = Image.fromarray(band)
+    width, height = band.size
+    packed = band.point(_BITS, "1").tobytes()
+    row_bytes = (width + 7) // 8
+
+    strips = []
+    for top in range(0, height, strip_height):
+        strip = packed[top * row_bytes:min(height, top + strip_height) * row_bytes]
+        strips.append(zlib.compress(strip) if compression == "zlib" else strip)
+    reference = MaskReference.from_mask(mask).to_json().encode() if mask is not None else b""
+    offsets = [0]
+    for strip in strips:
+        offsets.append(offsets[-1] + len(strip))
+
+    with open(path, "wb") as file:
+        file.write(_HEADER.pack(MAGIC, FORMAT_VERSION, COMPRESSIONS[compression], 0, width, height,
+                                segmentation.cloud_pixels, segmentation.total_pixels, strip_height, len(reference)))
+        file.write(reference)
+        file.write(b"".join(_OFFSET.pack(offset) for offset in offsets))
+        file.write(b"".join(strips))
+
+
+def save_segmentation(segmentation, path, mask=None):
+    """Saves a segmentation as a segmentation file if the path ends with EXTENSION,
+    or else as an image in LA mode in the format of the extension.
+
+    :param segmentation: The segmentation of a frame.
+    :type segmentation: Segmentation
+    :param path: path to save the segmentation at
+    :type path: str
+    :param mask: optional prepared mask of the frame, referenced by segmentation files
+    :type mask: PreparedMask
+    """
+    if path.lower().endswith(EXTENSION):
+        write_segmentation(path, segmentation, mask=mask)
+    else:
+        segmentation.to_image().save(path)
+
+
+def read_counts(path):
+    """Reads the pixel counts of a segmentation file from its header only.
+
+    :param path: path of the file
+    :type path: str
+    :return: A tuple (cloud_pixels, total_pixels)
+    :rtype: tuple
+    """
+    with open(path, "rb") as file:
+        header = _parse_header(file.read(_HEADER.size))
+    return header[3], header[4]
+
+
+class SegmentationFile:
+    """A segmentation file, memory mapped. Use it as a context manager or close it.
+
+    :param path: path of the file
+    :type path: str
+    """
+
+    def __init__(self, path):
+        with open(path, "rb") as file:
+            if os.fstat(file.fileno()).st_size < _HEADER.size:
+                raise ValueError("Not a segmentation file: " + path)
+            self.__map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            (compression, width, height, self.cloud_pixels, self.total_pixels, self.strip_height,
+             reference_size) = _parse_header(self.__map[:_HEADER.size])
+            self.size = (width, height)
+            self.compression = compression
+            start = _HEADER.size + reference_size
+            reference = bytes(self.__map[_HEADER.size:start]).decode()
+            self.mask_reference = MaskReference.from_json(reference) if reference else None
+            strips = -(-height // self.strip_height)
+            self.__offsets = [_OFFSET.unpack_from(self.__map, start + i * _OFFSET.size)[0]
+                              for i in range(strips + 1)]
+            self.__payload = start + (strips + 1) * _OFFSET.size
+            if self.__payload + self.__offsets[-1] > len(self.__map):
+                raise ValueError("Truncated segmentation file: " + path)
+        except (struct.error, UnicodeDecodeError, json.JSONDecodeError, KeyError, TypeError) as error:
+            self.__map.close()
+            raise ValueError("Not a segmentation file: " + path) from error
+        except ValueError:
+            self.__map.close()
+            raise
+
+    @property
+    def cloud_cover_index(self):
+        """The cloud cover index of the segmentation."""
+        return self.cloud_pixels / self.total_pixels
+
+    def band(self, top=0, bottom=None):
+        """Decodes rows of the segmented band, only the strips holding them are decompressed.
+
+        :param top: first row
+        :type top: int
+        :param bottom: row after the last one, by default the height
+        :type bottom: int
+        :return: An image in L mode, with values 0 or 255.
+        """
+        width, height = self.size
+        bottom = height if bottom is None else bottom
+        if not 0 <= top <= bottom <= height:
+            raise ValueError("Rows out of the segmentation")
+        row_bytes = (width + 7) // 8
+        first, last = top // self.strip_height, -(-bottom // self.strip_height)
+        data = b"".join(self.__strip(i) for i in range(first, last))
+        skipped = (top - first * self.strip_height) * row_bytes
+        data = data[skipped:skipped + (bottom - top) * row_bytes]
+        return Image.frombytes("1", (width, bottom - top), data).convert("L")
+
+    def to_image(self, mask=None, verify=True):
+        """Rebuilds the segmented image, as saved by CloudCoverApp.
+
+        :param mask: prepared mask of the frame, by default the referenced mask is loaded
+        :type mask: PreparedMask
+        :param verify: when loading the referenced mask, check that its file didn't change
+        :type verify: bool
+        :return: An image in LA mode.
+        """
+        if mask is None:
+            if self.mask_reference is None:
+                raise ValueError("The segmentation doesn't reference a mask, it must be given")
+            mask = self.mask_reference.load(verify=verify)
+        if mask.band.size != self.size:
+            raise ValueError("Mask doesn't have the size of the segmentation")
+        return Image.merge("LA", (self.band(), mask.band))
+
+    def close(self):
+        """Unmaps the file."""
+        self.__map.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __strip(self, index):
+        start = self.__payload + self.__offsets[index]
+        strip = self.__map[start:self.__payload + self.__offsets[index + 1]]
+        return zlib.decompress(strip) if self.compression == "zlib" else strip
+
+
+def _parse_header(data):
+    # Checks the header and returns its fields after the version, the compression by name
+    if len(data) < _HEADER.size:
+        raise ValueError("Not a segmentation file")
+    magic, version, compression, _, width, height, cloud_pixels, total_pixels, strip_height, reference_size = \
+        _HEADER.unpack(data)
+    if magic != MAGIC:
+        raise ValueError("Not a segmentation file")
+    if version != FORMAT_VERSION:
+        raise ValueError("Unsupported segmentation file version: " + str(version))
+    names = {value: name for name, value in COMPRESSIONS.items()}
+    if compression not in names or strip_height < 1:
+        raise ValueError("Corrupted segmentation file header")
+    return names[compression], width, height, cloud_pixels, total_pixels, strip_height, reference_size
@@ -0,0 +1,321 @@
+"""Segmentation of a single frame on several processes.
+
+The RGB frame, the mask and the segmented band live in shared memory. The
+opaque part of the mask is split into the same rectangles the engine uses,
+and every worker segments a contiguous group of them straight from the
+shared frame into the shared band, returning only its cloud pixel count.
+Rectangles don't overlap, so the band is complete once every worker is
+done and nothing has to be merged or copied back.
+
+Only decoding the frame is left to this process, which copies the decoded
+pixels under the mask into shared memory. Downscaling is split between the
+workers: a box reduction by groups of rows, and a LANCZOS resize in the two
+passes pillow makes, horizontal by groups of rows and then vertical by
+groups of columns, so the frame is the same as crop_and_scale returns.
+
+Decoding and the copy bound the speedup of more workers: with them taking a
+time d and the rest of a frame a time s on one worker, a frame takes at least
+d + s / workers. Over the sample images with the 2700x2700 mask, one worker
+takes 0.18 s per frame at downscale factor 1 and 0.20 s at factor 4 (LANCZOS),
+and 0.10 s and 0.12 s for frames that are already decoded. With decoding at
+about 0.08 s and the copy at 0.01-0.015 s, 8 workers can make frames at most
+1.8x (factor 1) and 1.9x (factor 4) as fast, and already decoded frames about
+4.4x as fast, never 8x. These bounds are estimates from those times: the
+ParallelSegmenter benchmarks only ran on a single CPU, where 2 to 8 workers
+took 0.87-1.02x the time of one.
+
+Requires numpy and python 3.8 or newer, for multiprocessing.shared_memory.
+"""
+import atexit
+import multiprocessing
+import os
+import threading
+from collections import OrderedDict
+
+from PIL import Image
+
+from cloudcoverindex.engine import BAND_HEIGHT, Segmentation, segment
+from cloudcoverindex.filters import crop_and_scale, decode_for_mask, red_blue_white, convolution_slab
+from cloudcoverindex.masks import PreparedMask, prepare_mask
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+try:
+    from multiprocessing import shared_memory
+except ImportError:
+    shared_memory = None
+
+# Number of rows copied at a time from the decoded frame into shared memory
+COPY_ROWS = 256
+
+# Number of segmenters kept by segment_parallel, for the masks segmented last
+SEGMENTERS = 2
+
+# Shared arrays and parameters of the worker processes
+_worker_state = None
+
+# Segmenters kept by segment_parallel by mask, number of workers and parameters, least recently used first
+_segmenters = OrderedDict()
+_segmenters_lock = threading.Lock()
+
+
+class ParallelSegmenter:
+    """Segments frames on a pool of processes that share the frame memory.
+    The pool and the shared memory are created once and reused for every frame
+    with the same mask, so the segmenter can be kept for a stream of frames.
+    Decoding stays in this process, which caps the speedup of more workers at about
+    2x for JPEG images, see the module documentation.
+
+    :param mask: The prepared mask of the frames.
+    :type mask: PreparedMask
+    :param workers: Number of worker processes, by default the number of CPUs.
+    :type workers: int
+    :param ratio_threshold: Red/Blue ratios bigger than this value produce a white pixel.
+    :param window_size: Width and height of the convolution window, must be odd.
+    :param low_threshold: Counts lower or equal than this value produce a black pixel.
+    :param high_threshold: Counts greater than this value produce a white pixel.
+    """
+
+    def __init__(self, mask, workers=None, ratio_threshold=0.95, window_size=5, low_threshold=7,
+                 high_threshold=16):
+        if shared_memory is None:
+            raise RuntimeError("Shared memory requires python 3.8 or newer")
+        if workers is None:
+            workers = os.cpu_count() or 1
+        if workers < 1:
+            raise ValueError("Number of workers must be at least 1")
+        self.mask = mask
+        self.workers = workers
+        self.__parameters = (ratio_threshold, window_size, low_threshold, high_threshold)
+        width, height = mask.size
+        self.__shape = (height, width)
+        self.__memory = []
+        self.__pool = None
+        try:
+            self.__rgb, rgb_name = self.__shared_array((height, width, 3))
+            self.__band, band_name = self.__shared_array((height, width))
+            alpha, alpha_name = self.__shared_array((height, width))
+            alpha[...] = mask.alpha
+            # Decoded frames are copied here when they still have to be downscaled, and resized
+            # horizontally into the middle frame before being resized vertically
+            source_width, source_height = mask.source_size
+            self.__source, source_name = None, None
+            middle_name = None
+            if mask.downscale_factor != 1:
+                self.__source, source_name = self.__shared_array((source_height * source_width * 3,))
+                if not mask.fast_downscale:
+                    _, middle_name = self.__shared_array((source_height * width * 3,))
+            margin = window_size // 2
+            self.__tasks = _split_regions(mask.regions(BAND_HEIGHT, margin), workers)
+            self.__pool = multiprocessing.Pool(workers, initializer=_init_worker,
+                                               initargs=(rgb_name, band_name, alpha_name, source_name, middle_name,
+                                                         self.__shape, self.__parameters))
+        except Exception:
+            self.close()
+            raise
+
+    def __shared_array(self, shape):
+        memory = shared_memory.SharedMemory(create=True, size=max(1, int(np.prod(shape))))
+        self.__memory.append(memory)
+        return np.ndarray(shape, dtype=np.uint8, buffer=memory.buf), memory.name
+
+    def segment(self, image):
+        """Segments a frame, which is cropped and scaled to the mask first.
+        The band of the returned segmentation is a view of the shared memory, it is
+        only valid until the next frame is segmented or the segmenter is closed.
+
+        :param image: An image, must be in RGB mode.
+        :return: The segmentation of the frame.
+        :rtype: Segmentation
+        """
+        height, width = self.__shape
+        if height < self.__parameters[1] or width < self.__parameters[1]:
+            # Frames smaller than the window are left as they are, which the engine handles
+            return segment(np.asarray(crop_and_scale(image, self.mask)[0]), self.mask.alpha, *self.__parameters)
+        image, box, reduce_factor = decode_for_mask(image, self.mask)
+        if reduce_factor == 1:
+            self.__copy(image, box, self.__rgb)
+        else:
+            self.__scale(image, box, reduce_factor)
+        del image
+
+        self.__band.fill(0)
+        cloud_pixels = sum(self.__pool.map(_segment_regions, self.__tasks, chunksize=1))
+        return Segmentation(self.__band, self.mask.alpha, cloud_pixels, self.mask.opaque_pixels)
+
+    def __scale(self, image, box, reduce_factor):
+        left, upper, right, lower = box
+        shape = (lower - upper, right - left, 3)
+        self.__copy(image, box, self.__source[:int(np.prod(shape))].reshape(shape))
+        height, width = self.__shape
+        if self.mask.fast_downscale:
+            self.__pool.map(_reduce_rows, [(top, bottom, shape, reduce_factor)
+                                           for top, bottom in _split_range(height, self.workers)], chunksize=1)
+            return
+        self.__pool.map(_resize_rows, [(top, bottom, shape) for top, bottom in _split_range(shape[0], self.workers)],
+                        chunksize=1)
+        self.__pool.map(_resize_columns, [(left, right, shape[0]) for left, right in _split_range(width, self.workers)],
+                        chunksize=1)
+
+    @staticmethod
+    def __copy(image, box, target):
+        left, upper, right, lower = box
+        for top in range(0, lower - upper, COPY_ROWS):
+            bottom = min(lower - upper, top + COPY_ROWS)
+            target[top:bottom] = np.asarray(image.crop((left, upper + top, right, upper + bottom)))
+
+    def close(self):
+        """Stops the worker processes and releases the shared memory."""
+        if self.__pool is not None:
+            self.__pool.close()
+            self.__pool.join()
+            self.__pool = None
+        self.__rgb = self.__band = self.__source = None
+        for memory in self.__memory:
+            memory.close()
+            memory.unlink()
+        self.__memory = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def segment_parallel(image, mask, downscale_factor=1, fast_downscale=False, workers=None, **parameters):
+    """Segments a single frame on a pool of processes, see ParallelSegmenter.
+    The segmenters of the last SEGMENTERS prepared masks are kept, so the pool and the shared
+    memory are created once for a stream of frames with the same PreparedMask, such as those
+    of the shared mask cache, and not for every frame. Frames are segmented one at a time,
+    each one already uses every worker. Kept segmenters are closed when replaced, by
+    close_segmenters or when the program exits. The image is decoded in this process, which
+    caps the speedup of more workers, see ParallelSegmenter.
+
+    :param image: An image, must be in RGB mode.
+    :param mask: An image, must have only one band/channel, or a PreparedMask.
+    :param downscale_factor: An optional factor to downscale the image, replaced by that of a PreparedMask.
+    :type downscale_factor: int
+    :param fast_downscale: Use decode time scaling and box reduction instead of LANCZOS.
+    :type fast_downscale: bool
+    :param workers: Number of worker processes, by default the number of CPUs.
+    :type workers: int
+    :param parameters: Thresholds and window size of the filters, as taken by ParallelSegmenter.
+    :return: The segmentation of the frame.
+    :rtype: Segmentation
+    """
+    if not isinstance(mask, PreparedMask):
+        mask = prepare_mask(mask, downscale_factor=downscale_factor, fast_downscale=fast_downscale)
+    if workers is None:
+        workers = os.cpu_count() or 1
+    key = (mask, workers, tuple(sorted(parameters.items())))
+    with _segmenters_lock:
+        segmenter = _segmenters.pop(key, None)
+        if segmenter is None:
+            segmenter = ParallelSegmenter(mask, workers=workers, **parameters)
+        _segmenters[key] = segmenter
+        while len(_segmenters) > SEGMENTERS:
+            _segmenters.popitem(last=False)[1].close()
+        segmentation = segmenter.segment(image)
+        # The shared band is overwritten by the next frame
+        segmentation.band = segmentation.band.copy()
+    return segmentation
+
+
+def close_segmenters():
+    """Closes the segmenters kept by segment_parallel, stopping their worker processes."""
+    with _segmenters_lock:
+        while _segmenters:
+            _segmenters.popitem()[1].close()
+
+
+atexit.register(close_segmenters)
+
+
+def _split_regions(regions, workers):
+    # Contiguous groups of regions with about the same number of pixels each
+    areas = [(bottom - top) * (right - left) for top, bottom, left, right in regions]
+    total = sum(areas)
+    groups = []
+    group = []
+    done = 0
+    for region, area in zip(regions, areas):
+        group.append(region)
+        done += area
+        if done * workers >= total * (len(groups) + 1):
+            groups.append(group)
+            group = []
+    if group:
+        groups.append(group)
+    return groups
+
+
+def _split_range(length, parts):
+    # Contiguous ranges of about the same length, without empty ones
+    bounds = [length * part // parts for part in range(parts + 1)]
+    return [(start, stop) for start, stop in zip(bounds, bounds[1:]) if start < stop]
+
+
+def _init_worker(rgb_name, band_name, alpha_name, source_name, middle_name, shape, parameters):
+    global _worker_state
+    names = (rgb_name, band_name, alpha_name, source_name, middle_name)
+    memory = [shared_memory.SharedMemory(name=name) if name is not None else None for name in names]
+    height, width = shape
+    rgb = np.ndarray((height, width, 3), dtype=np.uint8, buffer=memory[0].buf)
+    band = np.ndarray((height, width), dtype=np.uint8, buffer=memory[1].buf)
+    opaque = np.ndarray((height, width), dtype=np.uint8, buffer=memory[2].buf) != 0
+    _worker_state = (memory, rgb, band, opaque, parameters)
+
+
+def _shared_frame(memory, shape):
+    return np.ndarray(shape, dtype=np.uint8, buffer=memory.buf)
+
+
+def _reduce_rows(task):
+    # Box reduces the source rows of a group of rows of the frame
+    top, bottom, source_shape, reduce_factor = task
+    memory, rgb = _worker_state[:2]
+    source = _shared_frame(memory[3], source_shape)
+    rows = Image.fromarray(source[top * reduce_factor:bottom * reduce_factor])
+    rgb[top:bottom] = np.asarray(rows.reduce(reduce_factor))
+
+
+def _resize_rows(task):
+    # Horizontal pass of the LANCZOS resize, over a group of rows of the source frame
+    top, bottom, source_shape = task
+    memory, rgb = _worker_state[:2]
+    source = _shared_frame(memory[3], source_shape)
+    middle = _shared_frame(memory[4], (source_shape[0], rgb.shape[1], 3))
+    rows = Image.fromarray(source[top:bottom])
+    middle[top:bottom] = np.asarray(rows.resize((rgb.shape[1], bottom - top), Image.LANCZOS))
+
+
+def _resize_columns(task):
+    # Vertical pass of the LANCZOS resize, over a group of columns of the frame
+    left, right, source_height = task
+    memory, rgb = _worker_state[:2]
+    middle = _shared_frame(memory[4], (source_height, rgb.shape[1], 3))
+    columns = Image.fromarray(middle[:, left:right])
+    rgb[:, left:right] = np.asarray(columns.resize((right - left, rgb.shape[0]), Image.LANCZOS))
+
+
+def _segment_regions(regions):
+    _, rgb, band, opaque, parameters = _worker_state
+    ratio_threshold, window_size, low_threshold, high_threshold = parameters
+    height, width = band.shape
+    margin = window_size // 2
+    cloud_pixels = 0
+    for top, bottom, left, right in regions:
+        input_top = max(0, top - margin)
+        input_bottom = min(height, bottom + margin)
+        white = red_blue_white(rgb[input_top:input_bottom, left:right], opaque[input_top:input_bottom, left:right],
+                               ratio_threshold)
+        output = convolution_slab(white.astype(np.uint8) * 255, window_size, low_threshold, high_threshold,
+                                  offset=(input_top, left), image_shape=(height, width))
+        output = output[top - input_top:bottom - input_top]
+        band[top:bottom, left:right] = output
+        cloud_pixels += int(np.count_nonzero((output == 255) & opaque[top:bottom, left:right]))
+    return cloud_pixels
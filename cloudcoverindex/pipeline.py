@@ -0,0 +1,84 @@
+"""Prefetching pipeline that overlaps decoding, computing and saving.
+
+Images are decoded, cropped and scaled by a pool of background threads
+while the current image is being segmented, and segmented images are
+saved by a writer thread. Pillow releases the GIL while decoding, resizing
+and encoding, so the three stages run at the same time. The number of
+decoded frames and of pending saves is bounded, keeping memory use
+constant on long runs.
+"""
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from cloudcoverindex.engine import segment
+from cloudcoverindex.packed import save_segmentation
+from cloudcoverindex.rawframes import load_frame_file
+from cloudcoverindex.results import ImageResult, describe_error
+
+
+def run_pipeline(paths, mask, save_paths=None, decode_threads=2, prefetch=4, write_queue=4, frame_size=None):
+    """Processes several images, yielding their results in input order.
+
+    :param paths: paths to the image files, or to uncompressed frames, see cloudcoverindex.rawframes
+    :type paths: list
+    :param mask: The mask to apply.
+    :type mask: PreparedMask
+    :param save_paths: optional paths to save each segmented image at, None entries aren't saved
+    :type save_paths: list
+    :param decode_threads: number of threads decoding images
+    :type decode_threads: int
+    :param prefetch: maximum number of images decoded ahead of the one being segmented
+    :type prefetch: int
+    :param write_queue: maximum number of segmented images waiting to be saved
+    :type write_queue: int
+    :param frame_size: width and height of raw frames
+    :type frame_size: tuple
+    :return: An iterator of ImageResult.
+    """
+    if decode_threads < 1 or prefetch < 1 or write_queue < 1:
+        raise ValueError("Threads and queue depths must be at least 1")
+    paths = list(paths)
+    if save_paths is None:
+        save_paths = [None] * len(paths)
+    tasks = iter(zip(paths, save_paths))
+
+    decoded = deque()
+    pending = deque()
+    with ThreadPoolExecutor(decode_threads) as decoder, ThreadPoolExecutor(1) as writer:
+        def fill():
+            for path, save_path in tasks:
+                decoded.append((path, save_path, decoder.submit(load_frame_file, path, mask, frame_size)))
+                if len(decoded) >= prefetch:
+                    break
+
+        fill()
+        while decoded:
+            path, save_path, frame = decoded.popleft()
+            fill()
+            try:
+                segmentation = segment(*frame.result(), mask=mask)
+            except Exception as error:
+                pending.append((ImageResult(path, error=describe_error(error)), None))
+            else:
+                result = ImageResult(path, segmentation.cloud_pixels, segmentation.total_pixels,
+                                     save_path=save_path)
+                saved = None
+                if save_path is not None:
+                    saved = writer.submit(save_segmentation, segmentation, save_path, mask)
+                pending.append((result, saved))
+
+            # Results are yielded once their image is saved, blocking only when the write queue is full
+            while pending and (len(pending) > write_queue or pending[0][1] is None or pending[0][1].done()):
+                yield _finish(*pending.popleft())
+
+        while pending:
+            yield _finish(*pending.popleft())
+
+
+def _finish(result, saved):
+    if saved is not None:
+        try:
+            saved.result()
+        except Exception as error:
+            result = ImageResult(result.path, error=describe_error(error))
+    return result
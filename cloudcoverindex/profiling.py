@@ -0,0 +1,161 @@
+"""Opt-in instrumentation of the processing stages.
+
+A Profiler records the wall time, the CPU time and the peak memory
+allocated by every stage it is given to, such as decoding, cropping or
+the R/B filter. Memory is measured with tracemalloc, which sees the
+allocations made by python and numpy but not those made inside pillow.
+The peak of a stage needs tracemalloc.reset_peak, which is only in python
+3.9 and newer. On older versions the peak memory of the stages is None.
+Functions that accept a profiler do nothing extra when it is None.
+"""
+import json
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+# Whether the peak memory of the stages can be measured, tracemalloc can only reset its peak on python 3.9+
+MEASURES_PEAKS = hasattr(tracemalloc, "reset_peak")
+
+# Names of the stages recorded by the filters, the engine and CloudCoverApp
+STAGES = ("decode", "crop", "resize", "merge", "red_blue", "convolution", "select", "count", "save")
+
+
+class StageStats:
+    """Measurements of a stage, accumulated over every time it ran.
+
+    :param name: Name of the stage.
+    :type name: str
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.calls = 0
+        self.wall_time = 0.0
+        self.cpu_time = 0.0
+        # Peak of the memory allocated while the stage ran, in bytes, None if it can't be measured
+        self.peak_memory = 0
+
+    def to_dict(self):
+        """Returns the measurements as a dictionary.
+
+        :rtype: dict
+        """
+        return {"calls": self.calls, "wall_time": self.wall_time, "cpu_time": self.cpu_time,
+                "peak_memory": self.peak_memory}
+
+
+class Profiler:
+    """Records the measurements of the processing stages.
+    Memory is only traced if trace_memory is set, tracemalloc is started when
+    the profiler is created and stopped when it is closed, unless it was
+    already running. Without MEASURES_PEAKS memory isn't traced and the peak
+    memory of every stage is None, instead of the peak since tracing started.
+
+    :param trace_memory: Whether the peak memory of each stage is measured.
+    :type trace_memory: bool
+    """
+
+    def __init__(self, trace_memory=True):
+        self.stages = {}
+        self.trace_memory = trace_memory
+        self.__started_tracing = False
+        # Highest absolute peak seen by the stages that are running, innermost last
+        self.__peaks = []
+        if trace_memory and MEASURES_PEAKS and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self.__started_tracing = True
+
+    @contextmanager
+    def stage(self, name):
+        """Context manager that measures the code it runs as the given stage.
+        Stages can be nested, the time and memory of an inner stage also count for the outer one.
+
+        :param name: Name of the stage.
+        :type name: str
+        """
+        stats = self.stages.get(name)
+        if stats is None:
+            stats = self.stages[name] = StageStats(name)
+            if self.trace_memory and not MEASURES_PEAKS:
+                stats.peak_memory = None
+        start_memory = self.__start_peak()
+        start_wall = time.perf_counter()
+        start_cpu = time.process_time()
+        try:
+            yield stats
+        finally:
+            stats.wall_time += time.perf_counter() - start_wall
+            stats.cpu_time += time.process_time() - start_cpu
+            stats.calls += 1
+            if start_memory is not None:
+                stats.peak_memory = max(stats.peak_memory, self.__end_peak() - start_memory)
+
+    def __start_peak(self):
+        if not self.trace_memory or not MEASURES_PEAKS or not tracemalloc.is_tracing():
+            return None
+        current, peak = tracemalloc.get_traced_memory()
+        if self.__peaks:
+            self.__peaks[-1] = max(self.__peaks[-1], peak)
+        self.__peaks.append(current)
+        tracemalloc.reset_peak()
+        return current
+
+    def __end_peak(self):
+        peak = max(self.__peaks.pop(), tracemalloc.get_traced_memory()[1])
+        if self.__peaks:
+            self.__peaks[-1] = max(self.__peaks[-1], peak)
+        return peak
+
+    def to_dict(self):
+        """Returns the measurements of every stage as a dictionary.
+
+        :rtype: dict
+        """
+        return {"stages": {name: stats.to_dict() for name, stats in self.stages.items()}}
+
+    def write_json(self, path):
+        """Writes the measurements of every stage to a JSON file.
+
+        :param path: path to the JSON file
+        :type path: str
+        """
+        with open(path, "w") as file:
+            json.dump(self.to_dict(), file, indent=2)
+
+    def close(self):
+        """Stops tracing memory if the profiler started it."""
+        if self.__started_tracing:
+            tracemalloc.stop()
+            self.__started_tracing = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class _NoStage:
+    """Context manager that does nothing, used when there is no profiler."""
+
+    def __enter__(self):
+        return None
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_no_stage = _NoStage()
+
+
+def stage(profiler, name):
+    """Returns a context manager measuring the given stage, or doing nothing if profiler is None.
+
+    :param profiler: The profiler, or None.
+    :type profiler: Profiler
+    :param name: Name of the stage.
+    :type name: str
+    """
+    if profiler is None:
+        return _no_stage
+    return profiler.stage(name)
@@ -0,0 +1,165 @@
+"""Uncompressed frames, read memory mapped instead of decoded.
+
+Some cameras dump their frames uncompressed, which skips JPEG decoding, the
+largest fixed cost of processing a frame. Two kinds of files are accepted:
+NumPy files (.npy) holding a uint8 array of shape (height, width, 3), and raw
+files (.rgb or .raw) holding the RGB values of the pixels row after row, whose
+width and height must be given as the frame size.
+
+Files are memory mapped and cropped to the mask with a view instead of a copy,
+so at the scale of the mask the filters read the pixels straight from the
+mapped file and only the pages of the cropped rows are read from disk.
+Downscaled frames are resized from the cropped view, as crop_and_scale does
+with decoded images.
+
+Requires numpy.
+"""
+import os
+
+from PIL import Image
+
+from cloudcoverindex.engine import load_frame
+from cloudcoverindex.masks import PreparedMask, prepare_mask
+from cloudcoverindex.profiling import stage
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+NPY_EXTENSION = ".npy"
+RAW_EXTENSIONS = (".rgb", ".raw")
+# First bytes of every .npy file
+NPY_MAGIC = b"\x93NUMPY"
+
+
+def is_raw_frame(path):
+    """Checks whether a path is that of an uncompressed frame, from its extension.
+
+    :param path: path to the file, any other source of an image, such as a file object, isn't one
+    :type path: str
+    :rtype: bool
+    """
+    if not isinstance(path, (str, os.PathLike)):
+        return False
+    return os.fspath(path).lower().endswith((NPY_EXTENSION,) + RAW_EXTENSIONS)
+
+
+def is_raw_frame_file(path):
+    """Checks whether a file is an uncompressed frame, .npy files from their first bytes
+    and raw files from their extension only.
+
+    :param path: path to the file
+    :type path: str
+    :rtype: bool
+    :raises OSError: if a .npy file can't be read
+    """
+    if not is_raw_frame(path):
+        return False
+    if not os.fspath(path).lower().endswith(NPY_EXTENSION):
+        return os.path.isfile(path)
+    with open(path, "rb") as file:
+        return file.read(len(NPY_MAGIC)) == NPY_MAGIC
+
+
+def open_raw_frame(path, frame_size=None):
+    """Memory maps an uncompressed frame, read only.
+
+    :param path: path to a .npy file or a raw file
+    :type path: str
+    :param frame_size: width and height of raw frames, .npy files have their own
+    :type frame_size: tuple
+    :return: A uint8 array of shape (height, width, 3) backed by the file.
+    """
+    if np is None:
+        raise RuntimeError("Raw frames require numpy")
+    path = os.fspath(path)
+    if path.lower().endswith(NPY_EXTENSION):
+        rgb = np.load(path, mmap_mode="r", allow_pickle=False)
+        if rgb.dtype != np.uint8 or rgb.ndim != 3 or rgb.shape[2] != 3:
+            raise ValueError("Frame must be a uint8 array of shape (height, width, 3): " + path)
+        return rgb
+    if frame_size is None:
+        raise ValueError("The frame size of raw frames must be given: " + path)
+    width, height = frame_size
+    if width < 1 or height < 1:
+        raise ValueError("Frame width and height must be at least 1")
+    if os.path.getsize(path) != width * height * 3:
+        raise ValueError("Raw frame doesn't have %dx%d RGB pixels: %s" % (width, height, path))
+    return np.memmap(path, dtype=np.uint8, mode="r", shape=(height, width, 3))
+
+
+def crop_frame(rgb, mask, profiler=None):
+    """Crops and scales a frame array to its mask, the counterpart of crop_and_scale for arrays.
+    The frame is cropped to the center with a view. At a downscale factor of 1 no pixel is
+    copied, otherwise the cropped view is resized with LANCZOS, or box reduced with fast_downscale.
+
+    :param rgb: uint8 array of shape (height, width, 3) with the frame.
+    :param mask: An image, must have only one band/channel, or a PreparedMask.
+    :param profiler: An optional profiler recording the crop and resize stages.
+    :type profiler: Profiler
+    :return: A tuple (rgb, alpha) with arrays of shape (height, width, 3) and (height, width).
+    """
+    if not isinstance(mask, PreparedMask):
+        with stage(profiler, "resize"):
+            mask = prepare_mask(mask)
+    height, width = rgb.shape[:2]
+    mask_width, mask_height = mask.source_size
+    if mask_width > width or mask_height > height:
+        raise ValueError("Both width and height of mask must be smaller than width and height of image")
+    factor = mask.downscale_factor
+    with stage(profiler, "crop"):
+        left = (width - mask_width) // 2
+        upper = (height - mask_height) // 2
+        new_width, new_height = mask.size
+        if mask.fast_downscale:
+            # Only the pixels of whole boxes are reduced
+            mask_width, mask_height = new_width * factor, new_height * factor
+        rgb = rgb[upper:upper + mask_height, left:left + mask_width]
+    if factor == 1:
+        return rgb, mask.alpha
+    with stage(profiler, "resize"):
+        image = Image.fromarray(np.ascontiguousarray(rgb))
+        if mask.fast_downscale:
+            image = image.reduce(factor)
+        else:
+            image = image.resize((new_width, new_height), Image.LANCZOS)
+        return np.asarray(image), mask.alpha
+
+
+def load_raw_frame(path, mask, frame_size=None, profiler=None):
+    """Memory maps an uncompressed frame and crops and scales it to its mask, as engine.load_frame does.
+
+    :param path: path to a .npy file or a raw file
+    :type path: str
+    :param mask: An image, must have only one band/channel, or a PreparedMask.
+    :param frame_size: width and height of raw frames, .npy files have their own
+    :type frame_size: tuple
+    :param profiler: An optional profiler recording the decode, crop and resize stages.
+    :type profiler: Profiler
+    :return: A tuple (rgb, alpha) with arrays of shape (height, width, 3) and (height, width).
+    """
+    with stage(profiler, "decode"):
+        rgb = open_raw_frame(path, frame_size)
+    return crop_frame(rgb, mask, profiler=profiler)
+
+
+def load_frame_file(path, mask, frame_size=None, profiler=None):
+    """Loads a frame file cropped and scaled to its mask, whatever its format.
+    Uncompressed frames are memory mapped, any other file is decoded by pillow.
+
+    :param path: path to the frame file
+    :type path: str
+    :param mask: An image, must have only one band/channel, or a PreparedMask.
+    :param frame_size: width and height of raw frames
+    :type frame_size: tuple
+    :param profiler: An optional profiler recording the decode, crop and resize stages.
+    :type profiler: Profiler
+    :return: A tuple (rgb, alpha) as returned by engine.load_frame.
+    """
+    if is_raw_frame(path):
+        return load_raw_frame(path, mask, frame_size=frame_size, profiler=profiler)
+    with stage(profiler, "decode"):
+        image = Image.open(path)
+    with image:
+        return load_frame(image, mask, profiler=profiler)
@@ -0,0 +1,265 @@
+"""Coarse to fine segmentation.
+
+The frame is first segmented at a coarser resolution, box reduced from the
+full resolution frame. Most of the sky and of the clouds is decided there:
+a pixel whose window has few or many white pixels is black or white whatever
+the exact values of its neighbours. Coarse pixels whose window count falls
+between the thresholds keep their R/B value, so they depend on the fine
+detail, and so do the pixels on the boundary between clouds and sky. The
+blocks of the frame holding any of them are segmented again at full
+resolution, and every other pixel takes the value of its coarse pixel.
+
+Refined blocks are exact, each one is computed with the halo its windows need.
+The result is an approximation of the full resolution segmentation whose
+accuracy and cost depend on how much of the frame is refined, which is
+reported in the segmentation.
+
+The mode is opt-in and saves little. On the sample images at a downscale
+factor of 1, 19-32% of the opaque pixels are refined. Against the engine
+restricted to the mask regions, which takes about 0.08 s per decoded frame,
+a coarse factor of 4 with blocks of 8 ran 0.99 to 1.14 times as fast, with
+index errors up to 0.0005, and a coarse factor of 8 with blocks of 4 ran
+1.16 to 1.21 times as fast, with errors up to 0.0018.
+
+The fused engine is already a few vectorized passes per pixel, so reducing,
+upscaling and padding cost about as much as the skipped work. At a downscale
+factor of 2 no setting is faster. Decoding the frame isn't saved either: the
+refined blocks cover the whole frame, so it is always decoded at full
+resolution, and fast_downscale is the cheaper way of trading accuracy for
+time. The benchmark suite times both settings.
+"""
+import threading
+import weakref
+
+from PIL import Image
+
+from cloudcoverindex.engine import Segmentation, load_frame, segment
+from cloudcoverindex.filters import red_blue_white, window_counts, select_output_array, keep_border
+from cloudcoverindex.masks import PreparedMask
+from cloudcoverindex.profiling import stage
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Factor the frame is reduced by for the coarse segmentation
+COARSE_FACTOR = 4
+# Width and height of the refined blocks, in coarse pixels
+BLOCK_SIZE = 8
+# Maximum number of blocks refined together
+REFINED_BLOCKS = 256
+
+# Segmenters with the default parameters of every prepared mask in use, by coarse factor
+_segmenters = weakref.WeakKeyDictionary()
+_segmenters_lock = threading.Lock()
+
+
+class RefinedSegmentation(Segmentation):
+    """Segmentation computed coarse to fine.
+
+    :param refined_fraction: Fraction of the opaque pixels that were segmented at full resolution.
+    :type refined_fraction: float
+    """
+
+    def __init__(self, band, alpha, cloud_pixels, total_pixels, refined_fraction):
+        super().__init__(band, alpha, cloud_pixels, total_pixels)
+        self.refined_fraction = refined_fraction
+
+
+class CoarseToFineSegmenter:
+    """Segments frames coarse to fine, the coarse mask is prepared once for every frame.
+
+    :param mask: The prepared mask of the frames, at full resolution.
+    :type mask: PreparedMask
+    :param coarse_factor: Factor the frames are reduced by for the coarse segmentation.
+    :type coarse_factor: int
+    :param block_size: Width and height of the refined blocks, in coarse pixels.
+    :type block_size: int
+    :param ratio_threshold: Red/Blue ratios bigger than this value produce a white pixel.
+    :param window_size: Width and height of the convolution window, must be odd.
+    :param low_threshold: Counts lower or equal than this value produce a black pixel.
+    :param high_threshold: Counts greater than this value produce a white pixel.
+    """
+
+    def __init__(self, mask, coarse_factor=COARSE_FACTOR, block_size=BLOCK_SIZE, ratio_threshold=0.95,
+                 window_size=5, low_threshold=7, high_threshold=16):
+        if coarse_factor < 1 or block_size < 1:
+            raise ValueError("Coarse factor and block size must be at least 1")
+        self.mask = mask
+        self.coarse_factor = coarse_factor
+        self.block_size = block_size
+        self.__parameters = (ratio_threshold, window_size, low_threshold, high_threshold)
+        # Partially covered boxes at the right and bottom are reduced too, so every pixel has a coarse pixel
+        band = mask.band.reduce(coarse_factor) if coarse_factor > 1 else mask.band
+        self.coarse_mask = PreparedMask(band, mask.source_size, mask.downscale_factor * coarse_factor,
+                                        fast_downscale=True)
+        self.__padded_opaque = None
+        if np is not None:
+            # Frames are split into blocks, padded by the window margin and up to whole blocks.
+            # Pixels outside the frame are black, as in the convolution of the whole frame
+            height, width = mask.alpha.shape
+            block_pixels = block_size * coarse_factor
+            self.__blocks = (-(-height // block_pixels), -(-width // block_pixels))
+            margin = window_size // 2
+            self.__padding = ((margin, self.__blocks[0] * block_pixels - height + margin),
+                              (margin, self.__blocks[1] * block_pixels - width + margin))
+            self.__padded_opaque = np.pad(mask.opaque, self.__padding)
+
+    def segment(self, rgb, profiler=None):
+        """Segments a frame coarse to fine.
+        Without numpy, or when the coarse frame is smaller than the window, the frame
+        is segmented at full resolution.
+
+        :param rgb: uint8 array of shape (height, width, 3) with the frame cropped and scaled to the mask,
+            as returned by engine.load_frame, or an RGB image without numpy.
+        :param profiler: An optional profiler recording the resize, red_blue, convolution and count stages.
+        :type profiler: Profiler
+        :return: The segmentation of the frame.
+        :rtype: RefinedSegmentation
+        """
+        window_size = self.__parameters[1]
+        width, height = self.coarse_mask.size
+        if np is None or height < window_size or width < window_size:
+            alpha = self.mask.band if np is None else self.mask.alpha
+            segmentation = segment(rgb, alpha, *self.__parameters, mask=self.mask if np is not None else None,
+                                   profiler=profiler)
+            return RefinedSegmentation(segmentation.band, segmentation.alpha, segmentation.cloud_pixels,
+                                       segmentation.total_pixels, 1.0)
+
+        coarse_band, uncertain = self.__segment_coarse(rgb, profiler)
+        height, width = self.mask.alpha.shape
+        rows, columns = self.__blocks
+        block_pixels = self.block_size * self.coarse_factor
+        # Band padded to whole blocks, seen as a (rows, columns, block, block) array of blocks
+        padded = np.zeros((rows * self.block_size, columns * self.block_size), dtype=np.uint8)
+        padded[:coarse_band.shape[0], :coarse_band.shape[1]] = coarse_band
+        padded = np.repeat(np.repeat(padded, self.coarse_factor, axis=0), self.coarse_factor, axis=1)
+        blocks = padded.reshape(rows, block_pixels, columns, block_pixels).swapaxes(1, 2)
+
+        selected = self.__uncertain_blocks(uncertain)
+        if len(selected[0]):
+            padded_rgb = np.pad(rgb, self.__padding + ((0, 0),))
+            for first in range(0, len(selected[0]), REFINED_BLOCKS):
+                block_rows = selected[0][first:first + REFINED_BLOCKS]
+                block_columns = selected[1][first:first + REFINED_BLOCKS]
+                blocks[block_rows, block_columns] = self.__segment_blocks(padded_rgb, block_rows, block_columns,
+                                                                          profiler)
+
+        with stage(profiler, "count"):
+            band = np.ascontiguousarray(padded[:height, :width])
+            opaque = self.mask.opaque
+            cloud_pixels = int(np.count_nonzero((band == 255) & opaque))
+            total_pixels = self.mask.opaque_pixels
+            refined = np.zeros((rows, columns), dtype=bool)
+            refined[selected] = True
+            refined = np.repeat(np.repeat(refined, block_pixels, axis=0), block_pixels, axis=1)[:height, :width]
+            refined_pixels = int(np.count_nonzero(refined & opaque))
+        return RefinedSegmentation(band, self.mask.alpha, cloud_pixels, total_pixels,
+                                   refined_pixels / total_pixels if total_pixels else 0.0)
+
+    def __segment_coarse(self, rgb, profiler):
+        ratio_threshold, window_size, low_threshold, high_threshold = self.__parameters
+        coarse = rgb
+        if self.coarse_factor > 1:
+            with stage(profiler, "resize"):
+                coarse = np.asarray(Image.fromarray(rgb).reduce(self.coarse_factor))
+        opaque = self.coarse_mask.opaque
+        with stage(profiler, "red_blue"):
+            white = red_blue_white(coarse, opaque, ratio_threshold)
+        with stage(profiler, "convolution"):
+            original = white.astype(np.uint8) * 255
+            counts = window_counts(white, window_size)
+            band = select_output_array(original, counts, low_threshold, high_threshold)
+            keep_border(band, original, window_size // 2)
+
+        # Pixels that keep their R/B value, and pixels next to one of the other color
+        uncertain = (counts > low_threshold) & (counts <= high_threshold)
+        cloud = band == 255
+        edges = cloud[1:] != cloud[:-1]
+        uncertain[1:] |= edges
+        uncertain[:-1] |= edges
+        edges = cloud[:, 1:] != cloud[:, :-1]
+        uncertain[:, 1:] |= edges
+        uncertain[:, :-1] |= edges
+        uncertain &= opaque
+        return band, uncertain
+
+    def __uncertain_blocks(self, uncertain):
+        # Row and column of every block holding an uncertain coarse pixel
+        rows, columns = self.__blocks
+        size = self.block_size
+        padded = np.zeros((rows * size, columns * size), dtype=bool)
+        padded[:uncertain.shape[0], :uncertain.shape[1]] = uncertain
+        return np.nonzero(padded.reshape(rows, size, columns, size).any(axis=(1, 3)))
+
+    def __segment_blocks(self, padded_rgb, block_rows, block_columns, profiler):
+        # Segments a stack of blocks at full resolution, each one with the halo of its windows
+        ratio_threshold, window_size, low_threshold, high_threshold = self.__parameters
+        height, width = self.mask.alpha.shape
+        margin = window_size // 2
+        block_pixels = self.block_size * self.coarse_factor
+        with stage(profiler, "red_blue"):
+            white = red_blue_white(_blocks_with_halo(padded_rgb, block_rows, block_columns, block_pixels, margin),
+                                   _blocks_with_halo(self.__padded_opaque, block_rows, block_columns,
+                                                     block_pixels, margin),
+                                   ratio_threshold)
+        with stage(profiler, "convolution"):
+            original = white.astype(np.uint8) * 255
+            output = select_output_array(original, window_counts(white, window_size), low_threshold,
+                                         high_threshold)
+        inner = slice(margin, margin + block_pixels)
+        output = output[:, inner, inner]
+        original = original[:, inner, inner]
+        # Pixels closer than the margin to the border of the frame keep their value
+        offsets = np.arange(block_pixels)
+        rows = (block_rows[:, None] * block_pixels + offsets)[:, :, None]
+        columns = (block_columns[:, None] * block_pixels + offsets)[:, None, :]
+        border = (rows < margin) | (rows >= height - margin) | (columns < margin) | (columns >= width - margin)
+        return np.where(border, original, output)
+
+
+def _blocks_with_halo(padded, block_rows, block_columns, block_pixels, margin):
+    # Copies the given blocks of a padded array, each one grown by the margin on every side
+    rows, columns = padded.shape[:2]
+    row_stride, column_stride = padded.strides[:2]
+    shape = ((rows - 2 * margin) // block_pixels, (columns - 2 * margin) // block_pixels,
+             block_pixels + 2 * margin, block_pixels + 2 * margin) + padded.shape[2:]
+    strides = (row_stride * block_pixels, column_stride * block_pixels, row_stride, column_stride) + \
+        padded.strides[2:]
+    return np.lib.stride_tricks.as_strided(padded, shape, strides, writeable=False)[block_rows, block_columns]
+
+
+def get_segmenter(mask, coarse_factor=COARSE_FACTOR):
+    """Returns a segmenter with the default block size and parameters for a prepared mask.
+    Segmenters are kept while their mask is in use, so frames sharing a mask share its segmenter.
+
+    :param mask: The prepared mask of the frames, at full resolution.
+    :type mask: PreparedMask
+    :param coarse_factor: Factor the frames are reduced by for the coarse segmentation.
+    :type coarse_factor: int
+    :rtype: CoarseToFineSegmenter
+    """
+    with _segmenters_lock:
+        segmenters = _segmenters.setdefault(mask, {})
+        if coarse_factor not in segmenters:
+            segmenters[coarse_factor] = CoarseToFineSegmenter(mask, coarse_factor=coarse_factor)
+        return segmenters[coarse_factor]
+
+
+def segment_refined(image, mask, coarse_factor=COARSE_FACTOR, block_size=BLOCK_SIZE, **parameters):
+    """Segments a single frame coarse to fine, see CoarseToFineSegmenter.
+
+    :param image: An image, must be in RGB mode.
+    :param mask: The prepared mask of the frame, at full resolution.
+    :type mask: PreparedMask
+    :param coarse_factor: Factor the frame is reduced by for the coarse segmentation.
+    :type coarse_factor: int
+    :param block_size: Width and height of the refined blocks, in coarse pixels.
+    :type block_size: int
+    :param parameters: Thresholds and window size of the filters, as taken by CoarseToFineSegmenter.
+    :return: The segmentation of the frame.
+    :rtype: RefinedSegmentation
+    """
+    rgb, _ = load_frame(image, mask)
+    return CoarseToFineSegmenter(mask, coarse_factor, block_size, **parameters).segment(rgb)
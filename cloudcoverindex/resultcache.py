@@ -0,0 +1,148 @@
+"""Persistent cache of results, so images submitted again aren't processed again.
+
+Results are stored in a SQLite database keyed by a hash of the image file,
+a hash of the mask file, the downscale factor and the filter parameters.
+Only the pixel counts are stored. Least recently used results are evicted
+once the cache holds more than its maximum number of entries.
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import time
+
+# Changing how images are processed must change this value, so old results aren't reused
+CACHE_VERSION = 1
+
+
+def default_cache_path():
+    """Returns the default location of the cache database, inside the user cache directory.
+
+    :rtype: str
+    """
+    cache_home = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(cache_home, "cloudcoverindex", "results.sqlite")
+
+
+def hash_file(path):
+    """Returns the SHA-256 hash of the contents of a file.
+
+    :param path: path to the file
+    :type path: str
+    :return: The hash as an hexadecimal string.
+    :rtype: str
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def result_key(image_hash, mask_hash, downscale_factor=1, fast_downscale=False, ratio_threshold=0.95,
+               window_size=5, low_threshold=7, high_threshold=16, frame_size=None):
+    """Returns the key of a result in the cache.
+
+    :param image_hash: hash of the image file, see hash_file
+    :type image_hash: str
+    :param mask_hash: hash of the mask file, see hash_file
+    :type mask_hash: str
+    :param downscale_factor: factor the image is downscaled by
+    :type downscale_factor: int
+    :param fast_downscale: whether the image is downscaled while decoding and with a box filter
+    :type fast_downscale: bool
+    :param ratio_threshold: Red/Blue ratio threshold of the R/B filter
+    :param window_size: Width and height of the convolution window
+    :param low_threshold: Low threshold of the convolution filter
+    :param high_threshold: High threshold of the convolution filter
+    :param frame_size: width and height of a raw frame, which its file doesn't record
+    :type frame_size: tuple
+    :rtype: str
+    """
+    key = [CACHE_VERSION, image_hash, mask_hash, downscale_factor, bool(fast_downscale), ratio_threshold,
+           window_size, low_threshold, high_threshold]
+    if frame_size is not None:
+        # Left out otherwise, so keys of images stay the same
+        key.append(list(frame_size))
+    return hashlib.sha256(json.dumps(key).encode()).hexdigest()
+
+
+class ResultCache:
+    """Cache of pixel counts stored in a SQLite database.
+
+    :param path: path to the database file, created if it doesn't exist
+    :type path: str
+    :param max_entries: maximum number of results kept
+    :type max_entries: int
+    """
+
+    def __init__(self, path=None, max_entries=100000):
+        if max_entries < 1:
+            raise ValueError("Cache size must be at least 1")
+        if path is None:
+            path = default_cache_path()
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.path = path
+        self.max_entries = max_entries
+        self.__connection = sqlite3.connect(path, timeout=30)
+        self.__connection.execute("PRAGMA journal_mode=WAL")
+        self.__connection.execute("PRAGMA synchronous=NORMAL")
+        with self.__connection:
+            self.__connection.execute("CREATE TABLE IF NOT EXISTS results ("
+                                      "key TEXT PRIMARY KEY, cloud_pixels INTEGER NOT NULL, "
+                                      "total_pixels INTEGER NOT NULL, last_used REAL NOT NULL)")
+            self.__connection.execute("CREATE INDEX IF NOT EXISTS results_last_used ON results (last_used)")
+        self.__entries = self.__connection.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+
+    def get(self, key):
+        """Returns the pixel counts stored for a key.
+
+        :param key: key of the result, see result_key
+        :type key: str
+        :return: A tuple (cloud_pixels, total_pixels), or None if the key isn't cached.
+        :rtype: tuple
+        """
+        row = self.__connection.execute("SELECT cloud_pixels, total_pixels FROM results WHERE key = ?",
+                                        (key,)).fetchone()
+        if row is None:
+            return None
+        with self.__connection:
+            self.__connection.execute("UPDATE results SET last_used = ? WHERE key = ?", (time.time(), key))
+        return row[0], row[1]
+
+    def put(self, key, cloud_pixels, total_pixels):
+        """Stores the pixel counts of a result, evicting the least recently used results if the cache is full.
+
+        :param key: key of the result, see result_key
+        :type key: str
+        :param cloud_pixels: Number of cloud pixels.
+        :type cloud_pixels: int
+        :param total_pixels: Number of pixels that aren't transparent.
+        :type total_pixels: int
+        """
+        with self.__connection:
+            exists = self.__connection.execute("SELECT 1 FROM results WHERE key = ?", (key,)).fetchone()
+            self.__connection.execute("INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?)",
+                                      (key, cloud_pixels, total_pixels, time.time()))
+            if exists is None:
+                self.__entries += 1
+            if self.__entries > self.max_entries:
+                # Evict a tenth of the cache at once so eviction doesn't run on every insert
+                excess = self.__entries - self.max_entries + self.max_entries // 10
+                self.__connection.execute("DELETE FROM results WHERE key IN "
+                                          "(SELECT key FROM results ORDER BY last_used LIMIT ?)", (excess,))
+                self.__entries = self.__connection.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+
+    def close(self):
+        """Closes the database."""
+        self.__connection.close()
+
+    def __len__(self):
+        return self.__entries
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,48 @@
+"""Results of processing images."""
+
+
+class ImageResult:
+    """Result of processing a single image.
+
+    :param path: path to the image file
+    :type path: str
+    :param cloud_pixels: Number of cloud pixels, None if the image couldn't be processed.
+    :type cloud_pixels: int
+    :param total_pixels: Number of pixels that aren't transparent, None if the image couldn't be processed.
+    :type total_pixels: int
+    :param save_path: path the segmented image was saved at, if it was saved.
+    :type save_path: str
+    :param error: Description of the error if the image couldn't be processed.
+    :type error: str
+    :param cached: Whether the counts come from the result cache instead of processing the image.
+    :type cached: bool
+    """
+
+    def __init__(self, path, cloud_pixels=None, total_pixels=None, save_path=None, error=None, cached=False):
+        self.path = path
+        self.cloud_pixels = cloud_pixels
+        self.total_pixels = total_pixels
+        self.save_path = save_path
+        self.error = error
+        self.cached = cached
+
+    @property
+    def ok(self):
+        """Whether the image was processed successfully."""
+        return self.error is None
+
+    @property
+    def cloud_cover_index(self):
+        """Cloud cover index of the image, None if it couldn't be processed."""
+        if not self.ok:
+            return None
+        return self.cloud_pixels / self.total_pixels
+
+
+def describe_error(error):
+    """Returns a one line description of an error, used to report images that couldn't be processed.
+
+    :param error: The exception raised while processing the image.
+    :rtype: str
+    """
+    return f"{type(error).__name__}: {error}"
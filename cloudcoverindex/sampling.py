@@ -0,0 +1,219 @@
+"""Approximate cloud cover index from a sample of the pixels.
+
+Instead of segmenting the whole frame, the R/B filter and the window rule of
+the convolution filter are evaluated only at random points inside the mask,
+each point from the pixels of its window. The opaque part of the mask is split
+into a grid of strata and every stratum gets a share of the points
+proportional to its opaque pixels, so the points cover the whole sky.
+
+Points are added in rounds until the confidence interval of the estimate is
+narrow enough, a time budget runs out or a maximum number of points is
+reached. The estimate is that of the index of the frame at its resolution, as
+computed by CloudCoverApp, and its interval uses the normal approximation.
+
+Requires numpy.
+"""
+import math
+import time
+
+from cloudcoverindex.filters import red_blue_white
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Number of rows and columns of the grid of strata over the opaque part of the mask
+STRATA = 8
+# Points added to the sample in every round
+ROUND_SIZE = 512
+
+
+class CloudCoverEstimate:
+    """Approximate cloud cover index with its confidence interval.
+
+    :param cloud_cover_index: The estimated index.
+    :type cloud_cover_index: float
+    :param lower: Lower bound of the confidence interval.
+    :type lower: float
+    :param upper: Upper bound of the confidence interval.
+    :type upper: float
+    :param confidence: Confidence level of the interval.
+    :type confidence: float
+    :param samples: Number of pixels the estimate comes from.
+    :type samples: int
+    """
+
+    def __init__(self, cloud_cover_index, lower, upper, confidence, samples):
+        self.cloud_cover_index = cloud_cover_index
+        self.lower = lower
+        self.upper = upper
+        self.confidence = confidence
+        self.samples = samples
+
+    @property
+    def error(self):
+        """Half the width of the confidence interval."""
+        return (self.upper - self.lower) / 2
+
+
+def normal_quantile(probability):
+    """Quantile of the standard normal distribution, found by bisection.
+
+    :param probability: A probability between 0 and 1, exclusive.
+    :type probability: float
+    :rtype: float
+    """
+    if not 0 < probability < 1:
+        raise ValueError("Probability must be between 0 and 1")
+    low, high = -10.0, 10.0
+    for _ in range(100):
+        middle = (low + high) / 2
+        if (1 + math.erf(middle / math.sqrt(2))) / 2 < probability:
+            low = middle
+        else:
+            high = middle
+    return (low + high) / 2
+
+
+def classify_points(rgb, opaque, rows, columns, ratio_threshold=0.95, window_size=5, low_threshold=7,
+                    high_threshold=16):
+    """Segments single pixels of a frame, as the R/B and convolution filters do for the whole frame.
+
+    :param rgb: uint8 array of shape (height, width, 3) with the frame.
+    :param opaque: Boolean array of shape (height, width), True for the opaque pixels.
+    :param rows: Integer array with the rows of the pixels.
+    :param columns: Integer array with the columns of the pixels, of the same length.
+    :param ratio_threshold: Red/Blue ratios bigger than this value produce a white pixel.
+    :param window_size: Width and height of the convolution window, must be odd.
+    :param low_threshold: Counts lower or equal than this value produce a black pixel.
+    :param high_threshold: Counts greater than this value produce a white pixel.
+    :return: A boolean array, True for the pixels segmented as white.
+    """
+    height, width = opaque.shape
+    margin = window_size // 2
+    offsets = np.arange(-margin, margin + 1)
+    window_rows = (rows[:, None] + offsets)[:, :, None]
+    window_columns = (columns[:, None] + offsets)[:, None, :]
+    inside = (window_rows >= 0) & (window_rows < height) & (window_columns >= 0) & (window_columns < width)
+    window_rows = np.clip(window_rows, 0, height - 1)
+    window_columns = np.clip(window_columns, 0, width - 1)
+    white = red_blue_white(rgb[window_rows, window_columns], opaque[window_rows, window_columns] & inside,
+                           ratio_threshold)
+    counts = np.count_nonzero(white, axis=(1, 2))
+    original = white[:, margin, margin]
+    cloud = (counts > high_threshold) | (original & (counts > low_threshold))
+    # Pixels closer than the margin to the border of the frame keep their value
+    border = (rows < margin) | (rows >= height - margin) | (columns < margin) | (columns >= width - margin)
+    return np.where(border, original, cloud)
+
+
+def estimate_cloud_cover(rgb, mask, error_bound=0.01, confidence=0.95, time_budget=None, max_samples=None,
+                         seed=None, ratio_threshold=0.95, window_size=5, low_threshold=7, high_threshold=16):
+    """Estimates the cloud cover index of a frame from a stratified random sample of its pixels.
+    Points are added until the error, half the width of the confidence interval, is at most
+    the error bound, the time budget runs out or the sample reaches max_samples.
+
+    :param rgb: uint8 array of shape (height, width, 3) with the frame cropped and scaled to the mask,
+        as returned by engine.load_frame.
+    :param mask: The prepared mask of the frame.
+    :type mask: PreparedMask
+    :param error_bound: Largest error accepted, None to sample until the time budget or max_samples.
+    :type error_bound: float
+    :param confidence: Confidence level of the interval.
+    :type confidence: float
+    :param time_budget: Optional seconds after which no more points are added.
+    :type time_budget: float
+    :param max_samples: Optional maximum number of points, by default the number of opaque pixels.
+    :type max_samples: int
+    :param seed: Optional seed of the random points, for repeatable estimates.
+    :param ratio_threshold: Red/Blue ratios bigger than this value produce a white pixel.
+    :param window_size: Width and height of the convolution window, must be odd.
+    :param low_threshold: Counts lower or equal than this value produce a black pixel.
+    :param high_threshold: Counts greater than this value produce a white pixel.
+    :return: The estimate.
+    :rtype: CloudCoverEstimate
+    """
+    if np is None:
+        raise RuntimeError("Approximate cloud cover requires numpy")
+    if error_bound is not None and error_bound <= 0:
+        raise ValueError("Error bound must be positive")
+    if rgb.shape[:2] != mask.alpha.shape:
+        raise ValueError("Frame must have the size of the mask")
+    deadline = time.perf_counter() + time_budget if time_budget is not None else None
+    z = normal_quantile((1 + confidence) / 2)
+    if max_samples is None:
+        max_samples = mask.opaque_pixels
+    cells, pixels = __strata(mask)
+    if len(pixels) == 0:
+        raise ValueError("Mask has no opaque pixels")
+    generator = np.random.default_rng(seed)
+    weights = pixels / mask.opaque_pixels
+    samples = np.zeros(len(pixels), dtype=np.int64)
+    clouds = np.zeros(len(pixels), dtype=np.int64)
+    parameters = (ratio_threshold, window_size, low_threshold, high_threshold)
+
+    while True:
+        size = max(1, min(ROUND_SIZE, max_samples - int(samples.sum())))
+        allocation = __allocate(weights, size, generator)
+        strata = np.repeat(np.arange(len(pixels)), allocation)
+        rows, columns = __sample_points(mask, cells[strata], generator)
+        cloud = classify_points(rgb, mask.opaque, rows, columns, *parameters)
+        clouds += np.bincount(strata[cloud], minlength=len(pixels))
+        samples += allocation
+        index, error = __interval(weights, clouds, samples, z)
+        if (error_bound is not None and error <= error_bound) or samples.sum() >= max_samples or \
+                (deadline is not None and time.perf_counter() >= deadline):
+            return CloudCoverEstimate(index, max(0.0, index - error), min(1.0, index + error), confidence,
+                                      int(samples.sum()))
+
+
+def __strata(mask):
+    # Cells of a grid over the bounding box of the opaque pixels that have any, as an array of
+    # (top, bottom, left, right) rows, and the number of opaque pixels of each
+    left, top, right, bottom = mask.bbox if mask.bbox is not None else (0, 0, 0, 0)
+    row_edges = np.linspace(top, bottom, STRATA + 1).astype(np.int64)
+    column_edges = np.linspace(left, right, STRATA + 1).astype(np.int64)
+    cells = []
+    pixels = []
+    for cell_top, cell_bottom in zip(row_edges[:-1], row_edges[1:]):
+        for cell_left, cell_right in zip(column_edges[:-1], column_edges[1:]):
+            count = np.count_nonzero(mask.opaque[cell_top:cell_bottom, cell_left:cell_right])
+            if count:
+                cells.append((cell_top, cell_bottom, cell_left, cell_right))
+                pixels.append(count)
+    return np.array(cells, dtype=np.int64).reshape(-1, 4), np.array(pixels, dtype=float)
+
+
+def __allocate(weights, size, generator):
+    # Proportional allocation, the remainder goes to strata drawn by their weight
+    allocation = np.floor(weights * size).astype(np.int64)
+    remainder = size - int(allocation.sum())
+    if remainder:
+        allocation += np.bincount(generator.choice(len(weights), remainder, p=weights), minlength=len(weights))
+    return allocation
+
+
+def __sample_points(mask, cells, generator):
+    # A uniform point among the opaque pixels of every cell, drawn by rejection
+    rows = np.empty(len(cells), dtype=np.int64)
+    columns = np.empty(len(cells), dtype=np.int64)
+    missing = np.arange(len(cells))
+    while len(missing):
+        top, bottom, left, right = cells[missing].T
+        rows[missing] = top + (generator.random(len(missing)) * (bottom - top)).astype(np.int64)
+        columns[missing] = left + (generator.random(len(missing)) * (right - left)).astype(np.int64)
+        missing = missing[~mask.opaque[rows[missing], columns[missing]]]
+    return rows, columns
+
+
+def __interval(weights, clouds, samples, z):
+    # Stratified estimate and half width of its interval. The variance of every stratum
+    # is that of its proportion with one more cloud and one more sky point, so strata
+    # whose points all agree don't claim a certainty the sample can't give
+    sampled = samples > 0
+    proportions = np.where(sampled, clouds / np.maximum(samples, 1), 0.0)
+    index = float((weights * proportions).sum())
+    adjusted = (clouds + 1) / (samples + 2)
+    variances = np.where(sampled, adjusted * (1 - adjusted) / np.maximum(samples, 1), 0.25)
+    return index, z * math.sqrt(float((weights ** 2 * variances).sum()))
@@ -0,0 +1,192 @@
+"""Incremental segmentation of a sequence of frames from a fixed camera.
+
+Consecutive frames of a sky camera are often mostly unchanged. The frame is
+split into square tiles, and for every new frame only the tiles whose pixels
+changed beyond a tolerance since they were last segmented are segmented again,
+together with the pixels their convolution windows reach. When most of the
+tiles changed the whole frame is segmented instead. The segmented band
+and the cloud pixel count of every tile are kept between frames, so the counts
+of the frame are updated from the counts of the recomputed tiles only.
+
+With a tolerance of 0 every frame gives the same segmentation as segmenting it
+on its own. With a bigger tolerance small changes, such as JPEG noise, are
+ignored until they add up beyond the tolerance, at the cost of exactness.
+
+Requires numpy.
+"""
+from cloudcoverindex.engine import Segmentation, load_frame, segment
+from cloudcoverindex.filters import red_blue_white, convolution_slab
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Width and height of the tiles changes are detected in
+TILE_SIZE = 64
+# Fraction of changed tiles above which the whole frame is segmented instead
+WHOLE_FRAME_FRACTION = 0.5
+
+
+class SequenceProcessor:
+    """Segments the frames of a sequence that share a mask, recomputing only the tiles that changed.
+
+    :param mask: The prepared mask of the frames.
+    :type mask: PreparedMask
+    :param tile_size: Width and height of the tiles changes are detected in.
+    :type tile_size: int
+    :param tolerance: Largest difference of a color value of a pixel that isn't taken as a change.
+    :type tolerance: int
+    :param ratio_threshold: Red/Blue ratios bigger than this value produce a white pixel.
+    :param window_size: Width and height of the convolution window, must be odd.
+    :param low_threshold: Counts lower or equal than this value produce a black pixel.
+    :param high_threshold: Counts greater than this value produce a white pixel.
+    """
+
+    def __init__(self, mask, tile_size=TILE_SIZE, tolerance=0, ratio_threshold=0.95, window_size=5, low_threshold=7,
+                 high_threshold=16):
+        if np is None:
+            raise RuntimeError("Incremental segmentation requires numpy")
+        if tile_size < 1:
+            raise ValueError("Tile size must be at least 1")
+        if tolerance < 0:
+            raise ValueError("Tolerance can't be negative")
+        self.mask = mask
+        self.tile_size = tile_size
+        self.tolerance = tolerance
+        self.__parameters = (ratio_threshold, window_size, low_threshold, high_threshold)
+        height, width = mask.alpha.shape
+        self.__tiles = (-(-height // tile_size), -(-width // tile_size))
+        # Opaque pixels repeated for the three color values of every pixel
+        self.__opaque_values = np.repeat(mask.opaque, 3, axis=1)
+        # Fraction of the tiles segmented again for the last frame
+        self.changed_fraction = None
+        self.reset()
+
+    def reset(self):
+        """Forgets the previous frames, the next frame is segmented whole."""
+        self.__reference = None
+        self.__band = None
+        self.__tile_counts = None
+        self.changed_fraction = None
+
+    def segment(self, image):
+        """Segments the next frame of the sequence, which is cropped and scaled to the mask first.
+        The band of the returned segmentation is updated in place by the next frames.
+
+        :param image: An image, must be in RGB mode.
+        :return: The segmentation of the frame.
+        :rtype: Segmentation
+        """
+        rgb, _ = load_frame(image, self.mask)
+        return self.segment_array(rgb)
+
+    def segment_array(self, rgb):
+        """Segments the next frame of the sequence, already cropped and scaled to the mask.
+
+        :param rgb: uint8 array of shape (height, width, 3), as returned by engine.load_frame.
+        :return: The segmentation of the frame.
+        :rtype: Segmentation
+        """
+        if rgb.shape[:2] != self.mask.alpha.shape:
+            raise ValueError("Frames must have the size of the mask")
+        height, width = self.mask.alpha.shape
+        window_size = self.__parameters[1]
+        if self.__reference is None or height < window_size or width < window_size:
+            self.changed_fraction = 1.0
+            return self.__segment_whole(rgb)
+
+        changed = self.__changed_tiles(rgb)
+        self.changed_fraction = float(changed.mean())
+        if self.changed_fraction > WHOLE_FRAME_FRACTION:
+            # Scattered changed tiles cost more than the whole frame
+            return self.__segment_whole(rgb)
+        if changed.any():
+            for top, bottom, left, right in self.__runs(changed):
+                self.__segment_region(rgb, top, bottom, left, right)
+                self.__reference[top:bottom, left:right] = rgb[top:bottom, left:right]
+            # Windows of the changed tiles reach the neighbouring tiles
+            affected = changed
+            for _ in range(-(-(window_size // 2) // self.tile_size)):
+                grown = affected.copy()
+                grown[1:] |= affected[:-1]
+                grown[:-1] |= affected[1:]
+                affected = grown.copy()
+                affected[:, 1:] |= grown[:, :-1]
+                affected[:, :-1] |= grown[:, 1:]
+            self.__update_counts(affected)
+        return Segmentation(self.__band, self.mask.alpha, int(self.__tile_counts.sum()), self.mask.opaque_pixels)
+
+    def __segment_whole(self, rgb):
+        segmentation = segment(rgb, self.mask.alpha, *self.__parameters, mask=self.mask)
+        if self.__reference is None:
+            self.__reference = np.array(rgb)
+            self.__band = np.array(segmentation.band)
+        else:
+            self.__reference[...] = rgb
+            self.__band[...] = segmentation.band
+        self.__tile_counts = self.__count_tiles()
+        return Segmentation(self.__band, self.mask.alpha, segmentation.cloud_pixels, segmentation.total_pixels)
+
+    def __changed_tiles(self, rgb):
+        # Tiles with an opaque pixel that changed, the color values of every row are taken as a single row
+        height, width = self.mask.alpha.shape
+        size = self.tile_size
+        if self.tolerance == 0:
+            changed = rgb != self.__reference
+        else:
+            changed = np.maximum(rgb, self.__reference) - np.minimum(rgb, self.__reference) > self.tolerance
+        changed = changed.reshape(height, width * 3)
+        changed &= self.__opaque_values
+        changed = np.maximum.reduceat(changed.view(np.uint8), np.arange(0, width * 3, size * 3), axis=1)
+        return np.maximum.reduceat(changed, np.arange(0, height, size), axis=0).astype(bool)
+
+    def __runs(self, changed):
+        # Rectangles covering the runs of neighbouring changed tiles of every row of tiles
+        height, width = self.mask.alpha.shape
+        size = self.tile_size
+        regions = []
+        for row in range(changed.shape[0]):
+            selected = np.flatnonzero(changed[row])
+            if len(selected) == 0:
+                continue
+            breaks = np.flatnonzero(np.diff(selected) != 1) + 1
+            for run in np.split(selected, breaks):
+                regions.append((row * size, min(height, (row + 1) * size), int(run[0]) * size,
+                                min(width, (int(run[-1]) + 1) * size)))
+        return regions
+
+    def __segment_region(self, rgb, top, bottom, left, right):
+        # Segments the pixels whose windows reach the region, from the pixels their windows reach
+        ratio_threshold, window_size, low_threshold, high_threshold = self.__parameters
+        height, width = self.mask.alpha.shape
+        margin = window_size // 2
+        output_top, output_bottom = max(0, top - margin), min(height, bottom + margin)
+        output_left, output_right = max(0, left - margin), min(width, right + margin)
+        input_top, input_bottom = max(0, top - 2 * margin), min(height, bottom + 2 * margin)
+        input_left, input_right = max(0, left - 2 * margin), min(width, right + 2 * margin)
+        white = red_blue_white(rgb[input_top:input_bottom, input_left:input_right],
+                               self.mask.opaque[input_top:input_bottom, input_left:input_right], ratio_threshold)
+        output = convolution_slab(white.astype(np.uint8) * 255, window_size, low_threshold, high_threshold,
+                                  offset=(input_top, input_left), image_shape=(height, width))
+        self.__band[output_top:output_bottom, output_left:output_right] = \
+            output[output_top - input_top:output_bottom - input_top, output_left - input_left:output_right - input_left]
+
+    def __count_tiles(self):
+        # Cloud pixels of every tile
+        rows, columns = self.__tiles
+        size = self.tile_size
+        cloud = np.zeros((rows * size, columns * size), dtype=bool)
+        height, width = self.mask.alpha.shape
+        cloud[:height, :width] = (self.__band == 255) & self.mask.opaque
+        return np.count_nonzero(cloud.reshape(rows, size, columns, size), axis=(1, 3))
+
+    def __update_counts(self, tiles):
+        # Counts the cloud pixels of the given tiles again
+        size = self.tile_size
+        height, width = self.mask.alpha.shape
+        for row, column in zip(*np.nonzero(tiles)):
+            top, left = row * size, column * size
+            bottom, right = min(height, top + size), min(width, left + size)
+            self.__tile_counts[row, column] = np.count_nonzero((self.__band[top:bottom, left:right] == 255) &
+                                                               self.mask.opaque[top:bottom, left:right])
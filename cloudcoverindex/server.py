@@ -0,0 +1,413 @@
+"""Local server computing cloud cover indexes on demand.
+
+Clients connect to a Unix or TCP socket and send requests as JSON objects,
+one per line. A request has an "id" that is returned with its response and
+either the "path" of an image readable by the server or the "image" itself as
+base64 encoded bytes. It may also have a "mask" path, a "downscale_factor" and
+"fast_downscale", which default to those of the server. Responses are JSON
+objects with "cloud_pixels", "total_pixels" and "cloud_cover_index", or with an
+"error", and are sent as soon as they are ready, not in request order.
+
+Requests are queued and dispatched in batches to a pool of worker processes,
+started with the default mask already prepared. Workers keep the masks they
+prepare in their mask cache. When the queue is full the server stops reading
+from the connections, so clients are slowed down instead of piling up work.
+If a worker dies, the requests of the batches it was given are answered with an
+error and a new pool is started for the following ones.
+
+The server reads any image path it is given, so it is meant for local use only.
+"""
+import asyncio
+import base64
+import binascii
+import io
+import json
+import os
+import signal
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import partial
+
+from cloudcoverindex.batch import process_image
+from cloudcoverindex.masks import load_mask
+from cloudcoverindex.results import describe_error
+
+# Maximum size of a request line, images are sent inside it
+MAX_REQUEST_SIZE = 64 * 1024 * 1024
+
+
+def parse_address(address):
+    """Parses the address of the server socket.
+    Addresses starting with "unix:" or containing a slash are Unix socket paths,
+    any other is a TCP "host:port" address, where the host may be left empty.
+
+    :param address: The address.
+    :type address: str
+    :return: A tuple ("unix", path) or ("tcp", (host, port)).
+    :rtype: tuple
+    """
+    if address.startswith("unix:"):
+        return "unix", address[len("unix:"):]
+    if "/" in address:
+        return "unix", address
+    host, separator, port = address.rpartition(":")
+    if not separator or not port.isdigit():
+        raise ValueError("Invalid address, expected a socket path or host:port: " + address)
+    return "tcp", (host or "127.0.0.1", int(port))
+
+
+class CloudCoverServer:
+    """Server computing cloud cover indexes on a pool of worker processes.
+
+    :param mask_path: path to the default mask image file
+    :type mask_path: str
+    :param downscale_factor: default factor to downscale the images by
+    :type downscale_factor: int
+    :param fast_downscale: whether images are downscaled while decoding by default
+    :type fast_downscale: bool
+    :param workers: number of worker processes, by default the number of CPUs
+    :type workers: int
+    :param batch_size: maximum number of requests dispatched to a worker at once
+    :type batch_size: int
+    :param batch_delay: seconds a batch waits to be filled before being dispatched
+    :type batch_delay: float
+    :param queue_size: maximum number of requests waiting to be dispatched
+    :type queue_size: int
+    """
+
+    def __init__(self, mask_path, downscale_factor=1, fast_downscale=False, workers=None, batch_size=4,
+                 batch_delay=0.002, queue_size=64):
+        if workers is None:
+            workers = os.cpu_count() or 1
+        if workers < 1 or batch_size < 1 or queue_size < 1:
+            raise ValueError("Workers, batch size and queue size must be at least 1")
+        if downscale_factor < 1:
+            raise ValueError("Downscale factor must be grater than 1")
+        self.mask_path = mask_path
+        self.downscale_factor = downscale_factor
+        self.fast_downscale = fast_downscale
+        self.workers = workers
+        self.batch_size = batch_size
+        self.batch_delay = batch_delay
+        self.queue_size = queue_size
+        self.__pool = None
+        # Batches submitted to the pool that haven't finished yet
+        self.__batches = set()
+        self.__server = None
+        self.__dispatcher = None
+        self.__connections = set()
+
+    async def start(self, address):
+        """Starts the worker processes and listens on the given address.
+
+        :param address: Unix socket path or TCP host:port, see parse_address.
+        :type address: str
+        """
+        kind, location = parse_address(address)
+        self.__loop = asyncio.get_event_loop()
+        self.__queue = asyncio.Queue(self.queue_size)
+        # Batches being processed, two per worker keep every worker busy
+        self.__slots = asyncio.Semaphore(2 * self.workers)
+        self.__start_pool()
+        self.__dispatcher = asyncio.ensure_future(self.__dispatch())
+        if kind == "unix":
+            if os.path.exists(location):
+                os.unlink(location)
+            self.__server = await asyncio.start_unix_server(self.__handle, location, limit=MAX_REQUEST_SIZE)
+        else:
+            self.__server = await asyncio.start_server(self.__handle, *location, limit=MAX_REQUEST_SIZE)
+
+    @property
+    def sockets(self):
+        """Sockets the server listens on."""
+        return self.__server.sockets if self.__server is not None else []
+
+    async def close(self):
+        """Stops listening and stops the worker processes, requests in progress are abandoned.
+        Workers finish the batch they are processing before they stop."""
+        if self.__server is not None:
+            self.__server.close()
+            for connection in self.__connections:
+                connection.cancel()
+            if self.__connections:
+                await asyncio.wait(self.__connections)
+            await self.__server.wait_closed()
+            self.__server = None
+        if self.__dispatcher is not None:
+            self.__dispatcher.cancel()
+            self.__dispatcher = None
+        if self.__pool is not None:
+            for batch in self.__batches:
+                batch.cancel()
+            self.__pool.shutdown()
+            self.__pool = None
+
+    async def __handle(self, reader, writer):
+        connection = asyncio.current_task() if hasattr(asyncio, "current_task") else asyncio.Task.current_task()
+        self.__connections.add(connection)
+        lock = asyncio.Lock()
+        responses = set()
+        try:
+            while True:
+                try:
+                    line = await reader.readline()
+                except (ValueError, ConnectionError):
+                    # Request bigger than the limit, or connection lost
+                    break
+                if not line:
+                    break
+                if not line.strip():
+                    continue
+                request_id = None
+                try:
+                    request = json.loads(line)
+                    if not isinstance(request, dict):
+                        raise ValueError("Request must be a JSON object")
+                    request_id = request.get("id")
+                    item = self.__parse(request)
+                except (ValueError, TypeError) as error:
+                    await _respond(writer, lock, request_id, {"error": describe_error(error)})
+                    continue
+                future = self.__loop.create_future()
+                # Waits while the queue is full, which stops reading from this connection
+                await self.__queue.put((item, future))
+                response = asyncio.ensure_future(self.__reply(writer, lock, request_id, future))
+                responses.add(response)
+                response.add_done_callback(responses.discard)
+            if responses:
+                await asyncio.wait(responses)
+        finally:
+            for response in responses:
+                response.cancel()
+            writer.close()
+            self.__connections.discard(connection)
+
+    def __parse(self, request):
+        if ("path" in request) == ("image" in request):
+            raise ValueError("Request must have either a path or an image")
+        if "path" in request:
+            source = request["path"]
+            if not isinstance(source, str):
+                raise TypeError("Path must be a string")
+        else:
+            try:
+                source = base64.b64decode(request["image"], validate=True)
+            except (binascii.Error, TypeError):
+                raise ValueError("Image must be base64 encoded")
+        mask_path = request.get("mask", self.mask_path)
+        downscale_factor = request.get("downscale_factor", self.downscale_factor)
+        fast_downscale = request.get("fast_downscale", self.fast_downscale)
+        if not isinstance(mask_path, str):
+            raise TypeError("Mask must be a path")
+        if not isinstance(downscale_factor, int) or downscale_factor < 1:
+            raise ValueError("Downscale factor must be a positive integer")
+        return source, mask_path, downscale_factor, bool(fast_downscale)
+
+    async def __reply(self, writer, lock, request_id, future):
+        await _respond(writer, lock, request_id, await future)
+
+    async def __dispatch(self):
+        while True:
+            batch = [await self.__queue.get()]
+            deadline = self.__loop.time() + self.batch_delay
+            while len(batch) < self.batch_size:
+                if not self.__queue.empty():
+                    batch.append(self.__queue.get_nowait())
+                    continue
+                timeout = deadline - self.__loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.__queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            await self.__slots.acquire()
+            self.__submit(batch)
+
+    def __start_pool(self):
+        initializer = partial(_init_worker, self.mask_path, self.downscale_factor, self.fast_downscale)
+        try:
+            self.__pool = ProcessPoolExecutor(self.workers, initializer=initializer)
+        except TypeError:
+            # Python 3.6 has no initializer, workers prepare the default mask with their first request
+            self.__pool = ProcessPoolExecutor(self.workers)
+
+    def __restart_pool(self, pool):
+        # Every batch of a broken pool fails, only the first one to finish replaces it
+        if pool is self.__pool:
+            pool.shutdown(wait=False)
+            self.__start_pool()
+
+    def __submit(self, batch):
+        items = [item for item, _ in batch]
+        futures = [future for _, future in batch]
+        pool = self.__pool
+        try:
+            submitted = pool.submit(_process_batch, items)
+        except BrokenProcessPool:
+            # A worker died since the last batch finished
+            self.__restart_pool(pool)
+            pool = self.__pool
+            submitted = pool.submit(_process_batch, items)
+        self.__batches.add(submitted)
+
+        def done(submitted):
+            self.__loop.call_soon_threadsafe(self.__finish, pool, submitted, futures)
+
+        submitted.add_done_callback(done)
+
+    def __finish(self, pool, submitted, futures):
+        self.__batches.discard(submitted)
+        self.__slots.release()
+        if submitted.cancelled():
+            return
+        try:
+            results = submitted.result()
+        except Exception as error:
+            if isinstance(error, BrokenProcessPool):
+                self.__restart_pool(pool)
+            results = [{"error": describe_error(error)}] * len(futures)
+        for future, result in zip(futures, results):
+            if not future.done():
+                future.set_result(result)
+
+
+async def _respond(writer, lock, request_id, result):
+    response = dict(result)
+    response["id"] = request_id
+    async with lock:
+        writer.write((json.dumps(response) + "\n").encode())
+        try:
+            await writer.drain()
+        except ConnectionError:
+            pass
+
+
+def serve(address, mask_path, **options):
+    """Runs a server until it is interrupted.
+
+    :param address: Unix socket path or TCP host:port, see parse_address.
+    :type address: str
+    :param mask_path: path to the default mask image file
+    :type mask_path: str
+    :param options: Options of the server, as taken by CloudCoverServer.
+    """
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    server = CloudCoverServer(mask_path, **options)
+    try:
+        loop.run_until_complete(server.start(address))
+        if hasattr(signal, "SIGTERM"):
+            try:
+                loop.add_signal_handler(signal.SIGTERM, loop.stop)
+            except NotImplementedError:
+                pass
+        loop.run_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        loop.run_until_complete(server.close())
+        loop.close()
+
+
+class CloudCoverClient:
+    """Client of a CloudCoverServer, requests can be sent concurrently.
+
+    :param reader: Stream reader of the connection.
+    :param writer: Stream writer of the connection.
+    """
+
+    def __init__(self, reader, writer):
+        self.__reader = reader
+        self.__writer = writer
+        self.__next_id = 0
+        self.__waiting = {}
+        self.__receiver = asyncio.ensure_future(self.__receive())
+
+    @classmethod
+    async def connect(cls, address):
+        """Connects to a server.
+
+        :param address: Unix socket path or TCP host:port, see parse_address.
+        :type address: str
+        :rtype: CloudCoverClient
+        """
+        kind, location = parse_address(address)
+        if kind == "unix":
+            reader, writer = await asyncio.open_unix_connection(location, limit=MAX_REQUEST_SIZE)
+        else:
+            reader, writer = await asyncio.open_connection(*location, limit=MAX_REQUEST_SIZE)
+        return cls(reader, writer)
+
+    async def request(self, path=None, image=None, **options):
+        """Sends a request and waits for its response.
+
+        :param path: path to an image file readable by the server
+        :type path: str
+        :param image: contents of an image file
+        :type image: bytes
+        :param options: "mask", "downscale_factor" or "fast_downscale" of the request.
+        :return: The response.
+        :rtype: dict
+        """
+        self.__next_id += 1
+        request = dict(options, id=self.__next_id)
+        if path is not None:
+            request["path"] = path
+        if image is not None:
+            request["image"] = base64.b64encode(image).decode("ascii")
+        future = asyncio.get_event_loop().create_future()
+        self.__waiting[self.__next_id] = future
+        self.__writer.write((json.dumps(request) + "\n").encode())
+        await self.__writer.drain()
+        return await future
+
+    async def __receive(self):
+        error = ConnectionError("Connection closed by the server")
+        try:
+            while True:
+                line = await self.__reader.readline()
+                if not line:
+                    break
+                response = json.loads(line)
+                future = self.__waiting.pop(response.get("id"), None)
+                if future is not None and not future.done():
+                    future.set_result(response)
+        except Exception as exception:
+            error = exception
+        for future in self.__waiting.values():
+            if not future.done():
+                future.set_exception(error)
+        self.__waiting.clear()
+
+    async def close(self):
+        """Closes the connection."""
+        self.__writer.close()
+        self.__receiver.cancel()
+
+
+def _init_worker(mask_path, downscale_factor, fast_downscale):
+    try:
+        load_mask(mask_path, downscale_factor=downscale_factor, fast_downscale=fast_downscale)
+    except Exception:
+        # Reported in the response of every request using it
+        pass
+
+
+def _process_batch(items):
+    return [_process_item(*item) for item in items]
+
+
+def _process_item(source, mask_path, downscale_factor, fast_downscale):
+    try:
+        mask = load_mask(mask_path, downscale_factor=downscale_factor, fast_downscale=fast_downscale)
+    except Exception as error:
+        return {"error": describe_error(error)}
+    if isinstance(source, bytes):
+        source = io.BytesIO(source)
+    result = process_image(source, mask)
+    if not result.ok:
+        return {"error": result.error}
+    # A fully transparent mask has no index
+    return {"cloud_pixels": result.cloud_pixels, "total_pixels": result.total_pixels,
+            "cloud_cover_index": result.cloud_cover_index if result.total_pixels else None}
@@ -0,0 +1,223 @@
+"""Tiled segmentation of large frames with bounded memory.
+
+The frame is processed in horizontal strips of a fixed number of rows. Every
+strip is cropped and scaled from the decoded image on its own, together with
+a halo of half the convolution window above and below it, so the intermediate
+images and arrays never hold more than a strip. Counts are accumulated strip
+by strip, and the segmented band is only assembled if it is kept.
+
+Results are the same as those of the whole frame path, as long as every strip
+is scaled by an integer scale: without downscaling, with fast downscale, or
+with LANCZOS when the mask size is a multiple of the downscale factor. Otherwise
+LANCZOS coefficients computed for a strip can round differently than those for
+the whole frame, changing the value of a few pixels by one.
+"""
+import math
+
+from PIL import Image, ImageChops, ImageFilter
+
+from cloudcoverindex.engine import Segmentation, segment
+from cloudcoverindex.filters import draft, red_blue_white, convolution_slab, red_blue_band, select_output_band
+from cloudcoverindex.masks import PreparedMask, prepare_mask
+from cloudcoverindex.profiling import stage
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Default number of rows of each strip
+TILE_HEIGHT = 256
+
+
+class StripReader:
+    """Reads horizontal strips of a frame, cropped and scaled to its mask.
+    The strips are the same rows crop_and_scale would return for the whole frame.
+    The image is decoded when the reader is created, at a reduced size if the
+    mask uses fast downscale.
+
+    :param image: An image, must be in RGB mode and not loaded yet to be decoded at a reduced size.
+    :param mask: The prepared mask of the frame.
+    :type mask: PreparedMask
+    """
+
+    def __init__(self, image, mask):
+        if image is None:
+            raise TypeError("Invalid None type argument")
+        if image.mode != "RGB":
+            raise ValueError("Only RGB images are supported")
+        mask_width, mask_height = mask.source_size
+        width, height = image.size
+        if mask_width > width or mask_height > height:
+            raise ValueError("Both width and height of mask must be smaller than width and height of image")
+
+        self.downscale_factor = mask.downscale_factor
+        self.fast_downscale = mask.fast_downscale and mask.downscale_factor != 1
+        scale = draft(image, self.downscale_factor) if self.fast_downscale else 1
+        image.load()
+        self.size = mask.size
+        self.__image = image
+        self.__scale = scale
+        # Crop box of the mask, in the coordinates of the decoded image
+        self.__left = (width - mask_width) // 2 // scale
+        self.__upper = (height - mask_height) // 2 // scale
+        self.__crop_size = (mask_width // scale, mask_height // scale)
+
+    def read(self, top, bottom):
+        """Returns the rows between top and bottom of the cropped and scaled frame.
+
+        :param top: First row of the strip.
+        :type top: int
+        :param bottom: Row after the last one of the strip.
+        :type bottom: int
+        :return: An image in RGB mode.
+        """
+        width = self.size[0]
+        left, upper = self.__left, self.__upper
+        if self.downscale_factor == 1:
+            return self.__image.crop((left, upper + top, left + width, upper + bottom))
+
+        if self.fast_downscale:
+            reduce_factor = self.downscale_factor // self.__scale
+            box = (left, upper + top * reduce_factor, left + width * reduce_factor, upper + bottom * reduce_factor)
+            if reduce_factor == 1:
+                return self.__image.crop(box)
+            return self.__image.reduce(reduce_factor, box=box)
+
+        # Only the rows under the support of the LANCZOS filter are cropped,
+        # but they are scaled as if they still were part of the whole crop
+        crop_width, crop_height = self.__crop_size
+        scale = crop_height / self.size[1]
+        source_top = top * scale
+        source_bottom = bottom * scale
+        support = 3 * scale
+        piece_top = max(0, math.floor(source_top - support) - 1)
+        piece_bottom = min(crop_height, math.ceil(source_bottom + support) + 1)
+        piece = self.__image.crop((left, upper + piece_top, left + crop_width, upper + piece_bottom))
+        return piece.resize((width, bottom - top), Image.LANCZOS,
+                            box=(0, source_top - piece_top, crop_width, source_bottom - piece_top))
+
+
+def segment_tiled(image, mask, downscale_factor=1, fast_downscale=False, tile_height=TILE_HEIGHT,
+                  ratio_threshold=0.95, window_size=5, low_threshold=7, high_threshold=16, keep_band=True,
+                  profiler=None):
+    """Segments a frame strip by strip, see the module documentation.
+    Only the strips around the opaque pixels of the mask are processed.
+
+    :param image: An image, must be in RGB mode.
+    :param mask: An image, must have only one band/channel, or a PreparedMask.
+    :param downscale_factor: An optional factor to downscale the image, replaced by that of a PreparedMask.
+    :type downscale_factor: int
+    :param fast_downscale: Use decode time scaling and box reduction instead of LANCZOS.
+    :type fast_downscale: bool
+    :param tile_height: Number of rows of each strip, bounds the memory used.
+    :type tile_height: int
+    :param ratio_threshold: Red/Blue ratios bigger than this value produce a white pixel.
+    :param window_size: Width and height of the convolution window, must be odd.
+    :param low_threshold: Counts lower or equal than this value produce a black pixel.
+    :param high_threshold: Counts greater than this value produce a white pixel.
+    :param keep_band: Whether the segmented band is assembled. If not, the segmentation only has the counts
+        and its band is None.
+    :type keep_band: bool
+    :param profiler: An optional profiler recording the stages of every strip.
+    :type profiler: Profiler
+    :return: The segmentation of the frame.
+    :rtype: Segmentation
+    """
+    if tile_height < 1:
+        raise ValueError("Tile height must be at least 1")
+    if not isinstance(mask, PreparedMask):
+        with stage(profiler, "resize"):
+            mask = prepare_mask(mask, downscale_factor=downscale_factor, fast_downscale=fast_downscale)
+    with stage(profiler, "decode"):
+        reader = StripReader(image, mask)
+
+    width, height = mask.size
+    if height < window_size or width < window_size:
+        # Frames smaller than the window are left as they are, which the whole frame path handles
+        rgb = reader.read(0, height)
+        if np is None:
+            return segment(rgb, mask.band, ratio_threshold, window_size, low_threshold, high_threshold,
+                           profiler=profiler)
+        return segment(np.asarray(rgb), mask.alpha, ratio_threshold, window_size, low_threshold, high_threshold,
+                       profiler=profiler)
+
+    if np is None:
+        return __segment_strips_images(reader, mask, tile_height, ratio_threshold, window_size, low_threshold,
+                                       high_threshold, keep_band, profiler)
+
+    margin = window_size // 2
+    band = np.zeros((height, width), dtype=np.uint8) if keep_band else None
+    cloud_pixels = 0
+    opaque = mask.opaque
+    for top, bottom in strips(mask, tile_height, margin):
+        input_top = max(0, top - margin)
+        input_bottom = min(height, bottom + margin)
+        with stage(profiler, "resize"):
+            rgb = reader.read(input_top, input_bottom)
+        with stage(profiler, "merge"):
+            rgb = np.asarray(rgb)
+        with stage(profiler, "red_blue"):
+            original = red_blue_white(rgb, opaque[input_top:input_bottom], ratio_threshold).astype(np.uint8) * 255
+        del rgb
+        output = convolution_slab(original, window_size, low_threshold, high_threshold, offset=(input_top, 0),
+                                  image_shape=(height, width), profiler=profiler)
+        output = output[top - input_top:bottom - input_top]
+        with stage(profiler, "count"):
+            cloud_pixels += int(np.count_nonzero((output == 255) & opaque[top:bottom]))
+        if keep_band:
+            band[top:bottom] = output
+    return Segmentation(band, mask.alpha, cloud_pixels, mask.opaque_pixels)
+
+
+def strips(mask, tile_height, margin=0):
+    """Splits the rows around the opaque pixels of a mask into strips.
+
+    :param mask: A prepared mask.
+    :type mask: PreparedMask
+    :param tile_height: Number of rows of each strip.
+    :type tile_height: int
+    :param margin: Number of rows the opaque rows are grown by.
+    :type margin: int
+    :return: A list of (top, bottom) pairs, bottom is exclusive.
+    :rtype: list
+    """
+    if mask.bbox is None:
+        return []
+    first = max(0, mask.bbox[1] - margin)
+    last = min(mask.size[1], mask.bbox[3] + margin)
+    return [(top, min(last, top + tile_height)) for top in range(first, last, tile_height)]
+
+
+def __segment_strips_images(reader, mask, tile_height, ratio_threshold, window_size, low_threshold, high_threshold,
+                            keep_band, profiler):
+    if window_size not in (3, 5):
+        raise ValueError("The pillow backend only supports 3x3 and 5x5 windows")
+    margin = window_size // 2
+    width, height = mask.size
+    kernel_filter = ImageFilter.Kernel((window_size, window_size), [1] * window_size ** 2, scale=255)
+    opaque_table = [255 if value else 0 for value in range(256)]
+    band = Image.new("L", (width, height), color=0) if keep_band else None
+    cloud_pixels = 0
+    for top, bottom in strips(mask, tile_height, margin):
+        input_top = max(0, top - margin)
+        input_bottom = min(height, bottom + margin)
+        with stage(profiler, "resize"):
+            rgb = reader.read(input_top, input_bottom)
+        with stage(profiler, "merge"):
+            alpha = mask.band.crop((0, input_top, width, input_bottom))
+            rgba = Image.merge("RGBA", rgb.split() + (alpha,))
+        with stage(profiler, "red_blue"):
+            original = red_blue_band(rgba, ratio_threshold)
+        # The kernel keeps the border of the strip, which is either the halo or the border of the frame
+        with stage(profiler, "convolution"):
+            convolved = original.filter(kernel_filter)
+        with stage(profiler, "select"):
+            output = select_output_band(original, convolved, low_threshold, high_threshold)
+            output = output.crop((0, top - input_top, width, bottom - input_top))
+        with stage(profiler, "count"):
+            opaque = alpha.crop((0, top - input_top, width, bottom - input_top)).point(opaque_table)
+            cloud_pixels += ImageChops.multiply(output, opaque).histogram()[255]
+        if keep_band:
+            band.paste(output, (0, top))
+    return Segmentation(band, mask.band, cloud_pixels, mask.opaque_pixels)
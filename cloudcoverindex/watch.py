@@ -0,0 +1,201 @@
+"""Continuous processing of the images that appear in a directory.
+
+The directory is polled, and a new JPEG file is processed once its size and
+modification time haven't changed for a settle time, so files that are still
+being written are left for a later poll. Every processed file is recorded in
+a checkpoint file, so after a restart only the files that weren't processed
+yet are. Results are appended to an output as JSON lines.
+
+A result is written before its file is recorded in the checkpoint, so a file
+whose processing is interrupted is processed again after a restart.
+"""
+import hashlib
+import json
+import os
+import time
+from datetime import datetime, timezone
+
+from cloudcoverindex.resultcache import default_cache_path
+
+# Extensions of the files that are processed, compared in lower case
+IMAGE_EXTENSIONS = (".jpg", ".jpeg")
+
+
+def default_checkpoint_path(directory):
+    """Returns the default location of the checkpoint of a directory, next to the result cache.
+
+    :param directory: path to the watched directory
+    :type directory: str
+    :rtype: str
+    """
+    digest = hashlib.sha1(os.path.abspath(directory).encode()).hexdigest()[:16]
+    return os.path.join(os.path.dirname(default_cache_path()), "watch-" + digest + ".checkpoint")
+
+
+class Checkpoint:
+    """Names of the files of a directory that have been processed, kept in a file.
+    Every name is appended to the file as soon as it is added.
+
+    :param path: path to the checkpoint file, created if it doesn't exist
+    :type path: str
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.__names = set()
+        if os.path.exists(path):
+            with open(path) as file:
+                for line in file:
+                    line = line.strip()
+                    if line:
+                        self.__names.add(json.loads(line))
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.__file = open(path, "a")
+
+    def add(self, name):
+        """Records a file as processed.
+
+        :param name: name of the file
+        :type name: str
+        """
+        self.__names.add(name)
+        self.__file.write(json.dumps(name) + "\n")
+        self.__file.flush()
+        os.fsync(self.__file.fileno())
+
+    def __contains__(self, name):
+        return name in self.__names
+
+    def __len__(self):
+        return len(self.__names)
+
+    def close(self):
+        """Closes the checkpoint file."""
+        self.__file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class FolderWatcher:
+    """Finds the new image files of a directory that are ready to be processed.
+
+    :param directory: path to the watched directory
+    :type directory: str
+    :param checkpoint: files that have already been processed
+    :type checkpoint: Checkpoint
+    :param settle_time: seconds the size and modification time of a file must stay the same
+    :type settle_time: float
+    """
+
+    def __init__(self, directory, checkpoint, settle_time=2.0):
+        self.directory = directory
+        self.checkpoint = checkpoint
+        self.settle_time = settle_time
+        # Last seen size and modification time of every unprocessed file, and when they were first seen
+        self.__pending = {}
+
+    def poll(self, now=None):
+        """Looks for new files and returns those that are ready, oldest first.
+        A returned file is expected to be recorded in the checkpoint once it is processed.
+
+        :param now: current monotonic time, by default time.monotonic()
+        :type now: float
+        :return: paths to the files that are ready
+        :rtype: list
+        """
+        if now is None:
+            now = time.monotonic()
+        seen = {}
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                if not entry.name.lower().endswith(IMAGE_EXTENSIONS) or entry.name in self.checkpoint:
+                    continue
+                try:
+                    if not entry.is_file():
+                        continue
+                    stat = entry.stat()
+                except OSError:
+                    # Removed while scanning
+                    continue
+                seen[entry.name] = (stat.st_size, stat.st_mtime_ns)
+
+        ready = []
+        pending = {}
+        for name, signature in seen.items():
+            previous = self.__pending.get(name)
+            if previous is None or previous[0] != signature:
+                pending[name] = (signature, now)
+            elif now - previous[1] >= self.settle_time:
+                ready.append((signature[1], name))
+            else:
+                pending[name] = previous
+        self.__pending = pending
+        return [os.path.join(self.directory, name) for _, name in sorted(ready)]
+
+
+def result_record(result):
+    """Builds the JSON record of a result.
+
+    :param result: The result of an image.
+    :type result: ImageResult
+    :rtype: dict
+    """
+    return {"path": result.path, "cloud_cover_index": result.cloud_cover_index,
+            "cloud_pixels": result.cloud_pixels, "total_pixels": result.total_pixels,
+            "save_path": result.save_path, "error": result.error,
+            "processed_at": datetime.now(timezone.utc).isoformat()}
+
+
+def process_ready(watcher, processor, output, save_path=None, now=None):
+    """Processes the files of a watcher that are ready, appending their results to an output.
+
+    :param watcher: The watcher of the directory.
+    :type watcher: FolderWatcher
+    :param processor: The processor of the images.
+    :type processor: ImageProcessor
+    :param output: file the results are written to, one JSON object per line
+    :param save_path: optional function returning the path to save the segmented image of a file at
+    :param now: current monotonic time, by default time.monotonic()
+    :type now: float
+    :return: The results of the processed files.
+    :rtype: list
+    """
+    paths = watcher.poll(now)
+    save_paths = [save_path(path) for path in paths] if save_path is not None else None
+    results = []
+    for result in processor.process(paths, save_paths):
+        output.write(json.dumps(result_record(result)) + "\n")
+        output.flush()
+        watcher.checkpoint.add(os.path.basename(result.path))
+        results.append(result)
+    return results
+
+
+def watch(directory, processor, output, checkpoint, interval=1.0, settle_time=2.0, save_path=None):
+    """Processes the files that appear in a directory until interrupted.
+
+    :param directory: path to the watched directory
+    :type directory: str
+    :param processor: The processor of the images, kept for the whole run.
+    :type processor: ImageProcessor
+    :param output: file the results are written to, one JSON object per line
+    :param checkpoint: files that have already been processed
+    :type checkpoint: Checkpoint
+    :param interval: seconds between polls
+    :type interval: float
+    :param settle_time: seconds the size and modification time of a file must stay the same
+    :type settle_time: float
+    :param save_path: optional function returning the path to save the segmented image of a file at
+    """
+    if not os.path.isdir(directory):
+        raise ValueError("Not a directory: " + directory)
+    watcher = FolderWatcher(directory, checkpoint, settle_time=settle_time)
+    while True:
+        process_ready(watcher, processor, output, save_path)
+        time.sleep(interval)
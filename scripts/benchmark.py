@@ -1,41 +1,667 @@
+"""Benchmark suite of the cloud cover index.
+
+Times every filter on its own over synthetic frames of several sizes, the
+whole CloudCoverApp pipeline and the batch processing over the sample images,
+also stored as uncompressed frames, the segmentation of the decoded sample
+images with and without the regions of the mask, the incremental segmentation of a sequence,
+the approximate index, saving and reading segmented images and the command
+line program.
+Every benchmark runs some warmup rounds and then several trials, and the
+median and percentiles of the trials are reported as JSON. Frames and
+segmenters a benchmark needs are prepared before it runs, so they are never
+timed, even without warmup.
+
+The accuracy of the approximate index against the exact one and of the fast
+downscale against LANCZOS on the sample images is reported too, unless their
+benchmarks are left out, and so is the speedup of the fast downscale and of
+segmenting only the regions of the mask, and that of segmenting single frames
+on more worker processes than one.
+
+When a baseline (the JSON output of a previous run) is given, the medians are
+compared with it and the run fails if any benchmark got slower than the tolerance.
+
+Run it from the root folder of the repository:
+
+    python -m scripts.benchmark --output results.json
+    python -m scripts.benchmark --baseline results.json
+"""
+import atexit
+import gc
+import glob
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
 import time
+from argparse import ArgumentParser
+
+import PIL
+from PIL import Image, ImageDraw
+
+from cloudcoverindex import filters
+from cloudcoverindex.batch import process_images
+from cloudcoverindex.cloudcoverindex import CloudCoverApp
+from cloudcoverindex.engine import load_frame, segment
+from cloudcoverindex.masks import load_mask, prepare_mask
+from cloudcoverindex.packed import SegmentationFile, read_counts, save_segmentation
+from cloudcoverindex.parallel import ParallelSegmenter, shared_memory
+from cloudcoverindex.refine import COARSE_FACTOR, CoarseToFineSegmenter
+from cloudcoverindex.sampling import estimate_cloud_cover
+from cloudcoverindex.sequence import SequenceProcessor
+
+MASK_PATH = "data/mask-1350-sq.png"
+SAMPLE_PATTERN = "data/sample_images/*"
+PERCENTILES = (10, 25, 50, 75, 90)
+# Error bounds the accuracy of the approximate index is measured with, the first one is timed
+ESTIMATE_ERROR_BOUNDS = (0.02, 0.01, 0.005)
+# Coarse factors and block sizes the coarse to fine segmentation is timed with
+REFINE_SETTINGS = ((4, 8), (8, 4))
+# Paths given to the command line program to time the validation of its arguments
+CLI_PATHS = 10000
+
+
+def sample_images():
+    """Returns the paths of the sample images, sorted by name.
+
+    :rtype: list
+    """
+    return sorted(path for path in glob.glob(SAMPLE_PATTERN) if path.lower().endswith((".jpg", ".jpeg")))
+
+
+def temporary_directory():
+    """Creates a directory for the files written by the benchmarks, removed when the program exits.
+
+    :rtype: str
+    """
+    directory = tempfile.mkdtemp(prefix="cci-benchmark-")
+    atexit.register(shutil.rmtree, directory, True)
+    return directory
+
+
+def synthetic_frame(size):
+    """Builds a frame with noisy sky and cloud like areas and a round mask, as the camera produces.
+
+    :param size: width and height of the frame
+    :type size: int
+    :return: A tuple (image, mask) with an RGB image and an L mask of the same size.
+    """
+    noise = Image.effect_noise((size, size), 48)
+    # Red stays below blue on the left half (sky) and close to it on the right half (clouds)
+    gradient = Image.linear_gradient("L").rotate(90).resize((size, size))
+    red = Image.blend(noise, gradient, 0.5)
+    blue = Image.blend(noise, Image.new("L", (size, size), 200), 0.5)
+    image = Image.merge("RGB", (red, noise, blue))
+    mask = Image.new("L", (size, size), 0)
+    ImageDraw.Draw(mask).ellipse((size // 16, size // 16, size - size // 16, size - size // 16), fill=255)
+    return image, mask
+
+
+def filter_benchmarks(sizes):
+    """Benchmarks of every filter on its own, over synthetic frames.
+
+    :param sizes: width and height of the synthetic frames
+    :type sizes: list
+    :return: A list of (name, function) pairs.
+    """
+    benchmarks = []
+    backends = ["numpy", "pillow"] if filters.np is not None else ["pillow"]
+    for size in sizes:
+        image, mask = synthetic_frame(size)
+        prepared = prepare_mask(mask)
+        rgba = filters.mask_filter(image, mask)
+        greyscale = filters.red_blue_filter(rgba)
+        segmented = filters.convolution_filter(greyscale)
+        rgb, alpha = load_frame(image, prepared)
+
+        benchmarks.append(("mask_filter/%d" % size, lambda image=image, mask=mask: filters.mask_filter(image, mask)))
+        for backend in backends:
+            benchmarks.append(("red_blue_filter/%s/%d" % (backend, size),
+                               lambda rgba=rgba, backend=backend: filters.red_blue_filter(rgba, backend=backend)))
+            benchmarks.append(("convolution_filter/%s/%d" % (backend, size),
+                               lambda greyscale=greyscale, backend=backend:
+                               filters.convolution_filter(greyscale, backend=backend)))
+            benchmarks.append(("count_cloud_pixels/%s/%d" % (backend, size),
+                               lambda segmented=segmented, backend=backend:
+                               filters.count_cloud_pixels(segmented, backend=backend)))
+        benchmarks.append(("segment/%d" % size,
+                           lambda rgb=rgb, alpha=alpha, prepared=prepared: segment(rgb, alpha, mask=prepared)))
+    return benchmarks
+
+
+def pipeline_benchmarks(paths, factors):
+    """Benchmarks of the whole processing of the sample images.
+
+    :param paths: paths to the sample images
+    :type paths: list
+    :param factors: downscale factors to run the pipeline with
+    :type factors: list
+    :return: A list of (name, function) pairs.
+    """
+    def run_app(factor, fast_downscale, coarse_factor=None):
+        mask = load_mask(MASK_PATH, downscale_factor=factor, fast_downscale=fast_downscale)
+        for path in paths:
+            CloudCoverApp(path, mask, coarse_factor=coarse_factor).get_cloud_cover_index()
+
+    def run_stacked(factor):
+        for result in CloudCoverApp.batch(paths, MASK_PATH, downscale_factor=factor):
+            assert result.ok, result.error
+
+    def run_batch(factor):
+        for result in process_images(paths, MASK_PATH, downscale_factor=factor):
+            assert result.ok, result.error
+
+    benchmarks = []
+    for factor in factors:
+        benchmarks.append(("CloudCoverApp/factor=%d" % factor, lambda factor=factor: run_app(factor, False)))
+        if factor != 1:
+            benchmarks.append(("CloudCoverApp/factor=%d/fast" % factor, lambda factor=factor: run_app(factor, True)))
+        benchmarks.append(("CloudCoverApp/factor=%d/refine=%d" % (factor, COARSE_FACTOR),
+                           lambda factor=factor: run_app(factor, False, COARSE_FACTOR)))
+        benchmarks.append(("CloudCoverApp.batch/factor=%d" % factor, lambda factor=factor: run_stacked(factor)))
+        benchmarks.append(("process_images/factor=%d" % factor, lambda factor=factor: run_batch(factor)))
+    return benchmarks
+
+
+def mask_region_benchmarks(paths, factors):
+    """Benchmarks of the segmentation of the decoded sample images over the whole frame,
+    only over the regions of the mask, and coarse to fine with every REFINE_SETTINGS.
+
+    :param paths: paths to the sample images
+    :type paths: list
+    :param factors: downscale factors of the frames
+    :type factors: list
+    :return: A list of (name, function) pairs.
+    """
+    def run(mask, frames, regions):
+        for rgb in frames:
+            segment(rgb, mask.alpha, mask=mask if regions else None)
+
+    def run_refined(segmenter, frames):
+        for rgb in frames:
+            segmenter.segment(rgb)
+
+    benchmarks = []
+    if filters.np is None:
+        return benchmarks
+    for factor in factors:
+        # Frames are decoded and segmenters built beforehand, so no trial times them even without warmup
+        mask = load_mask(MASK_PATH, downscale_factor=factor)
+        frames = [load_frame(Image.open(path), mask)[0] for path in paths]
+        benchmarks.append(("segment/factor=%d/whole_frame" % factor,
+                           lambda mask=mask, frames=frames: run(mask, frames, False)))
+        benchmarks.append(("segment/factor=%d/mask_regions" % factor,
+                           lambda mask=mask, frames=frames: run(mask, frames, True)))
+        for coarse_factor, block_size in REFINE_SETTINGS:
+            segmenter = CoarseToFineSegmenter(mask, coarse_factor=coarse_factor, block_size=block_size)
+            benchmarks.append(("segment/factor=%d/refine=%d/block=%d" % (factor, coarse_factor, block_size),
+                               lambda segmenter=segmenter, frames=frames: run_refined(segmenter, frames)))
+    return benchmarks
+
+
+def parallel_benchmarks(paths, factors, workers, segmenters):
+    """Benchmarks of the segmentation of single frames on several processes, end to end
+    from the image files and, with "/decoded", from images that are already decoded.
+    Every segmenter is created beforehand, so no trial times starting its workers,
+    and added to segmenters, they must be closed once the benchmarks have run.
+
+    :param paths: paths to the sample images
+    :type paths: list
+    :param factors: downscale factors of the frames
+    :type factors: list
+    :param workers: numbers of worker processes
+    :type workers: list
+    :param segmenters: list the created segmenters are added to
+    :type segmenters: list
+    :return: A list of (name, function) pairs.
+    """
+    def run(segmenter):
+        for path in paths:
+            with Image.open(path) as image:
+                segmenter.segment(image)
+
+    def run_decoded(segmenter, images):
+        for image in images:
+            segmenter.segment(image)
+
+    benchmarks = []
+    if filters.np is None or shared_memory is None:
+        return benchmarks
+    images = []
+    for path in paths:
+        images.append(Image.open(path))
+        images[-1].load()
+    for factor in factors:
+        for count in workers:
+            segmenters.append(ParallelSegmenter(load_mask(MASK_PATH, downscale_factor=factor), workers=count))
+            benchmarks.append(("ParallelSegmenter/factor=%d/workers=%d" % (factor, count),
+                               lambda segmenter=segmenters[-1]: run(segmenter)))
+            benchmarks.append(("ParallelSegmenter/factor=%d/workers=%d/decoded" % (factor, count),
+                               lambda segmenter=segmenters[-1]: run_decoded(segmenter, images)))
+    return benchmarks
+
+
+def sequence_benchmarks(paths, factors):
+    """Benchmarks of the incremental segmentation of a sequence of frames.
+    The sequence starts with the first sample image, and every following frame
+    takes a square patch of the second one, as a cloud moving into the sky.
+
+    :param paths: paths to the sample images
+    :type paths: list
+    :param factors: downscale factors of the frames
+    :type factors: list
+    :return: A list of (name, function) pairs.
+    """
+    def run(mask, frames, incremental):
+        processor = SequenceProcessor(mask)
+        for frame in frames:
+            if incremental:
+                processor.segment_array(frame)
+            else:
+                segment(frame, mask.alpha, mask=mask)
+
+    benchmarks = []
+    if len(paths) < 2 or filters.np is None:
+        return benchmarks
+    for factor in factors:
+        mask = load_mask(MASK_PATH, downscale_factor=factor)
+        first, second = [load_frame(Image.open(path), mask)[0] for path in paths[:2]]
+        height, width = first.shape[:2]
+        frames = [first]
+        for step in range(1, 9):
+            frame = frames[-1].copy()
+            top, left = height * step // 10, width * step // 10
+            frame[top:top + height // 10, left:left + width // 10] = second[top:top + height // 10,
+                                                                            left:left + width // 10]
+            frames.append(frame)
+        benchmarks.append(("segment/sequence/factor=%d" % factor,
+                           lambda mask=mask, frames=frames: run(mask, frames, False)))
+        benchmarks.append(("SequenceProcessor/factor=%d" % factor,
+                           lambda mask=mask, frames=frames: run(mask, frames, True)))
+    return benchmarks
+
+
+def save_benchmarks(paths, factors):
+    """Benchmarks of saving the segmented sample images as PNG images and as segmentation
+    files, and of reading the segmentation files back, into a temporary directory.
+
+    :param paths: paths to the sample images
+    :type paths: list
+    :param factors: downscale factors of the images
+    :type factors: list
+    :return: A list of (name, function) pairs.
+    """
+    directory = temporary_directory()
+
+    def save(segmentations, mask, extension):
+        for i, segmentation in enumerate(segmentations):
+            save_segmentation(segmentation, os.path.join(directory, "%d-%d%s" % (mask.downscale_factor, i,
+                                                                                 extension)), mask)
+
+    def read(files, mask):
+        for path in files:
+            with SegmentationFile(path) as file:
+                file.to_image(mask)
+
+    def count(files):
+        for path in files:
+            read_counts(path)
+
+    benchmarks = []
+    for factor in factors:
+        mask = load_mask(MASK_PATH, downscale_factor=factor)
+        segmentations = []
+        for path in paths:
+            with Image.open(path) as image:
+                segmentations.append(segment(*load_frame(image, mask), mask=mask))
+        # Files read by the benchmarks are written beforehand, so they can run on their own
+        save(segmentations, mask, ".cci")
+        files = [os.path.join(directory, "%d-%d.cci" % (factor, i)) for i in range(len(segmentations))]
+        benchmarks.append(("save/png/factor=%d" % factor,
+                           lambda segmentations=segmentations, mask=mask: save(segmentations, mask, ".png")))
+        benchmarks.append(("save/cci/factor=%d" % factor,
+                           lambda segmentations=segmentations, mask=mask: save(segmentations, mask, ".cci")))
+        benchmarks.append(("SegmentationFile/to_image/factor=%d" % factor,
+                           lambda files=files, mask=mask: read(files, mask)))
+        benchmarks.append(("read_counts/factor=%d" % factor, lambda files=files: count(files)))
+    return benchmarks
+
+
+def raw_frame_benchmarks(paths, factors):
+    """Benchmarks of CloudCoverApp over the sample images stored as uncompressed .npy frames,
+    which are memory mapped instead of decoded. Compare with the CloudCoverApp benchmarks.
+
+    :param paths: paths to the sample images
+    :type paths: list
+    :param factors: downscale factors to run the pipeline with
+    :type factors: list
+    :return: A list of (name, function) pairs.
+    """
+    def run_app(frames, factor, fast_downscale):
+        mask = load_mask(MASK_PATH, downscale_factor=factor, fast_downscale=fast_downscale)
+        for path in frames:
+            CloudCoverApp(path, mask).get_cloud_cover_index()
+
+    benchmarks = []
+    if filters.np is None:
+        return benchmarks
+    directory = temporary_directory()
+    frames = []
+    for i, path in enumerate(paths):
+        with Image.open(path) as image:
+            frames.append(os.path.join(directory, "%d.npy" % i))
+            filters.np.save(frames[-1], filters.np.asarray(image.convert("RGB")))
+    for factor in factors:
+        benchmarks.append(("CloudCoverApp/factor=%d/npy" % factor,
+                           lambda factor=factor: run_app(frames, factor, False)))
+        if factor != 1:
+            benchmarks.append(("CloudCoverApp/factor=%d/fast/npy" % factor,
+                               lambda factor=factor: run_app(frames, factor, True)))
+    return benchmarks
+
+
+def estimate_benchmarks(paths, factors):
+    """Benchmarks of the approximate index, of the sampling alone and with decoding the images.
+
+    :param paths: paths to the sample images
+    :type paths: list
+    :param factors: downscale factors of the frames
+    :type factors: list
+    :return: A list of (name, function) pairs.
+    """
+    def run_app(mask):
+        for path in paths:
+            CloudCoverApp.estimate_cloud_cover_index(path, mask, error_bound=ESTIMATE_ERROR_BOUNDS[0])
+
+    def run_sampling(mask, frames):
+        for rgb in frames:
+            estimate_cloud_cover(rgb, mask, error_bound=ESTIMATE_ERROR_BOUNDS[0])
+
+    benchmarks = []
+    if filters.np is None:
+        return benchmarks
+    for factor in factors:
+        mask = load_mask(MASK_PATH, downscale_factor=factor)
+        frames = [load_frame(Image.open(path), mask)[0] for path in paths]
+        benchmarks.append(("estimate_cloud_cover/factor=%d" % factor,
+                           lambda mask=mask, frames=frames: run_sampling(mask, frames)))
+        benchmarks.append(("CloudCoverApp.estimate/factor=%d" % factor, lambda mask=mask: run_app(mask)))
+    return benchmarks
+
+
+def estimate_accuracy(paths, factors, error_bounds=ESTIMATE_ERROR_BOUNDS, seed=0):
+    """Compares the approximate index of every sample image with its exact index.
+
+    :param paths: paths to the sample images
+    :type paths: list
+    :param factors: downscale factors of the frames
+    :type factors: list
+    :param error_bounds: error bounds the index is estimated with
+    :type error_bounds: tuple
+    :param seed: seed of the random points
+    :return: A dictionary with the estimates of every image and, for every factor and error bound,
+        the mean and largest absolute error and the fraction of intervals holding the exact index.
+    :rtype: dict
+    """
+    estimates = []
+    summary = {}
+    for factor in factors:
+        mask = load_mask(MASK_PATH, downscale_factor=factor)
+        for path in paths:
+            rgb, alpha = load_frame(Image.open(path), mask)
+            segmentation = segment(rgb, alpha, mask=mask)
+            exact = segmentation.cloud_pixels / segmentation.total_pixels
+            for error_bound in error_bounds:
+                start = time.perf_counter()
+                estimate = estimate_cloud_cover(rgb, mask, error_bound=error_bound, seed=seed)
+                estimates.append({"path": path, "factor": factor, "error_bound": error_bound, "exact": exact,
+                                  "estimate": estimate.cloud_cover_index, "lower": estimate.lower,
+                                  "upper": estimate.upper, "samples": estimate.samples,
+                                  "time": time.perf_counter() - start})
+        for error_bound in error_bounds:
+            rows = [row for row in estimates if row["factor"] == factor and row["error_bound"] == error_bound]
+            errors = [abs(row["estimate"] - row["exact"]) for row in rows]
+            summary["factor=%d/error_bound=%g" % (factor, error_bound)] = {
+                "mean_error": sum(errors) / len(errors), "max_error": max(errors),
+                "coverage": sum(row["lower"] <= row["exact"] <= row["upper"] for row in rows) / len(rows),
+                "mean_samples": sum(row["samples"] for row in rows) / len(rows)}
+    return {"estimates": estimates, "summary": summary}
+
+
+def fast_downscale_accuracy(paths, factors):
+    """Compares the index of every sample image downscaled with decode time scaling and box reduction
+    with its index downscaled with LANCZOS.
+
+    :param paths: paths to the sample images
+    :type paths: list
+    :param factors: downscale factors of the frames, a factor of 1 is skipped
+    :type factors: list
+    :return: A dictionary with the indexes of every image and, for every factor, the mean and largest
+        absolute difference between both indexes.
+    :rtype: dict
+    """
+    indexes = []
+    summary = {}
+    for factor in factors:
+        if factor == 1:
+            continue
+        lanczos_mask = load_mask(MASK_PATH, downscale_factor=factor)
+        fast_mask = load_mask(MASK_PATH, downscale_factor=factor, fast_downscale=True)
+        rows = []
+        for path in paths:
+            rows.append({"path": path, "factor": factor,
+                         "lanczos": CloudCoverApp(path, lanczos_mask).get_cloud_cover_index(),
+                         "fast": CloudCoverApp(path, fast_mask).get_cloud_cover_index()})
+        differences = [abs(row["fast"] - row["lanczos"]) for row in rows]
+        summary["factor=%d" % factor] = {"mean_difference": sum(differences) / len(differences),
+                                         "max_difference": max(differences)}
+        indexes.extend(rows)
+    return {"indexes": indexes, "summary": summary}
+
+
+def speedups(results, pairs):
+    """Ratios between the medians of pairs of benchmarks, for the pairs that ran.
+
+    :param results: results of the benchmarks, by name
+    :type results: dict
+    :param pairs: tuples (name, name of the slower benchmark, name of the faster one)
+    :type pairs: list
+    :return: The ratio of the slower median to the faster one of every pair, by name.
+    :rtype: dict
+    """
+    return {name: results[slower]["median"] / results[faster]["median"]
+            for name, slower, faster in pairs if slower in results and faster in results}
+
+
+def cli_benchmarks(paths):
+    """Benchmarks of the command line program, including the interpreter startup.
+    The program is also given CLI_PATHS paths together with --help, which validates
+    every path and exits before processing any image.
+
+    :param paths: paths to the sample images
+    :type paths: list
+    :return: A list of (name, function) pairs.
+    """
+    def run(arguments):
+        subprocess.run([sys.executable, "-m", "cloudcoverindex.cloudcoverindex"] + arguments, check=True,
+                       stdout=subprocess.DEVNULL)
+
+    return [("cli/help", lambda: run(["--help"])),
+            ("cli/help/paths=%d" % CLI_PATHS,
+             lambda: run([paths[i % len(paths)] for i in range(CLI_PATHS)] + ["--help"])),
+            ("cli/samples", lambda: run(paths + ["--no-cache"]))]
+
+
+def percentile(values, percent):
+    """Percentile of the values, interpolating linearly between the closest ranks.
+
+    :param values: sorted values
+    :type values: list
+    :param percent: percentile between 0 and 100
+    :rtype: float
+    """
+    position = (len(values) - 1) * percent / 100
+    lower = int(position)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+
+def run_benchmark(function, trials, warmup):
+    """Times a function, after running it some times to warm up caches.
+
+    :param function: the benchmarked function, called without arguments
+    :param trials: number of timed calls
+    :type trials: int
+    :param warmup: number of calls that aren't timed
+    :type warmup: int
+    :return: A dictionary with the times of every trial and their statistics, in seconds.
+    :rtype: dict
+    """
+    for _ in range(warmup):
+        function()
+    times = []
+    for _ in range(trials):
+        gc.collect()
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    ordered = sorted(times)
+    result = {"trials": trials, "times": times, "min": ordered[0], "max": ordered[-1],
+              "mean": sum(times) / trials, "median": percentile(ordered, 50)}
+    for percent in PERCENTILES:
+        result["p%d" % percent] = percentile(ordered, percent)
+    return result
+
+
+def compare(results, baseline, tolerance):
+    """Compares the medians of a run with those of a baseline.
+
+    :param results: benchmarks of the run
+    :type results: dict
+    :param baseline: benchmarks of the baseline
+    :type baseline: dict
+    :param tolerance: relative slowdown of the median that is still accepted
+    :type tolerance: float
+    :return: A dictionary with the ratio between both medians of every benchmark in both runs,
+        and a list with the names of the regressions.
+    :rtype: tuple
+    """
+    ratios = {}
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        ratios[name] = result["median"] / baseline[name]["median"]
+        if ratios[name] > 1 + tolerance:
+            regressions.append(name)
+    return ratios, regressions
+
+
+def environment():
+    """Versions and hardware the benchmarks ran on.
+
+    :rtype: dict
+    """
+    return {"python": platform.python_version(), "pillow": PIL.__version__,
+            "numpy": filters.np.__version__ if filters.np is not None else None, "backend": filters.BACKEND,
+            "platform": platform.platform(), "cpus": os.cpu_count()}
+
+
+def main():
+    parser = ArgumentParser(description="Benchmark suite of the cloud cover index")
+    parser.add_argument("--trials", type=int, default=5, metavar="N", help="timed runs of every benchmark (default: 5)")
+    parser.add_argument("--warmup", type=int, default=1, metavar="N",
+                        help="runs of every benchmark before timing it (default: 1)")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[256, 1024, 2048], metavar="SIZE",
+                        help="width and height of the synthetic frames (default: 256 1024 2048)")
+    parser.add_argument("--factors", type=int, nargs="+", default=[1, 4], metavar="FACTOR",
+                        help="downscale factors of the pipeline benchmarks (default: 1 4)")
+    parser.add_argument("--workers", type=int, nargs="+", default=sorted({1, os.cpu_count() or 1}), metavar="N",
+                        help="worker processes of the single frame benchmarks (default: 1 and the number of CPUs)")
+    parser.add_argument("--only", type=str, default=None, metavar="TEXT",
+                        help="only run the benchmarks whose name contains the text")
+    parser.add_argument("--output", type=str, default=None, metavar="FILE",
+                        help="write the results to a JSON file instead of the standard output")
+    parser.add_argument("--baseline", type=str, default=None, metavar="FILE",
+                        help="results of a previous run, fail if any median is slower than the tolerance")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="relative slowdown accepted against the baseline (default: 0.2)")
+    args = parser.parse_args()
+    if args.trials < 1 or args.warmup < 0:
+        parser.error("at least one trial is needed and warmup can't be negative")
+
+    paths = sample_images()
+    segmenters = []
+    benchmarks = filter_benchmarks(args.sizes) + pipeline_benchmarks(paths, args.factors) + \
+        mask_region_benchmarks(paths, args.factors) + \
+        parallel_benchmarks(paths, args.factors, args.workers, segmenters) + \
+        raw_frame_benchmarks(paths, args.factors) + sequence_benchmarks(paths, args.factors) + \
+        save_benchmarks(paths, args.factors) + \
+        estimate_benchmarks(paths, args.factors) + cli_benchmarks(paths)
+    if args.only is not None:
+        benchmarks = [(name, function) for name, function in benchmarks if args.only in name]
+
+    results = {}
+    try:
+        for name, function in benchmarks:
+            results[name] = run_benchmark(function, args.trials, args.warmup)
+            print("%-40s median %9.4f s  p90 %9.4f s" % (name, results[name]["median"], results[name]["p90"]),
+                  file=sys.stderr)
+    finally:
+        for segmenter in segmenters:
+            segmenter.close()
+
+    report = {"environment": environment(),
+              "settings": {"trials": args.trials, "warmup": args.warmup, "sizes": args.sizes,
+                           "factors": args.factors, "workers": args.workers, "images": len(paths)},
+              "benchmarks": results}
+    report["speedups"] = speedups(results, [("fast_downscale/factor=%d" % factor, "CloudCoverApp/factor=%d" % factor,
+                                             "CloudCoverApp/factor=%d/fast" % factor) for factor in args.factors] +
+                                  [("mask_regions/factor=%d" % factor, "segment/factor=%d/whole_frame" % factor,
+                                    "segment/factor=%d/mask_regions" % factor) for factor in args.factors] +
+                                  [("refine=%d/block=%d/factor=%d" % (coarse_factor, block_size, factor),
+                                    "segment/factor=%d/mask_regions" % factor,
+                                    "segment/factor=%d/refine=%d/block=%d" % (factor, coarse_factor, block_size))
+                                   for factor in args.factors for coarse_factor, block_size in REFINE_SETTINGS] +
+                                  [("workers=%d/factor=%d%s" % (count, factor, decoded),
+                                    "ParallelSegmenter/factor=%d/workers=1%s" % (factor, decoded),
+                                    "ParallelSegmenter/factor=%d/workers=%d%s" % (factor, count, decoded))
+                                   for factor in args.factors for count in args.workers if count != 1
+                                   for decoded in ("", "/decoded")])
+    for name, ratio in report["speedups"].items():
+        print("Speedup %-31s %.2fx" % (name, ratio), file=sys.stderr)
+    if any(name.startswith("CloudCoverApp/factor=") and name.endswith("/fast") for name, _ in benchmarks):
+        report["fast_downscale"] = fast_downscale_accuracy(paths, args.factors)
+        for name, summary in report["fast_downscale"]["summary"].items():
+            print("Fast downscale %-24s mean difference %.4f  max difference %.4f" %
+                  (name, summary["mean_difference"], summary["max_difference"]), file=sys.stderr)
+    if filters.np is not None and any(name.startswith("estimate_cloud_cover/") for name, _ in benchmarks):
+        report["accuracy"] = estimate_accuracy(paths, args.factors)
+        for name, summary in report["accuracy"]["summary"].items():
+            print("Estimate %-28s mean error %.4f  max error %.4f  coverage %.2f" %
+                  (name, summary["mean_error"], summary["max_error"], summary["coverage"]), file=sys.stderr)
+    regressions = []
+    if args.baseline is not None:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+        ratios, regressions = compare(results, baseline["benchmarks"], args.tolerance)
+        report["baseline"] = {"path": args.baseline, "tolerance": args.tolerance, "ratios": ratios,
+                              "regressions": regressions}
+        for name in regressions:
+            print("Regression: %s is %.2fx slower than the baseline" % (name, ratios[name]), file=sys.stderr)
+
+    if args.output is not None:
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+    if regressions:
+        sys.exit(1)
 
 
-# Ugly hack to allow absolute import from the root folder
-# whatever its name is. Please forgive the heresy.
-if __name__ == "__main__" and __package__ is None:
-    from sys import path
-    from os.path import dirname as dir
-
-    path.append(dir(path[0]))
-    __package__ = "examples"
-
-import cloudcoverindex.cloudcoverindex as cci
-
-def benchmark(factor):
-    print(f"Benchmark for downscale factor = {factor}")
-    t0 = time.perf_counter()
-
-    image1 = cci.CloudCoverApp("data/sample_images/11833.JPG", "data/mask-1350-sq.png", downscale_factor=factor)
-    print("Image 1 Cloud Cover", image1.get_cloud_cover_index())
-    image2 = cci.CloudCoverApp("data/sample_images/11836.JPG", "data/mask-1350-sq.png", downscale_factor=factor)
-    print("Image 2 Cloud Cover", image2.get_cloud_cover_index())
-    image3 = cci.CloudCoverApp("data/sample_images/11838.jpg", "data/mask-1350-sq.png", downscale_factor=factor)
-    print("Image 3 Cloud Cover", image3.get_cloud_cover_index())
-    image4 = cci.CloudCoverApp("data/sample_images/11839.JPG", "data/mask-1350-sq.png", downscale_factor=factor)
-    print("Image 4 Cloud Cover", image4.get_cloud_cover_index())
-    image5 = cci.CloudCoverApp("data/sample_images/11840.JPG", "data/mask-1350-sq.png", downscale_factor=factor)
-    print("Image 5 Cloud Cover", image5.get_cloud_cover_index())
-    image6 = cci.CloudCoverApp("data/sample_images/11841.JPG", "data/mask-1350-sq.png", downscale_factor=factor)
-    print("Image 6 Cloud Cover", image6.get_cloud_cover_index())
-
-    elapsed = time.perf_counter() - t0
-    print(f"Benchmark Completed in {elapsed} seconds.")
-    print()
-
-
-benchmark(1)
-benchmark(2)
-benchmark(4)
-benchmark(6)
-benchmark(8)
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+"""Load test of a running cloud cover index server.
+
+Sends requests for the sample images from several concurrent connections and
+reports the throughput and the latency percentiles of the responses as JSON.
+Start the server first, for example:
+
+    python -m cloudcoverindex --serve /tmp/cci.sock -j 4
+    python -m scripts.loadtest --address /tmp/cci.sock --requests 500 --concurrency 16
+"""
+import asyncio
+import json
+import os
+import sys
+import time
+from argparse import ArgumentParser
+
+from cloudcoverindex.server import CloudCoverClient
+from scripts.benchmark import percentile, sample_images
+
+
+async def client_worker(address, requests, send_bytes, images, latencies, errors):
+    """Sends requests one after the other until there are none left.
+
+    :param address: address of the server
+    :type address: str
+    :param requests: iterator of the paths to request, shared by every worker
+    :param send_bytes: send the contents of the images instead of their paths
+    :type send_bytes: bool
+    :param images: contents of every image, by path
+    :type images: dict
+    :param latencies: list the latency of every response is added to
+    :type latencies: list
+    :param errors: list the error of every failed request is added to
+    :type errors: list
+    """
+    client = await CloudCoverClient.connect(address)
+    try:
+        for path in requests:
+            start = time.perf_counter()
+            if send_bytes:
+                response = await client.request(image=images[path])
+            else:
+                response = await client.request(path=path)
+            latencies.append(time.perf_counter() - start)
+            if "error" in response:
+                errors.append(response["error"])
+    finally:
+        await client.close()
+
+
+async def load_test(address, paths, count, concurrency, send_bytes):
+    """Runs the load test.
+
+    :param address: address of the server
+    :type address: str
+    :param paths: paths to the requested images, requested in turns
+    :type paths: list
+    :param count: total number of requests
+    :type count: int
+    :param concurrency: number of connections sending requests at the same time
+    :type concurrency: int
+    :param send_bytes: send the contents of the images instead of their paths
+    :type send_bytes: bool
+    :return: The report of the test.
+    :rtype: dict
+    """
+    images = {}
+    if send_bytes:
+        for path in paths:
+            with open(path, "rb") as file:
+                images[path] = file.read()
+    requests = iter([paths[i % len(paths)] for i in range(count)])
+    latencies = []
+    errors = []
+    start = time.perf_counter()
+    await asyncio.gather(*[client_worker(address, requests, send_bytes, images, latencies, errors)
+                           for _ in range(concurrency)])
+    duration = time.perf_counter() - start
+
+    ordered = sorted(latencies)
+    return {"requests": len(latencies), "errors": len(errors), "concurrency": concurrency,
+            "send_bytes": send_bytes, "duration": duration, "throughput": len(latencies) / duration,
+            "latency": {"mean": sum(latencies) / len(latencies), "p50": percentile(ordered, 50),
+                        "p90": percentile(ordered, 90), "p99": percentile(ordered, 99), "max": ordered[-1]}}
+
+
+def main():
+    parser = ArgumentParser(description="Load test of a cloud cover index server")
+    parser.add_argument("--address", type=str, required=True,
+                        help="Unix socket path or TCP host:port of the server")
+    parser.add_argument("--requests", type=int, default=200, metavar="N",
+                        help="total number of requests (default: 200)")
+    parser.add_argument("--concurrency", type=int, default=8, metavar="N",
+                        help="connections sending requests at the same time (default: 8)")
+    parser.add_argument("--bytes", action="store_true",
+                        help="send the contents of the images instead of their paths")
+    parser.add_argument("paths", type=str, nargs="*", metavar="PATH/TO/IMAGE",
+                        help="requested images (default: the sample images)")
+    args = parser.parse_args()
+    if args.requests < 1 or args.concurrency < 1:
+        parser.error("requests and concurrency must be at least 1")
+
+    paths = [os.path.abspath(path) for path in args.paths or sample_images()]
+    loop = asyncio.new_event_loop()
+    try:
+        report = loop.run_until_complete(load_test(args.address, paths, args.requests, args.concurrency,
+                                                   args.bytes))
+    finally:
+        loop.close()
+    json.dump(report, sys.stdout, indent=2)
+    print()
+    if report["errors"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
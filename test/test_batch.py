@@ -0,0 +1,67 @@
+from PIL import Image
+
+from cloudcoverindex.batch import process_images, process_stacked
+from cloudcoverindex.cloudcoverindex import CloudCoverApp
+from cloudcoverindex.masks import prepare_mask
+from test.test_cloudcoverindex import random_rgba_image
+
+
+def write_batch_files(tmp_path):
+    mask_path = str(tmp_path / "mask.png")
+    random_rgba_image((40, 30), seed=1).getchannel("A").save(mask_path)
+    paths = []
+    for seed in range(4):
+        path = str(tmp_path / ("image%d.jpg" % seed))
+        random_rgba_image((48, 36), seed=seed).convert("RGB").save(path)
+        paths.append(path)
+    broken_path = str(tmp_path / "broken.jpg")
+    with open(broken_path, "wb") as broken:
+        broken.write(b"not a jpeg")
+    paths.insert(2, broken_path)
+    return paths, mask_path
+
+
+def test_process_images(tmp_path, subtests):
+    """
+    Test Partitions:
+    Jobs: 1, more than 1
+    Images: valid, broken
+    """
+    paths, mask_path = write_batch_files(tmp_path)
+    expected = None
+    for jobs in (1, 2):
+        with subtests.test(msg="Jobs %d" % jobs, jobs=jobs):
+            save_paths = [str(tmp_path / ("seg%d-%d.png" % (jobs, i))) for i in range(len(paths))]
+            results = list(process_images(paths, mask_path, downscale_factor=2, jobs=jobs, save_paths=save_paths))
+            assert [result.path for result in results] == paths
+            assert not results[2].ok
+            assert results[2].cloud_cover_index is None
+            assert all(result.ok for i, result in enumerate(results) if i != 2)
+            assert Image.open(save_paths[0]).size == (20, 15)
+
+            counts = [(result.cloud_pixels, result.total_pixels) for result in results]
+            if expected is None:
+                expected = counts
+            assert counts == expected
+
+
+def test_process_stacked(tmp_path, subtests):
+    """
+    Test Partitions:
+    Stack size: 1, smaller than the images, bigger than the images
+    Images: valid, broken
+    """
+    paths, mask_path = write_batch_files(tmp_path)
+    mask = prepare_mask(Image.open(mask_path), downscale_factor=2)
+    expected = [(result.cloud_pixels, result.total_pixels)
+                for result in process_images(paths, mask_path, downscale_factor=2)]
+    for stack_size in (1, 2, 10):
+        with subtests.test(msg="Stack size %d" % stack_size):
+            results = list(process_stacked(paths, mask, stack_size=stack_size))
+            assert [result.path for result in results] == paths
+            assert not results[2].ok
+            assert [(result.cloud_pixels, result.total_pixels) for result in results] == expected
+
+    with subtests.test(msg="CloudCoverApp.batch"):
+        results = CloudCoverApp.batch(paths, mask_path, downscale_factor=2, stack_size=3)
+        assert [(result.cloud_pixels, result.total_pixels) for result in results] == expected
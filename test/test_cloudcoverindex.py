@@ -1,7 +1,14 @@
+import io
+import os
+import random
+import subprocess
+import sys
+
 from PIL import Image, ImageDraw
 
 # TODO add TestCase for downscale > 1
 from cloudcoverindex import filters
+from cloudcoverindex.cloudcoverindex import is_jpeg, split_arguments
 
 
 def test_mask_filter(subtests):
@@ -320,3 +327,219 @@ def image_from_kernel(kernel, size):
 def assert_central_pixel_value(result_image, expected_value):
     result_pixels = result_image.load()
     assert result_pixels[2, 2][0] == expected_value
+
+
+def test_red_blue_filter_backends(subtests):
+    """
+    Test Partitions:
+    Backend: numpy, pillow, python
+    Ratio threshold: default, custom
+    Input: random pixels including transparent pixels and 0 blue component
+    """
+    image = random_rgba_image((60, 40))
+    for ratio_threshold in (0.95, 1.3):
+        expected = filters.red_blue_filter(image, ratio_threshold=ratio_threshold, backend="python")
+        for backend in ("numpy", "pillow", "python"):
+            with subtests.test(msg="Backend %s threshold %s" % (backend, ratio_threshold), backend=backend):
+                result = filters.red_blue_filter(image, ratio_threshold=ratio_threshold, backend=backend)
+                assert result.mode == "LA"
+                assert result.tobytes() == expected.tobytes()
+
+
+def test_red_blue_table(subtests):
+    """
+    Test Partitions:
+    Blue component: 0, bigger than 0
+    Ratio: bigger than threshold, exactly the threshold, smaller than threshold
+    """
+    table = filters.red_blue_table(0.95)
+    with subtests.test(msg="Blue 0"):
+        assert table[0 * 256 + 0] == 255
+        assert table[200 * 256 + 0] == 255
+    with subtests.test(msg="Ratio exactly 0.95"):
+        assert table[19 * 256 + 20] == 0
+    with subtests.test(msg="Ratio close to 0.95"):
+        assert table[100 * 256 + 104] == 255
+        assert table[100 * 256 + 106] == 0
+    with subtests.test(msg="Cached per threshold"):
+        assert filters.red_blue_table(0.95) is table
+        assert filters.red_blue_table(0.5)[60 * 256 + 100] == 255
+
+
+def random_rgba_image(size, seed=0):
+    rng = random.Random(seed)
+    image = Image.new("RGBA", size)
+    data = []
+    for _ in range(size[0] * size[1]):
+        red, green, blue = rng.randrange(256), rng.randrange(256), rng.randrange(256)
+        if rng.random() < 0.1:
+            blue = 0
+        alpha = 0 if rng.random() < 0.2 else rng.randrange(1, 256)
+        data.append((red, green, blue, alpha))
+    image.putdata(data)
+    return image
+
+
+def test_convolution_filter_backends(subtests):
+    """
+    Test Partitions:
+    Image size: smaller than the window, equal to the window, bigger than the window
+    Window size: 3, 5
+    Backend: numpy, pillow
+    """
+    for size in [(4, 9), (5, 5), (23, 17)]:
+        image = random_la_image(size)
+        for window_size in (3, 5):
+            with subtests.test(msg="Size %s window %d" % (size, window_size), size=size):
+                expected = filters.convolution_filter(image, window_size=window_size, backend="python")
+                for backend in ("numpy", "pillow"):
+                    result = filters.convolution_filter(image, window_size=window_size, backend=backend)
+                    assert result.tobytes() == expected.tobytes()
+
+
+def test_convolution_filter_window_size():
+    """
+    A 7x7 window with custom thresholds compared against counting the neighbours directly.
+    """
+    size = (15, 12)
+    image = random_la_image(size, seed=3)
+    result = filters.convolution_filter(image, window_size=7, low_threshold=20, high_threshold=30).load()
+    original = image.load()
+    for x in range(size[0]):
+        for y in range(size[1]):
+            if x < 3 or y < 3 or x >= size[0] - 3 or y >= size[1] - 3:
+                expected = original[x, y][0]
+            else:
+                count = sum(original[i, j][0] == 255 for i in range(x - 3, x + 4) for j in range(y - 3, y + 4))
+                expected = 0 if count <= 20 else original[x, y][0] if count <= 30 else 255
+            assert result[x, y][0] == expected
+
+
+def random_la_image(size, seed=0):
+    rng = random.Random(seed)
+    image = Image.new("LA", size)
+    image.putdata([(255 * (rng.random() < 0.55), 255 * (rng.random() < 0.8)) for _ in range(size[0] * size[1])])
+    return image
+
+
+def test_count_cloud_pixels(subtests):
+    """
+    Test Partitions:
+    Pixels: white opaque, white transparent, black opaque, black transparent, grey opaque
+    Backend: numpy, pillow
+    """
+    image = Image.new("LA", (4, 3), (0, 0))
+    image.putdata([(255, 255), (255, 0), (0, 255), (0, 0),
+                   (255, 10), (128, 255), (255, 255), (0, 1),
+                   (0, 0), (0, 0), (0, 0), (0, 0)])
+    for backend in ("numpy", "pillow"):
+        with subtests.test(msg="Mixed pixels", image=image, backend=backend):
+            assert filters.count_cloud_pixels(image, backend=backend) == (3, 6)
+
+    image = Image.new("LA", (10, 10), (255, 0))
+    for backend in ("numpy", "pillow"):
+        with subtests.test(msg="All transparent", image=image, backend=backend):
+            assert filters.count_cloud_pixels(image, backend=backend) == (0, 0)
+
+
+def test_mask_filter_fast_downscale(subtests):
+    """
+    Test Partitions:
+    Image: JPEG not loaded yet (decoded with draft), already in memory
+    Downscale factor: 2, 3, 4, 8
+    """
+    image = random_rgba_image((130, 110), seed=4).convert("RGB")
+    mask = random_rgba_image((100, 90), seed=5).getchannel("A")
+    jpeg_data = io.BytesIO()
+    image.save(jpeg_data, "JPEG")
+
+    for factor in (2, 3, 4, 8):
+        new_size = (mask.size[0] // factor, mask.size[1] // factor)
+        with subtests.test(msg="In memory image, factor %d" % factor, image=image):
+            result = filters.mask_filter(image, mask, downscale_factor=factor, fast_downscale=True)
+            assert result.size == new_size
+            box = (0, 0, new_size[0] * factor, new_size[1] * factor)
+            expected = image.crop((15, 10, 115, 100)).reduce(factor, box=box)
+            assert result.convert("RGB").tobytes() == expected.tobytes()
+            expected_mask = mask.reduce(factor, box=box)
+            assert result.getchannel("A").tobytes() == expected_mask.tobytes()
+
+        with subtests.test(msg="JPEG image, factor %d" % factor, image=image):
+            jpeg_data.seek(0)
+            result = filters.mask_filter(Image.open(jpeg_data), mask, downscale_factor=factor, fast_downscale=True)
+            assert result.mode == "RGBA"
+            assert result.size == new_size
+
+
+def test_is_jpeg(tmp_path, subtests):
+    """
+    Test Partitions:
+    File: JPEG image, PNG image, empty, missing
+    """
+    image = Image.new("RGB", (8, 8), (10, 20, 30))
+    image.save(str(tmp_path / "image.jpg"), "JPEG")
+    image.save(str(tmp_path / "image.png"), "PNG")
+    (tmp_path / "empty.jpg").write_bytes(b"")
+
+    with subtests.test(msg="JPEG image"):
+        assert is_jpeg(str(tmp_path / "image.jpg"))
+    with subtests.test(msg="PNG image"):
+        assert not is_jpeg(str(tmp_path / "image.png"))
+    with subtests.test(msg="Empty file"):
+        assert not is_jpeg(str(tmp_path / "empty.jpg"))
+    with subtests.test(msg="Missing file"):
+        try:
+            is_jpeg(str(tmp_path / "missing.jpg"))
+            assert False, "Expected an OSError"
+        except OSError:
+            pass
+
+
+def test_split_arguments(tmp_path, capsys, subtests):
+    """
+    Test Partitions:
+    Argument: JPEG path, uncompressed frame, other file, missing file, flag group, option with a value,
+        option with an attached value, short option with an attached value, unknown option, help
+    """
+    jpeg_path = str(tmp_path / "image.jpg")
+    png_path = str(tmp_path / "image.png")
+    image = Image.new("RGB", (8, 8), (10, 20, 30))
+    image.save(jpeg_path, "JPEG")
+    image.save(png_path, "PNG")
+
+    with subtests.test(msg="JPEG path and flag group"):
+        assert split_arguments([jpeg_path, "sp"]) == [jpeg_path, "--S", "--percentage"]
+    with subtests.test(msg="Other file"):
+        assert split_arguments([png_path, jpeg_path]) == [jpeg_path]
+        assert png_path in capsys.readouterr().err
+    with subtests.test(msg="Options"):
+        assert split_arguments(["-j", "2", "--cache=" + png_path, "--no-cache", jpeg_path]) == \
+            ["-j", "2", "--cache=" + png_path, "--no-cache", jpeg_path]
+    with subtests.test(msg="Flag groups"):
+        assert split_arguments(["-sp", "S", "--S", "--percentage", jpeg_path]) == \
+            ["--S", "--percentage", "--S", "--S", "--percentage", jpeg_path]
+    with subtests.test(msg="Short options with an attached value"):
+        assert split_arguments(["-j4", jpeg_path]) == ["-j4", jpeg_path]
+    with subtests.test(msg="Unknown arguments"):
+        assert split_arguments(["--jbos", "4", jpeg_path]) == ["--jbos", jpeg_path]
+        assert "\"4\"" in capsys.readouterr().err
+        assert split_arguments([str(tmp_path / "missing.jpg"), jpeg_path]) == [jpeg_path]
+        assert "missing.jpg" in capsys.readouterr().err
+    with subtests.test(msg="Help"):
+        assert split_arguments(["--help", jpeg_path]) == ["--help", jpeg_path]
+    with subtests.test(msg="Uncompressed frames"):
+        raw_path = str(tmp_path / "frame.rgb")
+        (tmp_path / "frame.rgb").write_bytes(image.tobytes())
+        assert split_arguments([raw_path, "--frame-size", "8x8"]) == [raw_path, "--frame-size", "8x8"]
+
+
+def test_lazy_imports():
+    """
+    Test Partitions:
+    Imported: the command line module alone
+    """
+    code = "import sys, cloudcoverindex.cloudcoverindex; print('numpy' in sys.modules, 'PIL' in sys.modules)"
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    output = subprocess.run([sys.executable, "-c", code], stdout=subprocess.PIPE, check=True,
+                            universal_newlines=True, cwd=root).stdout
+    assert output.split() == ["False", "False"]
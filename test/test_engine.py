@@ -0,0 +1,94 @@
+import numpy as np
+from PIL import Image, ImageDraw
+
+from cloudcoverindex import engine, filters
+from cloudcoverindex.masks import prepare_mask
+from test.test_cloudcoverindex import random_rgba_image
+
+
+def test_segment_matches_filter_chain(subtests):
+    """
+    Test Partitions:
+    Image size: bigger than mask, equal to mask
+    Downscale factor: 1, 2
+    """
+    mask = random_rgba_image((40, 30), seed=1).getchannel("A")
+    for image_size in [(40, 30), (50, 36)]:
+        image = random_rgba_image(image_size, seed=2).convert("RGB")
+        for downscale_factor in (1, 2):
+            with subtests.test(msg="Size %s factor %d" % (image_size, downscale_factor), image=image):
+                expected = filters.mask_filter(image, mask, downscale_factor=downscale_factor)
+                expected = filters.convolution_filter(filters.red_blue_filter(expected))
+
+                rgb, alpha = engine.load_frame(image, mask, downscale_factor=downscale_factor)
+                segmentation = engine.segment(rgb, alpha)
+
+                assert segmentation.to_image().tobytes() == expected.tobytes()
+                assert (segmentation.cloud_pixels, segmentation.total_pixels) == filters.count_cloud_pixels(expected)
+
+
+def test_segment_with_mask_regions(monkeypatch, subtests):
+    """
+    Test Partitions:
+    Mask: circle touching the border, small blob far from the border, fully transparent
+    Band height: smaller than the window, bigger than the image
+    """
+    size = (70, 50)
+    rgb, _ = engine.load_frame(random_rgba_image(size, seed=7).convert("RGB"), Image.new("L", size))
+    masks = {}
+    masks["circle"] = Image.new("L", size, 0)
+    ImageDraw.Draw(masks["circle"]).ellipse((0, 0, size[0] - 1, size[1] - 1), fill=255)
+    masks["blob"] = Image.new("L", size, 0)
+    ImageDraw.Draw(masks["blob"]).ellipse((30, 20, 40, 26), fill=200)
+    masks["transparent"] = Image.new("L", size, 0)
+
+    for name, mask in masks.items():
+        prepared = prepare_mask(mask)
+        expected = engine.segment(rgb, prepared.alpha)
+        for band_height in (3, 100):
+            with subtests.test(msg="Mask %s band height %d" % (name, band_height)):
+                monkeypatch.setattr(engine, "BAND_HEIGHT", band_height)
+                result = engine.segment(rgb, prepared.alpha, mask=prepared)
+                assert (result.band == expected.band).all()
+                assert (result.cloud_pixels, result.total_pixels) == (expected.cloud_pixels, expected.total_pixels)
+
+
+def test_segment_images():
+    """
+    Frames kept as images, as load_frame returns them without numpy, give the same segmentation.
+    """
+    mask = prepare_mask(random_rgba_image((40, 30), seed=1).getchannel("A"))
+    image = random_rgba_image((40, 30), seed=8).convert("RGB")
+    expected = engine.segment(*engine.load_frame(image, mask), mask=mask)
+    result = engine.segment(image, mask.band)
+    assert result.to_image().tobytes() == expected.to_image().tobytes()
+    assert (result.cloud_pixels, result.total_pixels) == (expected.cloud_pixels, expected.total_pixels)
+
+
+def test_segment_stack(monkeypatch, subtests):
+    """
+    Test Partitions:
+    Frames: one, several
+    Group: one frame, several frames, the whole stack
+    Frame size: smaller than the window
+    """
+    size = (70, 50)
+    mask = Image.new("L", size, 0)
+    ImageDraw.Draw(mask).ellipse((0, 5, size[0] - 1, size[1] - 6), fill=255)
+    prepared = prepare_mask(mask)
+    stack = np.stack([engine.load_frame(random_rgba_image(size, seed=seed).convert("RGB"), prepared)[0]
+                      for seed in range(5)])
+    expected = [(segmentation.cloud_pixels, segmentation.total_pixels)
+                for segmentation in (engine.segment(frame, prepared.alpha) for frame in stack)]
+    for stack_pixels in (1, 2 * engine.BAND_HEIGHT * size[0], 1 << 30):
+        for frames in (1, 5):
+            with subtests.test(msg="Frames %d stack pixels %d" % (frames, stack_pixels)):
+                monkeypatch.setattr(engine, "STACK_PIXELS", stack_pixels)
+                assert engine.segment_stack(stack[:frames], prepared) == expected[:frames]
+
+    with subtests.test(msg="Smaller than the window"):
+        small_mask = prepare_mask(random_rgba_image((4, 4), seed=2).getchannel("A"))
+        small = stack[:3, :4, :4]
+        expected = [(segmentation.cloud_pixels, segmentation.total_pixels)
+                    for segmentation in (engine.segment(frame, small_mask.alpha) for frame in small)]
+        assert engine.segment_stack(small, small_mask) == expected
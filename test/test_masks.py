@@ -0,0 +1,92 @@
+import os
+
+from PIL import Image
+
+from cloudcoverindex import filters
+from cloudcoverindex.masks import MaskCache, prepare_mask
+from test.test_cloudcoverindex import random_rgba_image
+
+
+def test_prepare_mask(subtests):
+    """
+    Test Partitions:
+    Downscale factor: 1, bigger than 1
+    Downscale mode: LANCZOS, fast
+    """
+    mask = Image.new("L", (40, 30), 0)
+    mask.paste(255, (10, 5, 30, 25))
+    with subtests.test(msg="No downscale"):
+        prepared = prepare_mask(mask)
+        assert prepared.size == (40, 30)
+        assert prepared.source_size == (40, 30)
+        assert prepared.bbox == (10, 5, 30, 25)
+        assert prepared.opaque_pixels == 400
+
+    with subtests.test(msg="Fast downscale"):
+        prepared = prepare_mask(mask, downscale_factor=4, fast_downscale=True)
+        assert prepared.size == (10, 7)
+        assert prepared.source_size == (40, 30)
+        assert prepared.bbox == (2, 1, 8, 7)
+
+    image = random_rgba_image((50, 36), seed=6).convert("RGB")
+    for fast_downscale in (False, True):
+        with subtests.test(msg="Same result as the mask image", fast_downscale=fast_downscale):
+            prepared = prepare_mask(mask, downscale_factor=2, fast_downscale=fast_downscale)
+            expected = filters.mask_filter(image, mask, downscale_factor=2, fast_downscale=fast_downscale)
+            assert filters.mask_filter(image, prepared).tobytes() == expected.tobytes()
+
+
+def test_mask_cache(tmp_path, subtests):
+    """
+    Test Partitions:
+    Lookup: hit, miss because of a different factor, miss because the file changed
+    Eviction: least recently used mask is dropped
+    """
+    path = str(tmp_path / "mask.png")
+    Image.new("L", (20, 20), 255).save(path)
+    cache = MaskCache(max_size=2)
+
+    first = cache.get(path, downscale_factor=2)
+    with subtests.test(msg="Hit"):
+        assert cache.get(path, downscale_factor=2) is first
+
+    with subtests.test(msg="Different factor"):
+        second = cache.get(path, downscale_factor=4)
+        assert second is not first
+        assert second.size == (5, 5)
+
+    with subtests.test(msg="Least recently used is evicted"):
+        cache.get(path, downscale_factor=2)
+        cache.get(path, downscale_factor=1)
+        assert len(cache) == 2
+        assert cache.get(path, downscale_factor=2) is first
+        assert cache.get(path, downscale_factor=4) is not second
+
+    with subtests.test(msg="File changed"):
+        Image.new("L", (20, 20), 0).save(path)
+        stat = os.stat(path)
+        os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+        changed = cache.get(path, downscale_factor=2)
+        assert changed is not first
+        assert changed.opaque_pixels == 0
+
+
+def test_mask_row_spans_and_regions(subtests):
+    """
+    Test Partitions:
+    Rows: fully transparent, opaque pixels
+    Margin: 0, bigger than 0
+    """
+    mask = Image.new("L", (10, 8), 0)
+    mask.paste(255, (3, 2, 6, 4))
+    mask.putpixel((8, 5), 1)
+    prepared = prepare_mask(mask)
+
+    with subtests.test(msg="Row spans"):
+        assert prepared.row_spans.tolist() == [[0, 0], [0, 0], [3, 6], [3, 6], [0, 0], [8, 9], [0, 0], [0, 0]]
+
+    with subtests.test(msg="Regions without margin"):
+        assert prepared.regions(band_height=2) == [(2, 4, 3, 6), (4, 6, 8, 9)]
+
+    with subtests.test(msg="Regions with margin"):
+        assert prepared.regions(band_height=3, margin=1) == [(1, 4, 2, 7), (4, 7, 2, 10)]
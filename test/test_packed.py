@@ -0,0 +1,126 @@
+import pytest
+from PIL import Image, ImageDraw
+
+from cloudcoverindex import engine
+from cloudcoverindex.cloudcoverindex import CloudCoverApp
+from cloudcoverindex.masks import load_mask, prepare_mask
+from cloudcoverindex.packed import SegmentationFile, read_counts, save_segmentation, write_segmentation
+from test.test_cloudcoverindex import random_rgba_image
+
+
+def segmented_frame(size, seed=0):
+    mask = Image.new("L", size, 0)
+    ImageDraw.Draw(mask).ellipse((1, 1, size[0] - 2, size[1] - 2), fill=255)
+    prepared = prepare_mask(mask)
+    frame = random_rgba_image(size, seed=seed).convert("RGB")
+    return engine.segment(*engine.load_frame(frame, prepared)), prepared
+
+
+def test_segmentation_file(tmp_path, subtests):
+    """
+    Test Partitions:
+    Width: multiple of 8, not a multiple of 8
+    Height: multiple of the strip height, not a multiple, smaller than a strip
+    Compression: zlib, none
+    Band: array, image
+    """
+    for size in [(16, 12), (21, 10), (13, 5)]:
+        segmentation, mask = segmented_frame(size, seed=size[0])
+        expected = segmentation.to_image()
+        segmentations = {"array": segmentation,
+                         "image": engine.Segmentation(Image.fromarray(segmentation.band), mask.band,
+                                                      segmentation.cloud_pixels, segmentation.total_pixels)}
+        for compression in ("zlib", "none"):
+            for band_type, segmentation in segmentations.items():
+                path = str(tmp_path / ("%dx%d-%s-%s.cci" % (size + (compression, band_type))))
+                with subtests.test(msg="Size %dx%d, %s, %s band" % (size + (compression, band_type))):
+                    write_segmentation(path, segmentation, mask=mask, compression=compression, strip_height=4)
+                    assert read_counts(path) == (segmentation.cloud_pixels, segmentation.total_pixels)
+                    with SegmentationFile(path) as file:
+                        assert file.size == size
+                        assert file.compression == compression
+                        assert (file.cloud_pixels, file.total_pixels) == read_counts(path)
+                        assert file.to_image(mask).tobytes() == expected.tobytes()
+                        for top, bottom in [(0, size[1]), (1, 3), (3, 9), (size[1], size[1])]:
+                            bottom = min(bottom, size[1])
+                            rows = expected.getchannel("L").crop((0, top, size[0], bottom))
+                            assert file.band(top, bottom).tobytes() == rows.tobytes()
+
+
+def test_segmentation_file_mask_reference(tmp_path, subtests):
+    """
+    Test Partitions:
+    Mask: loaded from a file, unchanged file, changed file, prepared in memory
+    """
+    size = (24, 18)
+    mask_path = str(tmp_path / "mask.png")
+    mask_image = Image.new("L", size, 0)
+    ImageDraw.Draw(mask_image).ellipse((2, 2, 21, 15), fill=255)
+    mask_image.save(mask_path)
+    mask = load_mask(mask_path, downscale_factor=2)
+    frame = random_rgba_image(size, seed=3).convert("RGB")
+    segmentation = engine.segment(*engine.load_frame(frame, mask))
+    path = str(tmp_path / "frame.cci")
+    save_segmentation(segmentation, path, mask)
+
+    with subtests.test(msg="Unchanged mask file"):
+        with SegmentationFile(path) as file:
+            assert file.mask_reference.path == mask.path
+            assert file.mask_reference.downscale_factor == 2
+            assert file.to_image().tobytes() == segmentation.to_image().tobytes()
+
+    with subtests.test(msg="Changed mask file"):
+        Image.new("L", size, 255).save(mask_path)
+        with SegmentationFile(path) as file:
+            with pytest.raises(ValueError):
+                file.to_image()
+
+    with subtests.test(msg="Mask prepared in memory"):
+        segmentation, mask = segmented_frame(size)
+        save_segmentation(segmentation, path, mask)
+        with SegmentationFile(path) as file:
+            assert file.mask_reference.path is None
+            with pytest.raises(ValueError):
+                file.to_image()
+            assert file.to_image(mask).tobytes() == segmentation.to_image().tobytes()
+
+
+def test_segmentation_file_errors(tmp_path, subtests):
+    """
+    Test Partitions:
+    File: empty, another format, truncated, mask of another size
+    """
+    segmentation, mask = segmented_frame((16, 16))
+    path = str(tmp_path / "frame.cci")
+    write_segmentation(path, segmentation, mask=mask)
+    with open(path, "rb") as file:
+        data = file.read()
+
+    for name, contents in [("Empty", b""), ("Another format", b"\x89PNG" + data[4:]), ("Truncated", data[:-4])]:
+        with subtests.test(msg=name):
+            (tmp_path / "broken.cci").write_bytes(contents)
+            with pytest.raises(ValueError):
+                SegmentationFile(str(tmp_path / "broken.cci"))
+
+    with subtests.test(msg="Mask of another size"):
+        with SegmentationFile(path) as file:
+            with pytest.raises(ValueError):
+                file.to_image(prepare_mask(Image.new("L", (8, 8), 255)))
+
+
+def test_save_segmentation_file(tmp_path):
+    """
+    Test Partitions:
+    Saved by: CloudCoverApp, as png and as cci
+    """
+    image_path = str(tmp_path / "frame.jpg")
+    mask_path = str(tmp_path / "mask.png")
+    random_rgba_image((40, 30), seed=6).convert("RGB").save(image_path, "JPEG")
+    Image.new("L", (40, 30), 255).save(mask_path)
+    app = CloudCoverApp(image_path, mask_path)
+    app.save(str(tmp_path / "frame.png"))
+    app.save(str(tmp_path / "frame.cci"))
+    with SegmentationFile(str(tmp_path / "frame.cci")) as file:
+        assert (file.cloud_pixels, file.total_pixels) == app.get_pixel_counts()
+        with Image.open(str(tmp_path / "frame.png")) as expected:
+            assert file.to_image().tobytes() == expected.tobytes()
@@ -0,0 +1,99 @@
+import io
+
+import pytest
+from PIL import Image, ImageDraw
+
+from cloudcoverindex import engine, parallel
+from cloudcoverindex.cloudcoverindex import CloudCoverApp
+from cloudcoverindex.masks import load_mask, prepare_mask
+from cloudcoverindex.parallel import ParallelSegmenter, close_segmenters, segment_parallel, _split_regions
+from test.test_cloudcoverindex import random_rgba_image
+
+requires_shared_memory = pytest.mark.skipif(parallel.shared_memory is None,
+                                            reason="Shared memory requires python 3.8 or newer")
+
+
+@requires_shared_memory
+def test_parallel_segmenter(subtests):
+    """
+    Test Partitions:
+    Workers: 1, more than 1
+    Downscale factor: 1, 2, 3 (not dividing the mask)
+    Downscale: LANCZOS, fast
+    Frames: several with the same segmenter, in memory, JPEG not decoded yet, smaller than the window
+    """
+    mask = Image.new("L", (90, 70), 0)
+    ImageDraw.Draw(mask).ellipse((0, 5, 89, 69), fill=255)
+    images = [random_rgba_image((96, 72), seed=seed).convert("RGB") for seed in range(2)]
+    jpeg_data = io.BytesIO()
+    images[0].save(jpeg_data, "JPEG")
+    frames = [lambda image=image: image for image in images] + [lambda: Image.open(io.BytesIO(jpeg_data.getvalue()))]
+    for downscale_factor in (1, 2, 3):
+        for fast_downscale in (False, True):
+            prepared = prepare_mask(mask, downscale_factor=downscale_factor, fast_downscale=fast_downscale)
+            for workers in (1, 3):
+                with subtests.test(msg="Factor %d fast %s workers %d" % (downscale_factor, fast_downscale, workers)):
+                    with ParallelSegmenter(prepared, workers=workers) as segmenter:
+                        for frame in frames:
+                            expected = engine.segment(*engine.load_frame(frame(), prepared))
+                            result = segmenter.segment(frame())
+                            assert (result.band == expected.band).all()
+                            assert (result.cloud_pixels, result.total_pixels) == \
+                                (expected.cloud_pixels, expected.total_pixels)
+
+    with subtests.test(msg="Smaller than the window"):
+        image = random_rgba_image((4, 4), seed=1).convert("RGB")
+        small_mask = random_rgba_image((4, 4), seed=2).getchannel("A")
+        expected = engine.segment(*engine.load_frame(image, small_mask))
+        result = segment_parallel(image, small_mask, workers=2)
+        assert (result.band == expected.band).all()
+        assert (result.cloud_pixels, result.total_pixels) == (expected.cloud_pixels, expected.total_pixels)
+
+
+@requires_shared_memory
+def test_segment_parallel_reuses_segmenters(tmp_path, subtests):
+    """
+    Test Partitions:
+    Frames: several with the same mask, with another mask, through CloudCoverApp
+    """
+    mask_path = str(tmp_path / "mask.png")
+    image_path = str(tmp_path / "frame.png")
+    random_rgba_image((40, 30), seed=3).getchannel("A").save(mask_path)
+    random_rgba_image((44, 32), seed=4).convert("RGB").save(image_path)
+    close_segmenters()
+    try:
+        with subtests.test(msg="Same mask"):
+            mask = load_mask(mask_path)
+            image = Image.open(image_path).convert("RGB")
+            expected = engine.segment(*engine.load_frame(image, mask))
+            results = [segment_parallel(image, mask, workers=2) for _ in range(3)]
+            assert len(parallel._segmenters) == 1
+            for result in results:
+                assert (result.band == expected.band).all()
+                assert result.cloud_pixels == expected.cloud_pixels
+
+        with subtests.test(msg="CloudCoverApp"):
+            app = CloudCoverApp(image_path, mask_path, workers=2)
+            assert app.get_pixel_counts() == (expected.cloud_pixels, expected.total_pixels)
+            assert len(parallel._segmenters) == 1
+
+        with subtests.test(msg="Other masks"):
+            for factor in range(2, 2 + parallel.SEGMENTERS + 1):
+                segment_parallel(image, load_mask(mask_path, downscale_factor=factor), workers=2)
+            assert len(parallel._segmenters) == parallel.SEGMENTERS
+    finally:
+        close_segmenters()
+    assert len(parallel._segmenters) == 0
+
+
+def test_split_regions(subtests):
+    """
+    Test Partitions:
+    Workers: 1, as many as regions, more than regions
+    """
+    regions = [(top, top + 10, 0, width) for top, width in zip(range(0, 60, 10), (5, 20, 40, 40, 20, 5))]
+    for workers in (1, 6, 10):
+        with subtests.test(msg="Workers %d" % workers):
+            groups = _split_regions(regions, workers)
+            assert len(groups) <= workers
+            assert [region for group in groups for region in group] == regions
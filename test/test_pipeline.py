@@ -0,0 +1,31 @@
+from cloudcoverindex.batch import process_image
+from cloudcoverindex.masks import load_mask
+from cloudcoverindex.pipeline import run_pipeline
+from test.test_batch import write_batch_files
+
+
+def test_run_pipeline(tmp_path, subtests):
+    """
+    Test Partitions:
+    Queue depths: 1, bigger than the number of images
+    Save: saved, not saved, save fails
+    """
+    paths, mask_path = write_batch_files(tmp_path)
+    mask = load_mask(mask_path, downscale_factor=2)
+    expected = [process_image(path, mask) for path in paths]
+    save_paths = [str(tmp_path / ("seg%d.png" % i)) for i in range(len(paths))]
+    save_paths[1] = None
+    save_paths[3] = str(tmp_path / "missing" / "seg.png")
+
+    for depth in (1, 10):
+        with subtests.test(msg="Queue depth %d" % depth, depth=depth):
+            results = list(run_pipeline(paths, mask, save_paths=save_paths, decode_threads=2,
+                                        prefetch=depth, write_queue=depth))
+            assert [result.path for result in results] == paths
+            for i, (result, expected_result) in enumerate(zip(results, expected)):
+                if i in (2, 3):
+                    assert not result.ok
+                    continue
+                assert (result.cloud_pixels, result.total_pixels) == \
+                       (expected_result.cloud_pixels, expected_result.total_pixels)
+                assert result.save_path == save_paths[i]
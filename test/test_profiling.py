@@ -0,0 +1,91 @@
+import json
+
+from cloudcoverindex import filters
+from cloudcoverindex.batch import process_images
+from cloudcoverindex.cloudcoverindex import CloudCoverApp
+from cloudcoverindex import profiling
+from cloudcoverindex.profiling import Profiler, STAGES
+from test.test_batch import write_batch_files
+from test.test_cloudcoverindex import random_rgba_image
+
+
+def test_profiler(tmp_path, subtests):
+    """
+    Test Partitions:
+    Stages: single, repeated, nested
+    Memory: traced, not traced
+    Output: dictionary, JSON file
+    """
+    with Profiler() as profiler:
+        for _ in range(2):
+            with profiler.stage("outer"):
+                with profiler.stage("inner"):
+                    data = bytearray(1 << 20)
+                del data
+        with subtests.test(msg="Calls"):
+            assert profiler.stages["outer"].calls == 2
+            assert profiler.stages["inner"].calls == 2
+        with subtests.test(msg="Nested"):
+            assert profiler.stages["outer"].wall_time >= profiler.stages["inner"].wall_time
+            if profiling.MEASURES_PEAKS:
+                assert profiler.stages["inner"].peak_memory >= 1 << 20
+                assert profiler.stages["outer"].peak_memory >= profiler.stages["inner"].peak_memory
+        with subtests.test(msg="JSON"):
+            path = str(tmp_path / "profile.json")
+            profiler.write_json(path)
+            with open(path) as file:
+                assert json.load(file) == profiler.to_dict()
+            assert set(profiler.to_dict()["stages"]["inner"]) == {"calls", "wall_time", "cpu_time", "peak_memory"}
+
+    with subtests.test(msg="Not traced"):
+        profiler = Profiler(trace_memory=False)
+        with profiler.stage("stage"):
+            data = bytearray(1 << 20)
+            assert len(data) == 1 << 20
+        assert profiler.stages["stage"].peak_memory == 0
+
+
+def test_profiler_without_peaks(monkeypatch):
+    """
+    Test Partitions:
+    Memory: traced on a python without tracemalloc.reset_peak
+    """
+    monkeypatch.setattr(profiling, "MEASURES_PEAKS", False)
+    with Profiler() as profiler:
+        with profiler.stage("stage"):
+            data = bytearray(1 << 20)
+            assert len(data) == 1 << 20
+    assert profiler.stages["stage"].calls == 1
+    assert profiler.stages["stage"].peak_memory is None
+    assert profiler.to_dict()["stages"]["stage"]["peak_memory"] is None
+
+
+def test_profile_stages(tmp_path, subtests):
+    """
+    Test Partitions:
+    Entry point: CloudCoverApp, filters, process_images
+    """
+    paths, mask_path = write_batch_files(tmp_path)
+    with subtests.test(msg="CloudCoverApp"):
+        with Profiler() as profiler:
+            app = CloudCoverApp(paths[0], mask_path, downscale_factor=2, profiler=profiler)
+            app.save(str(tmp_path / "seg.png"))
+        assert set(profiler.stages) == set(STAGES)
+        assert app.get_pixel_counts() == CloudCoverApp(paths[0], mask_path, downscale_factor=2).get_pixel_counts()
+
+    for backend in ("numpy", "pillow"):
+        with subtests.test(msg="Filters", backend=backend):
+            profiler = Profiler(trace_memory=False)
+            image = random_rgba_image((24, 18))
+            image = filters.red_blue_filter(image, backend=backend, profiler=profiler)
+            image = filters.convolution_filter(image, backend=backend, profiler=profiler)
+            filters.count_cloud_pixels(image, backend=backend, profiler=profiler)
+            assert set(profiler.stages) == {"red_blue", "convolution", "select", "count"}
+
+    with subtests.test(msg="process_images"):
+        profiler = Profiler(trace_memory=False)
+        results = list(process_images(paths, mask_path, downscale_factor=2, jobs=2, profiler=profiler))
+        expected = list(process_images(paths, mask_path, downscale_factor=2))
+        assert [(result.cloud_pixels, result.error is None) for result in results] == \
+            [(result.cloud_pixels, result.error is None) for result in expected]
+        assert profiler.stages["count"].calls >= len(paths) - 1
@@ -0,0 +1,109 @@
+import numpy as np
+import pytest
+from PIL import Image
+
+from cloudcoverindex import engine
+from cloudcoverindex.batch import process_images
+from cloudcoverindex.cloudcoverindex import CloudCoverApp
+from cloudcoverindex.masks import prepare_mask
+from cloudcoverindex.rawframes import crop_frame, is_raw_frame_file, load_frame_file, open_raw_frame
+from cloudcoverindex.resultcache import ResultCache
+from test.test_cloudcoverindex import random_rgba_image
+
+
+def write_frames(tmp_path, size, seed=0):
+    # The same frame as a lossless image, a .npy frame and a raw frame
+    image = random_rgba_image(size, seed=seed).convert("RGB")
+    paths = {"png": str(tmp_path / "frame.png"), "npy": str(tmp_path / "frame.npy"),
+             "rgb": str(tmp_path / "frame.rgb")}
+    image.save(paths["png"])
+    np.save(paths["npy"], np.asarray(image))
+    np.asarray(image).tofile(paths["rgb"])
+    return image, paths
+
+
+def test_crop_frame(subtests):
+    """
+    Test Partitions:
+    Frame: bigger than the mask, same size as the mask
+    Downscale factor: 1, 2, 3
+    Downscale mode: LANCZOS, box
+    """
+    mask = random_rgba_image((37, 29), seed=1).getchannel("A")
+    for size in [(52, 41), (37, 29)]:
+        image = random_rgba_image(size, seed=2).convert("RGB")
+        rgb = np.asarray(image)
+        for factor in (1, 2, 3):
+            for fast_downscale in (False, True):
+                prepared = prepare_mask(mask, downscale_factor=factor, fast_downscale=fast_downscale)
+                with subtests.test(msg="Size %dx%d factor %d fast %s" % (size + (factor, fast_downscale))):
+                    expected, expected_alpha = engine.load_frame(image, prepared)
+                    result, alpha = crop_frame(rgb, prepared)
+                    assert (result == expected).all()
+                    assert (alpha == expected_alpha).all()
+                    if factor == 1:
+                        assert np.shares_memory(result, rgb)
+
+    with subtests.test(msg="Frame smaller than the mask"):
+        with pytest.raises(ValueError):
+            crop_frame(np.zeros((20, 20, 3), dtype=np.uint8), prepare_mask(mask))
+
+
+def test_open_raw_frame(tmp_path, subtests):
+    """
+    Test Partitions:
+    File: .npy frame, raw frame with its size, raw frame without a size, raw frame of another size,
+        .npy array of another type or shape
+    """
+    image, paths = write_frames(tmp_path, (23, 17))
+    for name in ("npy", "rgb"):
+        with subtests.test(msg="%s frame" % name):
+            rgb = open_raw_frame(paths[name], frame_size=image.size)
+            assert isinstance(rgb, np.memmap)
+            assert (rgb == np.asarray(image)).all()
+    with subtests.test(msg="Raw frame without a size"):
+        with pytest.raises(ValueError):
+            open_raw_frame(paths["rgb"])
+    with subtests.test(msg="Raw frame of another size"):
+        with pytest.raises(ValueError):
+            open_raw_frame(paths["rgb"], frame_size=(17, 23 + 1))
+    for name, array in [("type", np.zeros((17, 23, 3), dtype=np.uint16)), ("shape", np.zeros((17, 23), np.uint8))]:
+        with subtests.test(msg=".npy array of another %s" % name):
+            np.save(str(tmp_path / "other.npy"), array)
+            with pytest.raises(ValueError):
+                open_raw_frame(str(tmp_path / "other.npy"))
+
+
+def test_load_frame_file(tmp_path, subtests):
+    """
+    Test Partitions:
+    File: image decoded by pillow, .npy frame, raw frame, .npy extension without its magic, another extension
+    Loaded by: load_frame_file, CloudCoverApp, process_images with and without a cache
+    """
+    image, paths = write_frames(tmp_path, (40, 30), seed=3)
+    mask_path = str(tmp_path / "mask.png")
+    random_rgba_image((32, 26), seed=4).getchannel("A").save(mask_path)
+    prepared = prepare_mask(Image.open(mask_path), downscale_factor=2)
+    expected = load_frame_file(paths["png"], prepared)[0]
+    counts = CloudCoverApp(paths["png"], mask_path).get_pixel_counts()
+
+    for name in ("npy", "rgb"):
+        with subtests.test(msg="load_frame_file %s" % name):
+            assert (load_frame_file(paths[name], prepared, frame_size=image.size)[0] == expected).all()
+        with subtests.test(msg="CloudCoverApp %s" % name):
+            assert CloudCoverApp(paths[name], mask_path, frame_size=image.size).get_pixel_counts() == counts
+            with pytest.raises(ValueError):
+                CloudCoverApp(paths[name], mask_path, frame_size=image.size, tile_height=8)
+        with subtests.test(msg="process_images %s" % name):
+            with ResultCache(str(tmp_path / "cache.sqlite")) as cache:
+                for _ in range(2):
+                    result, = process_images([paths[name]], mask_path, cache=cache, frame_size=image.size)
+                    assert (result.cloud_pixels, result.total_pixels) == counts
+                assert result.cached
+
+    with subtests.test(msg="File checks"):
+        (tmp_path / "fake.npy").write_bytes(b"not a frame")
+        assert is_raw_frame_file(paths["npy"])
+        assert is_raw_frame_file(paths["rgb"])
+        assert not is_raw_frame_file(str(tmp_path / "fake.npy"))
+        assert not is_raw_frame_file(paths["png"])
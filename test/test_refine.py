@@ -0,0 +1,64 @@
+from PIL import Image, ImageDraw
+
+from cloudcoverindex import engine
+from cloudcoverindex.masks import prepare_mask
+from cloudcoverindex.refine import CoarseToFineSegmenter, get_segmenter, segment_refined
+from test.test_cloudcoverindex import random_rgba_image
+
+SKY = (60, 120, 220)
+CLOUD = (200, 200, 205)
+
+
+def test_coarse_to_fine_segmenter(subtests):
+    """
+    Test Partitions:
+    Frame: uniform sky, sky and a cloud, noise
+    Blocks: none refined, some refined, a single block covering the frame
+    Mask: fully opaque (refined blocks touch the border), circle
+    Coarse factor: 1, dividing the frame size, not dividing the frame size
+    """
+    size = (70, 54)
+    masks = {"opaque": Image.new("L", size, 255), "circle": Image.new("L", size, 0)}
+    ImageDraw.Draw(masks["circle"]).ellipse((3, 2, size[0] - 4, size[1] - 3), fill=255)
+    frames = {"sky": Image.new("RGB", size, SKY), "cloud": Image.new("RGB", size, SKY),
+              "noise": random_rgba_image(size, seed=4).convert("RGB")}
+    ImageDraw.Draw(frames["cloud"]).rectangle((33, 0, 69, 30), fill=CLOUD)
+    for name, mask in masks.items():
+        prepared = prepare_mask(mask)
+        for coarse_factor, block_size in [(1, 4), (2, 3), (4, 2), (4, 64)]:
+            segmenter = CoarseToFineSegmenter(prepared, coarse_factor=coarse_factor, block_size=block_size)
+            for frame_name, frame in frames.items():
+                if frame_name == "noise" and 1 < coarse_factor and block_size < 64:
+                    # Refined blocks are exact, the others only approximate noise
+                    continue
+                case = (name, coarse_factor, block_size, frame_name)
+                with subtests.test(msg="Mask %s factor %d block %d frame %s" % case):
+                    rgb, alpha = engine.load_frame(frame, prepared)
+                    expected = engine.segment(rgb, alpha)
+                    result = segmenter.segment(rgb)
+                    assert (result.band == expected.band).all()
+                    assert (result.cloud_pixels, result.total_pixels) == (expected.cloud_pixels,
+                                                                          expected.total_pixels)
+                    if frame_name == "sky":
+                        assert result.refined_fraction == 0
+                    elif frame_name == "cloud" and block_size < 64:
+                        assert 0 < result.refined_fraction < 1
+                    elif coarse_factor > 1:
+                        assert result.refined_fraction == 1
+
+    with subtests.test(msg="Coarse frame smaller than the window"):
+        prepared = prepare_mask(masks["circle"])
+        expected = engine.segment(*engine.load_frame(frames["noise"], prepared))
+        result = segment_refined(frames["noise"], prepared, coarse_factor=16)
+        assert (result.cloud_pixels, result.total_pixels) == (expected.cloud_pixels, expected.total_pixels)
+        assert result.refined_fraction == 1
+
+
+def test_get_segmenter():
+    """
+    Segmenters are shared by the frames of a mask, for every coarse factor.
+    """
+    prepared = prepare_mask(Image.new("L", (40, 30), 255))
+    assert get_segmenter(prepared, 2) is get_segmenter(prepared, 2)
+    assert get_segmenter(prepared, 2) is not get_segmenter(prepared, 4)
+    assert get_segmenter(prepared, 4).coarse_factor == 4
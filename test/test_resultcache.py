@@ -0,0 +1,84 @@
+from cloudcoverindex.batch import process_images
+from cloudcoverindex.resultcache import ResultCache, hash_file, result_key
+from test.test_batch import write_batch_files
+
+
+def test_result_cache(tmp_path, subtests):
+    """
+    Test Partitions:
+    Lookup: hit, miss
+    Persistence: results survive reopening the database
+    Eviction: least recently used results are dropped when the cache is full
+    """
+    path = str(tmp_path / "cache.sqlite")
+    with ResultCache(path, max_entries=10) as cache:
+        with subtests.test(msg="Miss"):
+            assert cache.get("a") is None
+        cache.put("a", 1, 2)
+        with subtests.test(msg="Hit"):
+            assert cache.get("a") == (1, 2)
+        cache.put("a", 3, 4)
+        with subtests.test(msg="Replace"):
+            assert cache.get("a") == (3, 4)
+            assert len(cache) == 1
+
+    with ResultCache(path, max_entries=10) as cache:
+        with subtests.test(msg="Reopened"):
+            assert cache.get("a") == (3, 4)
+        for i in range(9):
+            cache.put(str(i), i, 100)
+        cache.get("a")
+        cache.put("9", 9, 100)
+        with subtests.test(msg="Eviction"):
+            assert len(cache) <= 10
+            assert cache.get("a") == (3, 4)
+            assert cache.get("0") is None
+            assert cache.get("9") == (9, 100)
+
+
+def test_result_key(tmp_path, subtests):
+    """
+    Test Partitions:
+    Key parts: image, mask, downscale factor, filter parameters
+    """
+    image_path = str(tmp_path / "image.bin")
+    with open(image_path, "wb") as image:
+        image.write(b"image")
+    image_hash = hash_file(image_path)
+    key = result_key(image_hash, "mask", 4)
+    with subtests.test(msg="Same parts"):
+        assert result_key(image_hash, "mask", 4) == key
+    with subtests.test(msg="Different parts"):
+        assert result_key(image_hash, "other mask", 4) != key
+        assert result_key(image_hash, "mask", 2) != key
+        assert result_key(image_hash, "mask", 4, fast_downscale=True) != key
+        assert result_key(image_hash, "mask", 4, ratio_threshold=1.0) != key
+
+
+def test_process_images_with_cache(tmp_path, subtests):
+    """
+    Test Partitions:
+    Images: not cached, cached, broken, cached but saved
+    """
+    paths, mask_path = write_batch_files(tmp_path)
+    with ResultCache(str(tmp_path / "cache.sqlite")) as cache:
+        first = list(process_images(paths, mask_path, downscale_factor=2, cache=cache))
+        with subtests.test(msg="Nothing cached"):
+            assert not any(result.cached for result in first)
+            assert len(cache) == len(paths) - 1
+
+        second = list(process_images(paths, mask_path, downscale_factor=2, cache=cache))
+        with subtests.test(msg="Cached"):
+            assert [result.cached for result in second] == [True, True, False, True, True]
+            assert [(result.cloud_pixels, result.total_pixels) for result in second] == \
+                   [(result.cloud_pixels, result.total_pixels) for result in first]
+
+        save_paths = [None, str(tmp_path / "seg.png"), None, None, None]
+        third = list(process_images(paths, mask_path, downscale_factor=2, save_paths=save_paths, cache=cache))
+        with subtests.test(msg="Saved images are processed"):
+            assert not third[1].cached
+            assert third[1].save_path == save_paths[1]
+
+        fourth = list(process_images(paths, mask_path, downscale_factor=4, cache=cache))
+        with subtests.test(msg="Different factor"):
+            assert not any(result.cached for result in fourth)
@@ -0,0 +1,88 @@
+import numpy as np
+import pytest
+from PIL import Image, ImageDraw
+
+from cloudcoverindex import engine, sampling
+from cloudcoverindex.cloudcoverindex import CloudCoverApp
+from cloudcoverindex.masks import prepare_mask
+from test.test_cloudcoverindex import random_rgba_image
+
+
+def test_classify_points(subtests):
+    """
+    Test Partitions:
+    Mask: fully opaque (points at the border of the frame), circle
+    """
+    size = (30, 24)
+    masks = {"opaque": Image.new("L", size, 255), "circle": Image.new("L", size, 0)}
+    ImageDraw.Draw(masks["circle"]).ellipse((1, 1, size[0] - 2, size[1] - 2), fill=255)
+    for name, mask in masks.items():
+        with subtests.test(msg="Mask %s" % name):
+            prepared = prepare_mask(mask)
+            rgb, alpha = engine.load_frame(random_rgba_image(size, seed=9).convert("RGB"), prepared)
+            expected = engine.segment(rgb, alpha).band == 255
+            rows, columns = np.nonzero(np.ones(alpha.shape, dtype=bool))
+            result = sampling.classify_points(rgb, prepared.opaque, rows, columns)
+            assert (result.reshape(alpha.shape) == expected).all()
+
+
+def test_estimate_cloud_cover(subtests):
+    """
+    Test Partitions:
+    Stop: error bound, time budget, maximum number of samples
+    Mask: circle, fully transparent
+    """
+    size = (120, 100)
+    mask = Image.new("L", size, 0)
+    ImageDraw.Draw(mask).ellipse((5, 5, size[0] - 6, size[1] - 6), fill=255)
+    prepared = prepare_mask(mask)
+    rgb, alpha = engine.load_frame(random_rgba_image(size, seed=10).convert("RGB"), prepared)
+    segmentation = engine.segment(rgb, alpha)
+    exact = segmentation.cloud_pixels / segmentation.total_pixels
+
+    with subtests.test(msg="Error bound"):
+        estimate = sampling.estimate_cloud_cover(rgb, prepared, error_bound=0.02, seed=1)
+        assert estimate.error <= 0.02
+        assert estimate.lower <= exact <= estimate.upper
+
+    with subtests.test(msg="Time budget"):
+        estimate = sampling.estimate_cloud_cover(rgb, prepared, error_bound=None, time_budget=0, seed=1)
+        assert estimate.samples == sampling.ROUND_SIZE
+
+    with subtests.test(msg="Maximum number of samples"):
+        estimate = sampling.estimate_cloud_cover(rgb, prepared, error_bound=None, max_samples=700, seed=1)
+        assert estimate.samples == 700
+        assert estimate.lower <= estimate.cloud_cover_index <= estimate.upper
+
+    with subtests.test(msg="Transparent mask"):
+        transparent = prepare_mask(Image.new("L", size, 0))
+        with pytest.raises(ValueError):
+            sampling.estimate_cloud_cover(rgb, transparent)
+
+
+def test_estimate_cloud_cover_index(tmp_path):
+    """
+    CloudCoverApp estimates from a file are repeatable with a seed and close to the exact index.
+    """
+    path = str(tmp_path / "frame.jpg")
+    random_rgba_image((100, 80), seed=11).convert("RGB").save(path, quality=95)
+    mask = Image.new("L", (96, 76), 255)
+    prepared = prepare_mask(mask)
+    exact = CloudCoverApp(path, prepared).get_cloud_cover_index()
+    first = CloudCoverApp.estimate_cloud_cover_index(path, prepared, error_bound=0.03, seed=2)
+    second = CloudCoverApp.estimate_cloud_cover_index(path, prepared, error_bound=0.03, seed=2)
+    assert first.cloud_cover_index == second.cloud_cover_index
+    assert first.lower <= exact <= first.upper
+
+
+def test_normal_quantile(subtests):
+    """
+    Test Partitions:
+    Probability: usual confidence levels, invalid
+    """
+    for probability, expected in ((0.5, 0), (0.975, 1.959964), (0.995, 2.575829)):
+        with subtests.test(msg="Probability %g" % probability):
+            assert abs(sampling.normal_quantile(probability) - expected) < 1e-5
+    with subtests.test(msg="Invalid"):
+        with pytest.raises(ValueError):
+            sampling.normal_quantile(1)
@@ -0,0 +1,77 @@
+import numpy as np
+from PIL import Image, ImageDraw
+
+from cloudcoverindex import engine
+from cloudcoverindex.masks import prepare_mask
+from cloudcoverindex.sequence import SequenceProcessor
+from test.test_cloudcoverindex import random_rgba_image
+
+
+def sequence_frames(size):
+    first = random_rgba_image(size, seed=5).convert("RGB")
+    other = random_rgba_image(size, seed=6).convert("RGB")
+    patched = first.copy()
+    patched.paste(other.crop((20, 10, 33, 19)), (20, 10))
+    corner = patched.copy()
+    corner.paste(other.crop((0, 0, 6, 6)), (0, 0))
+    return [("first", first), ("unchanged", first), ("patch", patched), ("corner", corner), ("whole", other)]
+
+
+def test_sequence_processor(subtests):
+    """
+    Test Partitions:
+    Change: none, a patch, at the border of the frame, the whole frame
+    Tile size: smaller than the window margin, bigger than the image
+    Mask: fully opaque, circle
+    """
+    size = (60, 44)
+    masks = {"opaque": Image.new("L", size, 255), "circle": Image.new("L", size, 0)}
+    ImageDraw.Draw(masks["circle"]).ellipse((2, 2, size[0] - 3, size[1] - 3), fill=255)
+    for name, mask in masks.items():
+        prepared = prepare_mask(mask)
+        for tile_size in (1, 8, 100):
+            processor = SequenceProcessor(prepared, tile_size=tile_size)
+            for frame_name, frame in sequence_frames(size):
+                with subtests.test(msg="Mask %s tile size %d frame %s" % (name, tile_size, frame_name)):
+                    expected = engine.segment(*engine.load_frame(frame, prepared))
+                    result = processor.segment(frame)
+                    assert (result.band == expected.band).all()
+                    assert (result.cloud_pixels, result.total_pixels) == (expected.cloud_pixels,
+                                                                          expected.total_pixels)
+                    if frame_name == "unchanged":
+                        assert processor.changed_fraction == 0
+                    elif frame_name == "patch" and tile_size == 8:
+                        assert 0 < processor.changed_fraction < 0.5
+
+
+def test_sequence_processor_tolerance(subtests):
+    """
+    Test Partitions:
+    Tolerance: changes within it, changes beyond it
+    State: kept, reset
+    """
+    size = (40, 30)
+    prepared = prepare_mask(Image.new("L", size, 255))
+    rgb, _ = engine.load_frame(random_rgba_image(size, seed=7).convert("RGB"), prepared)
+    processor = SequenceProcessor(prepared, tile_size=8, tolerance=3)
+    first = processor.segment_array(rgb)
+    first_counts = (first.cloud_pixels, first.total_pixels)
+
+    with subtests.test(msg="Within the tolerance"):
+        noisy = rgb.astype(np.int16) + np.random.default_rng(0).integers(-3, 4, rgb.shape)
+        result = processor.segment_array(np.clip(noisy, 0, 255).astype(np.uint8))
+        assert processor.changed_fraction == 0
+        assert (result.cloud_pixels, result.total_pixels) == first_counts
+
+    with subtests.test(msg="Beyond the tolerance"):
+        changed = rgb.copy()
+        changed[:8, :8] = 255 - changed[:8, :8]
+        result = processor.segment_array(changed)
+        expected = engine.segment(changed, prepared.alpha)
+        assert processor.changed_fraction > 0
+        assert (result.cloud_pixels, result.total_pixels) == (expected.cloud_pixels, expected.total_pixels)
+
+    with subtests.test(msg="Reset"):
+        processor.reset()
+        processor.segment_array(rgb)
+        assert processor.changed_fraction == 1
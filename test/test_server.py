@@ -0,0 +1,121 @@
+import asyncio
+import multiprocessing
+import os
+
+import pytest
+
+from cloudcoverindex import server
+from cloudcoverindex.batch import process_images
+from cloudcoverindex.server import CloudCoverClient, CloudCoverServer, parse_address
+from test.test_batch import write_batch_files
+
+
+def test_parse_address(subtests):
+    """
+    Test Partitions:
+    Address: unix prefix, path, host and port, port only, invalid
+    """
+    with subtests.test(msg="Unix"):
+        assert parse_address("unix:cci.sock") == ("unix", "cci.sock")
+        assert parse_address("/tmp/cci.sock") == ("unix", "/tmp/cci.sock")
+    with subtests.test(msg="TCP"):
+        assert parse_address("localhost:8765") == ("tcp", ("localhost", 8765))
+        assert parse_address(":8765") == ("tcp", ("127.0.0.1", 8765))
+    with subtests.test(msg="Invalid"):
+        try:
+            parse_address("localhost")
+            assert False
+        except ValueError:
+            pass
+
+
+def test_server(tmp_path, subtests):
+    """
+    Test Partitions:
+    Request: path, image bytes, other downscale factor, broken image, invalid request
+    Concurrency: several requests batched together on a small queue
+    """
+    paths, mask_path = write_batch_files(tmp_path)
+    expected = [(result.cloud_pixels, result.total_pixels)
+                for result in process_images(paths, mask_path, downscale_factor=2)]
+    expected_factor_1 = [(result.cloud_pixels, result.total_pixels) for result in process_images(paths[:1], mask_path)]
+    address = str(tmp_path / "cci.sock")
+
+    async def run():
+        server = CloudCoverServer(mask_path, downscale_factor=2, workers=2, batch_size=3, queue_size=2)
+        await server.start(address)
+        client = await CloudCoverClient.connect(address)
+        try:
+            with subtests.test(msg="Path"):
+                response = await client.request(path=paths[0])
+                assert (response["cloud_pixels"], response["total_pixels"]) == expected[0]
+                assert response["cloud_cover_index"] == expected[0][0] / expected[0][1]
+            with subtests.test(msg="Image bytes"):
+                with open(paths[1], "rb") as image:
+                    response = await client.request(image=image.read())
+                assert (response["cloud_pixels"], response["total_pixels"]) == expected[1]
+            with subtests.test(msg="Downscale factor"):
+                response = await client.request(path=paths[0], downscale_factor=1)
+                assert (response["cloud_pixels"], response["total_pixels"]) == expected_factor_1[0]
+            with subtests.test(msg="Broken image"):
+                response = await client.request(path=paths[2])
+                assert "error" in response and "cloud_pixels" not in response
+            with subtests.test(msg="Invalid request"):
+                response = await client.request(path=paths[0], image=b"")
+                assert "error" in response
+                response = await client.request(path=paths[0], downscale_factor=0)
+                assert "error" in response
+            with subtests.test(msg="Concurrent"):
+                responses = await asyncio.gather(*[client.request(path=path) for path in paths * 3])
+                counts = [(response.get("cloud_pixels"), response.get("total_pixels")) for response in responses]
+                assert counts == expected * 3
+        finally:
+            await client.close()
+            await server.close()
+
+    loop = asyncio.new_event_loop()
+    try:
+        loop.run_until_complete(run())
+    finally:
+        loop.close()
+
+
+@pytest.mark.skipif(multiprocessing.get_start_method() != "fork",
+                    reason="The workers only see the patched module when they are forked")
+def test_server_worker_dies(tmp_path, monkeypatch):
+    """
+    Test Partitions:
+    Worker: dies in the middle of a batch more times than there are batch slots, then works again
+    """
+    paths, mask_path = write_batch_files(tmp_path)
+    expected = next(process_images(paths[:1], mask_path, downscale_factor=2))
+    address = str(tmp_path / "cci.sock")
+    process_item = server._process_item
+
+    def dying_process_item(source, *options):
+        if source.endswith("die"):
+            os._exit(1)
+        return process_item(source, *options)
+
+    monkeypatch.setattr(server, "_process_item", dying_process_item)
+
+    async def run():
+        cloud_cover_server = CloudCoverServer(mask_path, downscale_factor=2, workers=1, batch_size=1)
+        await cloud_cover_server.start(address)
+        client = await CloudCoverClient.connect(address)
+        try:
+            for _ in range(3):
+                response = await asyncio.wait_for(client.request(path="die"), 30)
+                assert "error" in response
+            response = await asyncio.wait_for(client.request(path=paths[0]), 30)
+            assert (response["cloud_pixels"], response["total_pixels"]) == (expected.cloud_pixels,
+                                                                            expected.total_pixels)
+        finally:
+            await client.close()
+            await cloud_cover_server.close()
+
+    loop = asyncio.new_event_loop()
+    try:
+        loop.run_until_complete(run())
+    finally:
+        loop.close()
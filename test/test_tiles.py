@@ -0,0 +1,55 @@
+from PIL import Image, ImageDraw
+
+from cloudcoverindex import engine, tiles
+from cloudcoverindex.masks import prepare_mask
+from test.test_cloudcoverindex import random_rgba_image
+
+
+def write_frame(tmp_path):
+    path = str(tmp_path / "frame.jpg")
+    random_rgba_image((100, 84), seed=3).convert("RGB").save(path, quality=95)
+    mask = Image.new("L", (96, 80), 0)
+    ImageDraw.Draw(mask).ellipse((4, 10, 90, 76), fill=255)
+    return path, mask
+
+
+def test_segment_tiled(tmp_path, subtests):
+    """
+    Test Partitions:
+    Downscale: none, LANCZOS with a factor dividing the mask size, fast downscale
+    Tile height: 1, smaller than the window, bigger than the image
+    Band: kept, not kept
+    """
+    path, mask = write_frame(tmp_path)
+    for downscale_factor, fast_downscale in [(1, False), (2, False), (4, False), (2, True), (4, True)]:
+        prepared = prepare_mask(mask, downscale_factor=downscale_factor, fast_downscale=fast_downscale)
+        expected = engine.segment(*engine.load_frame(Image.open(path), prepared), mask=prepared)
+        for tile_height in (1, 3, 10, 500):
+            with subtests.test(msg="Factor %d fast %s tile height %d" % (downscale_factor, fast_downscale,
+                                                                         tile_height)):
+                result = tiles.segment_tiled(Image.open(path), prepared, tile_height=tile_height)
+                assert result.to_image().tobytes() == expected.to_image().tobytes()
+                assert (result.cloud_pixels, result.total_pixels) == (expected.cloud_pixels, expected.total_pixels)
+
+    with subtests.test(msg="Band not kept"):
+        result = tiles.segment_tiled(Image.open(path), mask, tile_height=7, keep_band=False)
+        expected = engine.segment(*engine.load_frame(Image.open(path), mask))
+        assert result.band is None
+        assert (result.cloud_pixels, result.total_pixels) == (expected.cloud_pixels, expected.total_pixels)
+
+
+def test_segment_tiled_images(monkeypatch, tmp_path, subtests):
+    """
+    Test Partitions:
+    Backend: pillow, as used without numpy
+    Tile height: 1, bigger than the image
+    """
+    path, mask = write_frame(tmp_path)
+    prepared = prepare_mask(mask, downscale_factor=2)
+    expected = engine.segment(*engine.load_frame(Image.open(path), prepared), mask=prepared)
+    monkeypatch.setattr(tiles, "np", None)
+    for tile_height in (1, 500):
+        with subtests.test(msg="Tile height %d" % tile_height):
+            result = tiles.segment_tiled(Image.open(path), prepared, tile_height=tile_height)
+            assert result.to_image().tobytes() == expected.to_image().tobytes()
+            assert (result.cloud_pixels, result.total_pixels) == (expected.cloud_pixels, expected.total_pixels)
@@ -0,0 +1,71 @@
+import io
+import json
+import os
+import shutil
+
+from cloudcoverindex.batch import ImageProcessor, process_images
+from cloudcoverindex.watch import Checkpoint, FolderWatcher, process_ready
+from test.test_batch import write_batch_files
+
+
+def test_folder_watcher(tmp_path, subtests):
+    """
+    Test Partitions:
+    Files: new, still being written, settled, processed, not an image
+    """
+    directory = tmp_path / "images"
+    directory.mkdir()
+    with Checkpoint(str(tmp_path / "checkpoint")) as checkpoint:
+        watcher = FolderWatcher(str(directory), checkpoint, settle_time=2)
+        (directory / "a.jpg").write_bytes(b"a")
+        (directory / "notes.txt").write_bytes(b"b")
+        with subtests.test(msg="New file"):
+            assert watcher.poll(now=0) == []
+        (directory / "a.jpg").write_bytes(b"aa")
+        with subtests.test(msg="Still being written"):
+            assert watcher.poll(now=1) == []
+            assert watcher.poll(now=2) == []
+        with subtests.test(msg="Settled"):
+            assert watcher.poll(now=3) == [str(directory / "a.jpg")]
+        checkpoint.add("a.jpg")
+        with subtests.test(msg="Processed"):
+            assert watcher.poll(now=10) == []
+
+
+def test_process_ready(tmp_path, subtests):
+    """
+    Test Partitions:
+    Images: valid, broken
+    Run: first, restarted with the same checkpoint
+    """
+    paths, mask_path = write_batch_files(tmp_path)
+    directory = tmp_path / "images"
+    directory.mkdir()
+    for path in paths[:3]:
+        shutil.copy(path, str(directory))
+    expected = list(process_images(paths[:3], mask_path, downscale_factor=2))
+    checkpoint_path = str(tmp_path / "checkpoint")
+
+    with Checkpoint(checkpoint_path) as checkpoint, ImageProcessor(mask_path, downscale_factor=2) as processor:
+        watcher = FolderWatcher(str(directory), checkpoint, settle_time=0)
+        output = io.StringIO()
+        watcher.poll(now=0)
+        results = process_ready(watcher, processor, output, now=1)
+        with subtests.test(msg="First run"):
+            records = [json.loads(line) for line in output.getvalue().splitlines()]
+            saved = sorted(str(directory / os.path.basename(path)) for path in paths[:3])
+            assert sorted(record["path"] for record in records) == saved
+            counts = {os.path.basename(record["path"]): (record["cloud_pixels"], record["error"] is None)
+                      for record in records}
+            assert counts == {os.path.basename(result.path): (result.cloud_pixels, result.ok) for result in expected}
+            assert len(results) == 3 and len(checkpoint) == 3
+
+    shutil.copy(paths[3], str(directory))
+    with Checkpoint(checkpoint_path) as checkpoint, ImageProcessor(mask_path, downscale_factor=2, jobs=2) as processor:
+        watcher = FolderWatcher(str(directory), checkpoint, settle_time=0)
+        output = io.StringIO()
+        watcher.poll(now=0)
+        results = process_ready(watcher, processor, output, now=1)
+        with subtests.test(msg="Restarted"):
+            assert [result.path for result in results] == [str(directory / os.path.basename(paths[3]))]
+            assert len(checkpoint) == 4